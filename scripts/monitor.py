@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import argparse
+import base64
+import bisect
 import os
 import sys
 import json
@@ -10,15 +12,22 @@ import subprocess
 import threading
 import logging
 import uuid
+import zlib
 import fcntl
+import functools
 import hashlib
+import hmac
 import html as html_lib
+import io
 import re
 import select
 import shlex
+import socket
+import socketserver
+import struct
+import tempfile
 from datetime import datetime
-from typing import Any, Callable, Dict, List, Optional, Set
-import requests
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 from pathlib import Path
 
 VERSION = "5.3.4"
@@ -31,15 +40,70 @@ ENABLE_ROLLBACK = os.getenv('ENABLE_ROLLBACK', 'true').lower() == 'true'
 CLEANUP_OLD_IMAGES = os.getenv('CLEANUP', 'true').lower() == 'true'
 AUTO_UPDATE = os.getenv('AUTO_UPDATE', 'true').lower() == 'true'
 NOTIFY_ON_AVAILABLE_UPDATE = os.getenv('NOTIFY_ON_AVAILABLE_UPDATE', 'true').lower() == 'true'
+NOTIFY_DIGEST = os.getenv('NOTIFY_DIGEST', 'true').lower() == 'true'
+NOTIFY_DIGEST_CRITICAL_IMMEDIATE = os.getenv('NOTIFY_DIGEST_CRITICAL_IMMEDIATE', 'false').lower() == 'true'
+TELEGRAM_MESSAGE_LIMIT = 4096
 UPDATE_SOURCE = os.getenv('UPDATE_SOURCE', 'auto').strip().lower()
 CHECK_INTERVAL = max(int(os.getenv('POLL_INTERVAL', '1800') or '1800'), 30)
 INITIAL_CHECK_DELAY = max(int(os.getenv('INITIAL_CHECK_DELAY', '15') or '15'), 0)
 UPDATE_RETRY_BACKOFF = max(int(os.getenv('UPDATE_RETRY_BACKOFF', '1800') or '1800'), 60)
 REMOTE_JOB_PROCESSING_TIMEOUT = max(int(os.getenv('REMOTE_JOB_PROCESSING_TIMEOUT', '900') or '900'), 60)
+REMOTE_QUEUE_FALLBACK_POLL = max(int(os.getenv('REMOTE_QUEUE_FALLBACK_POLL', '15') or '15'), 1)
+REMOTE_WORKER_CONCURRENCY = max(int(os.getenv('REMOTE_WORKER_CONCURRENCY', '3') or '3'), 1)
+REMOTE_PROGRESS_EDIT_INTERVAL = max(int(os.getenv('REMOTE_PROGRESS_EDIT_INTERVAL', '2') or '2'), 1)
+REMOTE_JOB_TTL = max(int(os.getenv('REMOTE_JOB_TTL', '86400') or '86400'), 60)
+REMOTE_JOB_ARCHIVE_SIZE = max(int(os.getenv('REMOTE_JOB_ARCHIVE_SIZE', '100') or '100'), 1)
 REMOTE_CONTROL_MODE = os.getenv('REMOTE_CONTROL_MODE', 'auto').strip().lower()
 SSH_CONNECT_TIMEOUT = max(int(os.getenv('SSH_CONNECT_TIMEOUT', '15') or '15'), 5)
 SSH_COMMAND_TIMEOUT = max(int(os.getenv('SSH_COMMAND_TIMEOUT', '300') or '300'), 30)
 REMOTE_CACHE_TTL = max(int(os.getenv('REMOTE_CACHE_TTL', '15') or '15'), 5)
+REMOTE_REFRESH_INTERVAL = max(int(os.getenv('REMOTE_REFRESH_INTERVAL', '10') or '0'), 0)
+REMOTE_STALE_MAX_AGE = max(int(os.getenv('REMOTE_STALE_MAX_AGE', '600') or '600'), REMOTE_CACHE_TTL)
+SERVER_QUARANTINE_THRESHOLD = max(int(os.getenv('SERVER_QUARANTINE_THRESHOLD', '2') or '2'), 1)
+SERVER_QUARANTINE_BASE = max(int(os.getenv('SERVER_QUARANTINE_BASE', '15') or '15'), 1)
+SERVER_QUARANTINE_MAX = max(int(os.getenv('SERVER_QUARANTINE_MAX', '600') or '600'), SERVER_QUARANTINE_BASE)
+REMOTE_PING_TIMEOUT = max(int(os.getenv('REMOTE_PING_TIMEOUT', '8') or '8'), 2)
+REMOTE_DISCOVERY_TTL = max(int(os.getenv('REMOTE_DISCOVERY_TTL', '30') or '30'), 5)
+REMOTE_INVENTORY_COMPRESS = os.getenv('REMOTE_INVENTORY_COMPRESS', 'false').lower() == 'true'
+REMOTE_INVENTORY_FIELDS = [
+    field.strip() for field in os.getenv('REMOTE_INVENTORY_FIELDS', '').split(',') if field.strip()
+]
+REMOTE_RPC_SESSIONS = os.getenv('REMOTE_RPC_SESSIONS', 'true').lower() == 'true'
+RPC_FORWARD = os.getenv('RPC_FORWARD', 'true').lower() == 'true'
+AGENT_LISTEN = os.getenv('AGENT_LISTEN', '').strip()
+AGENT_TOKEN = os.getenv('AGENT_TOKEN', '').strip()
+AGENT_PORT = max(int(os.getenv('AGENT_PORT', '8765') or '8765'), 1)
+AGENT_POOL_SIZE = max(int(os.getenv('AGENT_POOL_SIZE', '8') or '8'), 1)
+TELEGRAM_GLOBAL_RATE = max(int(os.getenv('TELEGRAM_GLOBAL_RATE', '25') or '25'), 1)
+TELEGRAM_CHAT_RATE_PER_MINUTE = max(int(os.getenv('TELEGRAM_CHAT_RATE_PER_MINUTE', '60') or '60'), 1)
+OUTBOX_DEDUP_WINDOW = max(int(os.getenv('OUTBOX_DEDUP_WINDOW', '3600') or '3600'), 0)
+SSH_CONTROL_PERSIST = max(int(os.getenv('SSH_CONTROL_PERSIST', '600') or '0'), 0)
+SSH_CONTROL_DIR = Path(os.getenv('SSH_CONTROL_DIR', '/tmp/watchtower-monitor-ssh'))
+SSH_CONTROL_CHECK_INTERVAL = max(int(os.getenv('SSH_CONTROL_CHECK_INTERVAL', '60') or '60'), 10)
+ADAPTIVE_TIMEOUTS = os.getenv('ADAPTIVE_TIMEOUTS', 'true').lower() == 'true'
+ADAPTIVE_TIMEOUT_PERCENTILE = min(max(int(os.getenv('ADAPTIVE_TIMEOUT_PERCENTILE', '95') or '95'), 50), 100)
+ADAPTIVE_TIMEOUT_MARGIN = max(float(os.getenv('ADAPTIVE_TIMEOUT_MARGIN', '1.5') or '1.5'), 1.0)
+ADAPTIVE_TIMEOUT_MIN = max(int(os.getenv('ADAPTIVE_TIMEOUT_MIN', '20') or '20'), 5)
+ADAPTIVE_TIMEOUT_MAX = max(int(os.getenv('ADAPTIVE_TIMEOUT_MAX', '900') or '900'), ADAPTIVE_TIMEOUT_MIN)
+ADAPTIVE_PULL_TIMEOUT_MIN = max(int(os.getenv('ADAPTIVE_PULL_TIMEOUT_MIN', '120') or '120'), ADAPTIVE_TIMEOUT_MIN)
+READY_REGRESSION_FACTOR = max(float(os.getenv('READY_REGRESSION_FACTOR', '2.0') or '2.0'), 1.1)
+POST_UPDATE_OBSERVE_SECONDS = max(int(os.getenv('POST_UPDATE_OBSERVE_SECONDS', '0') or '0'), 0)
+PERF_BASELINE_SECONDS = max(int(os.getenv('PERF_BASELINE_SECONDS', '10') or '10'), 0)
+PERF_SAMPLE_INTERVAL = max(int(os.getenv('PERF_SAMPLE_INTERVAL', '5') or '5'), 1)
+PERF_WARMUP_SECONDS = max(int(os.getenv('PERF_WARMUP_SECONDS', '10') or '10'), 0)
+PERF_CPU_REGRESSION_FACTOR = max(float(os.getenv('PERF_CPU_REGRESSION_FACTOR', '2.0') or '2.0'), 1.0)
+PERF_CPU_MIN_DELTA = max(float(os.getenv('PERF_CPU_MIN_DELTA', '10') or '10'), 0.0)
+PERF_MEMORY_REGRESSION_FACTOR = max(float(os.getenv('PERF_MEMORY_REGRESSION_FACTOR', '1.5') or '1.5'), 1.0)
+PERF_MEMORY_MIN_DELTA_MB = max(int(os.getenv('PERF_MEMORY_MIN_DELTA_MB', '64') or '64'), 0)
+CGROUP_ROOT = Path(os.getenv('CGROUP_ROOT', '/sys/fs/cgroup'))
+BATCH_CONCURRENCY = max(int(os.getenv('BATCH_CONCURRENCY', '2') or '2'), 1)
+TOP_CONTAINER_LIMIT = max(int(os.getenv('TOP_CONTAINER_LIMIT', '10') or '10'), 1)
+READINESS_PROBE_TIMEOUT = max(int(os.getenv('READINESS_PROBE_TIMEOUT', '60') or '60'), 5)
+READINESS_PROBE_LABEL = 'watchtower-monitor.readiness'
+UPDATE_DEFER_WINDOW = max(int(os.getenv('UPDATE_DEFER_WINDOW', '0') or '0'), 0)
+UPDATE_DEFER_SAMPLE_INTERVAL = max(int(os.getenv('UPDATE_DEFER_SAMPLE_INTERVAL', '30') or '30'), 5)
+UPDATE_DEFER_QUIET_CPU = max(float(os.getenv('UPDATE_DEFER_QUIET_CPU', '1.0') or '1.0'), 0.0)
+UPDATE_DEFER_QUIET_NET_KBPS = max(float(os.getenv('UPDATE_DEFER_QUIET_NET_KBPS', '4') or '4'), 0.0)
 
 if UPDATE_SOURCE not in {'auto', 'independent', 'watchtower'}:
     UPDATE_SOURCE = 'independent'
@@ -52,10 +116,18 @@ MONITOR_CONFIG = DATA_DIR / "monitor_config.json"
 SERVER_REGISTRY = DATA_DIR / "server_registry.json"
 UPDATE_STATE_FILE = DATA_DIR / "update_state.json"
 COMMAND_QUEUE_FILE = DATA_DIR / "command_queue.json"
+REMOTE_JOB_DEFAULT_PRIORITY = 5
+REMOTE_JOB_PRIORITIES = {
+    'interactive': 0,
+    'scheduled': 10,
+}
 
-DATA_DIR.mkdir(parents=True, exist_ok=True)
 LOCK_DIR = DATA_DIR / 'locks'
-LOCK_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def ensure_data_dirs():
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    LOCK_DIR.mkdir(parents=True, exist_ok=True)
 
 
 def sanitize_file_component(value: str) -> str:
@@ -129,7 +201,7 @@ def parse_remote_servers_config(raw_value: str) -> Dict[str, Dict[str, Any]]:
             continue
 
         transport = str(item.get('transport') or 'ssh').strip().lower()
-        if transport not in {'ssh', 'queue'}:
+        if transport not in {'ssh', 'queue', 'agent'}:
             transport = 'ssh'
 
         port_value = item.get('port', 22)
@@ -160,6 +232,16 @@ def parse_remote_servers_config(raw_value: str) -> Dict[str, Dict[str, Any]]:
             logger.warning(f'远程服务器 {name} 缺少 host，已忽略 SSH 配置')
             continue
 
+        url = str(item.get('url') or '').strip().rstrip('/')
+        if transport == 'agent' and not url:
+            if not host:
+                logger.warning(f'远程服务器 {name} 缺少 url/host，已忽略 Agent 配置')
+                continue
+            url = f"http://{host}:{int(item.get('agent_port') or AGENT_PORT)}"
+        token = str(item.get('token') or os.getenv(str(item.get('token_env') or 'AGENT_TOKEN'), '')).strip()
+        if transport == 'agent' and not token:
+            logger.warning(f'远程服务器 {name} 未配置 Agent token，请求将被拒绝')
+
         remote_servers[name] = {
             'name': name,
             'transport': transport,
@@ -179,15 +261,212 @@ def parse_remote_servers_config(raw_value: str) -> Dict[str, Dict[str, Any]]:
             'docker_bin': str(item.get('docker_bin') or 'docker').strip(),
             'python_bin': str(item.get('python_bin') or 'python3').strip(),
             'rpc_path': str(item.get('rpc_path') or '/app/monitor.py').strip(),
+            'url': url,
+            'token': token,
         }
 
     return remote_servers
 
 
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+BYTE_UNITS = {
+    'b': 1,
+    'kb': 1000,
+    'kib': 1024,
+    'mb': 1000 ** 2,
+    'mib': 1024 ** 2,
+    'gb': 1000 ** 3,
+    'gib': 1024 ** 3,
+    'tb': 1000 ** 4,
+    'tib': 1024 ** 4,
+}
+
+
+def parse_byte_size(value: str) -> int:
+    match = re.match(r'^\s*([0-9.]+)\s*([A-Za-z]*)\s*$', value or '')
+    if not match:
+        return 0
+    unit = BYTE_UNITS.get((match.group(2) or 'b').lower(), 1)
+    return int(float(match.group(1)) * unit)
+
+
+def format_byte_size(value: float) -> str:
+    size = float(value or 0)
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024:
+            return f'{size:.1f}{unit}'
+        size /= 1024
+    return f'{size:.1f}TiB'
+
+
+STEP_LABELS = {
+    'pull': '拉取',
+    'start': '启动',
+    'compose_up': '重建',
+    'ready': '就绪',
+    'probe': '探测',
+    'restart': '重启',
+}
+
+
+def format_step_timings(timings: Dict[str, float]) -> str:
+    parts = [
+        f"{STEP_LABELS.get(step, step)} {float(duration):.1f}s"
+        for step, duration in timings.items()
+    ]
+    return ' · '.join(parts)
+
+
+UPDATE_SCHEDULE_REASONS = {
+    'quiet': '负载低于阈值',
+    'quietest': '窗口内最安静时刻',
+    'deadline': '窗口截止',
+}
+
+
+def format_update_schedule(schedule: Dict[str, Any]) -> str:
+    decided_at = datetime.fromtimestamp(schedule.get('decided_at') or time.time()).strftime('%H:%M:%S')
+    reason = UPDATE_SCHEDULE_REASONS.get(schedule.get('reason'), schedule.get('reason') or '')
+    text = f"{decided_at} · {reason} · 等待 {schedule.get('waited', 0):.0f}s"
+
+    load = []
+    if schedule.get('cpu_percent') is not None:
+        load.append(f"CPU {schedule['cpu_percent']:.1f}%")
+    if schedule.get('net_kbps') is not None:
+        load.append(f"网络 {schedule['net_kbps']:.1f}KB/s")
+    if load:
+        text += f"\n  当时负载: {' · '.join(load)}"
+    if schedule.get('samples'):
+        text += (
+            f"\n  窗口峰值: CPU {schedule.get('peak_cpu', 0):.1f}% · "
+            f"网络 {schedule.get('peak_net_kbps', 0):.1f}KB/s ({schedule['samples']} 次采样)"
+        )
+    return text
+
+
+def parse_probe_spec(spec: Any) -> Optional[Dict[str, Any]]:
+    if not spec:
+        return None
+
+    if isinstance(spec, dict):
+        probe_type = str(spec.get('type') or '').strip().lower()
+        if probe_type == 'http' and spec.get('url'):
+            expected = spec.get('expected_status')
+            return {
+                'type': 'http',
+                'url': str(spec['url']),
+                'expected_status': int(expected) if expected else None,
+            }
+        if probe_type == 'tcp' and spec.get('port'):
+            return {
+                'type': 'tcp',
+                'host': str(spec.get('host') or '127.0.0.1'),
+                'port': int(spec['port']),
+            }
+        if probe_type == 'log' and spec.get('pattern'):
+            return {'type': 'log', 'pattern': str(spec['pattern'])}
+        return None
+
+    text = str(spec).strip()
+    if text.startswith(('http://', 'https://')):
+        return {'type': 'http', 'url': text, 'expected_status': None}
+    if text.startswith('tcp://'):
+        host, _, port = text[len('tcp://'):].rpartition(':')
+        if not port.isdigit():
+            return None
+        return {'type': 'tcp', 'host': host or '127.0.0.1', 'port': int(port)}
+    if text.startswith('log:'):
+        return {'type': 'log', 'pattern': text[len('log:'):]}
+    return None
+
+
+def parse_readiness_probes_config(raw_value: str) -> Dict[str, Dict[str, Any]]:
+    if not raw_value.strip():
+        return {}
+
+    try:
+        data = json.loads(raw_value)
+    except Exception as exc:
+        logger.warning(f'READINESS_PROBES_JSON 解析失败，已忽略: {exc}')
+        return {}
+
+    if not isinstance(data, dict):
+        logger.warning('READINESS_PROBES_JSON 必须为 JSON 对象，已忽略')
+        return {}
+
+    probes = {}
+    for container, spec in data.items():
+        try:
+            probe = parse_probe_spec(spec)
+        except (TypeError, ValueError):
+            probe = None
+        if probe:
+            probes[str(container)] = probe
+        else:
+            logger.warning(f'容器 {container} 的就绪探测配置无效，已忽略')
+    return probes
+
+
 def escape_html(value: Any) -> str:
     return html_lib.escape(str(value), quote=False)
 
 
+def render_update_diagnostics(result: Optional[Dict[str, Any]]) -> str:
+    result = result or {}
+    section = ''
+    timings = result.get('timings')
+    if timings:
+        section += f"\n⏱️ <b>步骤耗时</b>\n  <code>{escape_html(format_step_timings(timings))}</code>\n"
+    probe = result.get('probe')
+    if probe and probe.get('success'):
+        probe_text = f"{probe.get('type')} {probe.get('target')}"
+        if probe.get('latency_ms') is not None:
+            probe_text += f" · 首次响应 {probe['latency_ms']:.0f}ms"
+        section += f"\n🩺 <b>就绪探测</b>\n  <code>{escape_html(probe_text)}</code>\n"
+    if result.get('timing_alert'):
+        section += f"\n⚠️ <b>耗时告警</b>\n  {escape_html(result['timing_alert'])}\n"
+    schedule = result.get('schedule')
+    if schedule:
+        section += f"\n🕰️ <b>更新时机</b>\n  <code>{escape_html(format_update_schedule(schedule))}</code>\n"
+    return section
+
+
+def split_message_blocks(title: str, blocks: List[str], footer: str = '',
+                         limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    separator = '━━━━━━━━━━━━━━━━━━━━'
+    # 预留标题、分页标记、分隔线和页脚的长度
+    budget = max(limit - len(title) - len(footer) - len(separator) * 2 - 32, 200)
+    chunks: List[List[str]] = [[]]
+    size = 0
+    for block in blocks:
+        if len(block) > budget:
+            block = block[:budget - 1] + '…'
+        if chunks[-1] and size + len(block) + 2 > budget:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(block)
+        size += len(block) + 2
+
+    messages = []
+    for index, chunk in enumerate(chunks, 1):
+        page = f' ({index}/{len(chunks)})' if len(chunks) > 1 else ''
+        body = '\n\n'.join(chunk)
+        message = f'{title}{page}\n\n{separator}\n{body}\n{separator}'
+        if footer:
+            message += f'\n\n{footer}'
+        messages.append(message)
+    return messages
+
+
 def strip_html(value: str) -> str:
     return html_lib.unescape(re.sub(r'<[^>]+>', '', value))
 
@@ -198,16 +477,36 @@ def container_lock_path(container: str) -> Path:
 
 SERVER_FILE_KEY = sanitize_file_component(SERVER_NAME or 'default')
 HEALTH_FILE = DATA_DIR / f"health_status.{SERVER_FILE_KEY}.json"
+UPDATE_JOURNAL_FILE = DATA_DIR / f"update_journal.{SERVER_FILE_KEY}.json"
+NOTIFICATION_OUTBOX_FILE = DATA_DIR / f"notification_outbox.{SERVER_FILE_KEY}.jsonl"
+STEP_TIMINGS_FILE = DATA_DIR / f"step_timings.{SERVER_FILE_KEY}.json"
+INVENTORY_REVISIONS_FILE = DATA_DIR / f"inventory_revisions.{SERVER_FILE_KEY}.json"
+RPC_CONTROL_SOCKET = Path(os.getenv('RPC_CONTROL_SOCKET') or DATA_DIR / f"control.{SERVER_FILE_KEY}.sock")
 STATIC_MONITORED_CONTAINERS = parse_container_list(os.getenv('MONITORED_CONTAINERS', ''))
 
-logging.basicConfig(
-   level=logging.INFO,
-   format='[%(asctime)s] %(levelname)s: %(message)s',
-   datefmt='%H:%M:%S'
-)
+REMOTE_SERVERS_JSON = os.getenv('REMOTE_SERVERS_JSON', '')
+READINESS_PROBES_JSON = os.getenv('READINESS_PROBES_JSON', '')
+
 logger = logging.getLogger(__name__)
 
-REMOTE_SERVER_CONFIGS = parse_remote_servers_config(os.getenv('REMOTE_SERVERS_JSON', ''))
+
+def configure_logging():
+    logging.basicConfig(
+       level=logging.INFO,
+       format='[%(asctime)s] %(levelname)s: %(message)s',
+       datefmt='%H:%M:%S'
+    )
+
+
+# 导入时只读取原始配置，首次使用时再解析，rpc 短命令不做无关的解析和告警
+@functools.lru_cache(maxsize=None)
+def remote_server_configs() -> Dict[str, Dict[str, Any]]:
+    return parse_remote_servers_config(REMOTE_SERVERS_JSON)
+
+
+@functools.lru_cache(maxsize=None)
+def readiness_probes() -> Dict[str, Dict[str, Any]]:
+    return parse_readiness_probes_config(READINESS_PROBES_JSON)
 
 shutdown_flag = threading.Event()
 
@@ -410,6 +709,104 @@ def build_inventory_payload(server_name: str, docker: 'DockerManager',
         'containers': containers,
     }
 
+INVENTORY_VOLATILE_FIELDS = {'last_checked_at'}
+
+
+def hash_json(value: Any) -> str:
+    encoded = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+def project_inventory(payload: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    if not fields:
+        return payload
+    projected = dict(payload)
+    projected['containers'] = {
+        name: {key: value for key, value in info.items() if key in fields}
+        for name, info in payload.get('containers', {}).items()
+    }
+    projected['fields'] = list(fields)
+    return projected
+
+
+def compute_inventory_revision(payload: Dict[str, Any]) -> Tuple[str, Dict[str, str]]:
+    container_hashes = {
+        name: hash_json({key: value for key, value in info.items() if key not in INVENTORY_VOLATILE_FIELDS})
+        for name, info in payload.get('containers', {}).items()
+    }
+    revision = hash_json({
+        'containers': container_hashes,
+        'mode': payload.get('mode'),
+        'total_containers': payload.get('total_containers'),
+        'monitored_containers': payload.get('monitored_containers'),
+        'excluded_containers': payload.get('excluded_containers'),
+        'static_monitored_containers': payload.get('static_monitored_containers'),
+        'fields': payload.get('fields'),
+    })
+    return revision, container_hashes
+
+
+def build_inventory_delta(payload: Dict[str, Any], since: str, previous_hashes: Dict[str, str],
+                          container_hashes: Dict[str, str]) -> Dict[str, Any]:
+    delta = dict(payload)
+    delta['delta'] = True
+    delta['base_revision'] = since
+    delta['containers'] = {
+        name: info for name, info in payload.get('containers', {}).items()
+        if previous_hashes.get(name) != container_hashes.get(name)
+    }
+    delta['removed_containers'] = sorted(set(previous_hashes) - set(container_hashes))
+    return delta
+
+
+def merge_inventory_delta(base: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    removed = set(delta.get('removed_containers', []))
+    containers = {}
+    for name, info in base.get('containers', {}).items():
+        if name in removed:
+            continue
+        info = dict(info)
+        if 'last_checked_at' in info:
+            info['last_checked_at'] = delta.get('collected_at', info['last_checked_at'])
+        containers[name] = info
+    containers.update(delta.get('containers', {}))
+
+    merged = {key: value for key, value in delta.items() if key not in {'delta', 'base_revision', 'removed_containers'}}
+    merged['containers'] = containers
+    return merged
+
+
+def compress_rpc_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    encoded = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return {
+        'ok': payload.get('ok', False),
+        'encoding': 'zlib+base64',
+        'data': base64.b64encode(zlib.compress(encoded, 6)).decode('ascii'),
+    }
+
+
+def decode_rpc_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    if payload.get('encoding') != 'zlib+base64':
+        return payload
+    return json.loads(zlib.decompress(base64.b64decode(payload['data'])).decode('utf-8'))
+
+
+def build_top_payload(server_name: str, docker: 'DockerManager', limit: int = TOP_CONTAINER_LIMIT) -> Dict[str, Any]:
+    usage = docker.get_resource_usage()
+    containers = sorted(
+        usage['containers'],
+        key=lambda item: (item.get('cpu_percent', 0), item.get('memory_bytes', 0)),
+        reverse=True
+    )
+    return {
+        'ok': True,
+        'server_name': server_name,
+        'source': usage['source'],
+        'total_containers': len(containers),
+        'containers': containers[:limit],
+        'collected_at': time.time(),
+    }
+
 class HealthReporter:
     def __init__(self, health_file: Path, server_name: str):
         self.health_file = health_file
@@ -480,174 +877,1138 @@ class UpdateStateManager:
 
         safe_update_json(self.state_file, updater, default={})
 
+class UpdateJournal:
+    ACTIVE_STATES = ('planned', 'backup_tagged', 'pulled', 'stopped', 'removed', 'started')
+    TERMINAL_STATES = ('healthy', 'rolled_back', 'failed', 'skipped')
+
+    def __init__(self, journal_file: Path, retention: int = 7 * 86400):
+        self.journal_file = journal_file
+        self.retention = retention
+
+    def _prune(self, operations: Dict[str, Dict], now: float):
+        cutoff = now - self.retention
+        for op_id in list(operations.keys()):
+            record = operations[op_id]
+            if record.get('state') in self.TERMINAL_STATES and float(record.get('updated_at', 0) or 0) < cutoff:
+                operations.pop(op_id, None)
+
+    def _env_file(self, op_id: str) -> Path:
+        return self.journal_file.with_name(f'{self.journal_file.stem}.env') / f'{op_id}.json'
+
+    def _store_env(self, op_id: str, env: List[str]) -> bool:
+        env_file = self._env_file(op_id)
+        try:
+            env_file.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            fd = os.open(env_file, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as handle:
+                json.dump(env, handle, ensure_ascii=False)
+            return True
+        except OSError as exc:
+            logger.error(f'写入更新日志环境变量失败: {op_id} -> {exc}')
+            return False
+
+    def _with_env(self, record: Dict) -> Dict:
+        config = record.get('container_config')
+        if not config or not record.get('env_stored'):
+            return record
+        try:
+            env = json.loads(self._env_file(record['id']).read_text(encoding='utf-8'))
+        except (OSError, ValueError) as exc:
+            # 环境变量丢失时不能用残缺配置重建容器，按缺少配置处理
+            logger.error(f'读取更新日志环境变量失败: {record.get("id")} -> {exc}')
+            record['container_config'] = {}
+            return record
+        config = dict(config)
+        config['Config'] = dict(config.get('Config') or {}, Env=env)
+        record['container_config'] = config
+        return record
+
+    def begin(self, container: str, mode: str, details: Dict[str, Any]) -> Optional[str]:
+        op_id = f"{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}"
+        now = time.time()
+        record = dict(details)
+        config = record.get('container_config')
+        if config:
+            # 环境变量常含密钥，不写入共享数据目录中的日志，单独以 0600 权限保存
+            config = dict(config)
+            config_section = dict(config.get('Config') or {})
+            env = config_section.pop('Env', None)
+            config['Config'] = config_section
+            if env:
+                if self._store_env(op_id, env):
+                    record['env_stored'] = True
+                else:
+                    config = {}
+            record['container_config'] = config
+        record.update({
+            'id': op_id,
+            'container': container,
+            'mode': mode,
+            'state': 'planned',
+            'created_at': now,
+            'updated_at': now,
+            'history': [{'state': 'planned', 'at': now}],
+        })
+
+        def updater(data: Dict) -> Dict:
+            operations = data.setdefault('operations', {})
+            operations[op_id] = record
+            self._prune(operations, now)
+            return data
+
+        if safe_update_json(self.journal_file, updater, default={}) is None:
+            logger.error(f'写入更新日志失败: {container}')
+            return None
+        return op_id
+
+    def advance(self, op_id: Optional[str], state: str, **details: Any):
+        if not op_id:
+            return
+
+        def updater(data: Dict) -> Dict:
+            record = data.setdefault('operations', {}).get(op_id)
+            if record is None:
+                return data
+            now = time.time()
+            record.update(details)
+            record['state'] = state
+            record['updated_at'] = now
+            record.setdefault('history', []).append({'state': state, 'at': now})
+            if state in self.TERMINAL_STATES:
+                record.pop('container_config', None)
+                record.pop('env_stored', None)
+            return data
+
+        if safe_update_json(self.journal_file, updater, default={}) is None:
+            logger.error(f'更新日志状态写入失败: {op_id} -> {state}')
+        elif state in self.TERMINAL_STATES:
+            self._env_file(op_id).unlink(missing_ok=True)
+
+    def get_operation(self, op_id: str) -> Dict:
+        data = safe_read_json(self.journal_file, default={})
+        return dict(data.get('operations', {}).get(op_id, {}))
+
+    def get_incomplete(self) -> List[Dict]:
+        data = safe_read_json(self.journal_file, default={})
+        operations = data.get('operations', {})
+        incomplete = [
+            self._with_env(dict(record)) for record in operations.values()
+            if record.get('state') in self.ACTIVE_STATES
+        ]
+        return sorted(incomplete, key=lambda record: float(record.get('created_at', 0) or 0))
+
+class StepTimingStore:
+    def __init__(self, timing_file: Path, max_samples: int = 20, min_samples: int = 3):
+        self.timing_file = timing_file
+        self.max_samples = max_samples
+        self.min_samples = min_samples
+
+    def get_samples(self, container: str, step: str, include_censored: bool = False) -> List[float]:
+        data = safe_read_json(self.timing_file, default={})
+        values = []
+        for value in data.get(container, {}).get(step, []):
+            if isinstance(value, (int, float)):
+                values.append(float(value))
+            elif include_censored and isinstance(value, dict) and isinstance(value.get('min'), (int, float)):
+                # 超时样本只知道耗时下界，按下界计入，学到的超时不会低于曾经不够用的值
+                values.append(float(value['min']))
+        return values
+
+    def record(self, container: str, step: str, duration: float, censored: bool = False):
+        def updater(data: Dict) -> Dict:
+            steps = data.setdefault(container, {})
+            samples = steps.setdefault(step, [])
+            samples.append({'min': round(duration, 2)} if censored else round(duration, 2))
+            steps[step] = samples[-self.max_samples:]
+            return data
+
+        safe_update_json(self.timing_file, updater, default={})
+
+    def timeout_for(self, container: str, step: str, default: int) -> int:
+        samples = self.get_samples(container, step, include_censored=True)
+        if len(samples) < self.min_samples:
+            return default
+
+        lower = ADAPTIVE_PULL_TIMEOUT_MIN if step == 'pull' else ADAPTIVE_TIMEOUT_MIN
+        learned = percentile(samples, ADAPTIVE_TIMEOUT_PERCENTILE) * ADAPTIVE_TIMEOUT_MARGIN
+        return int(min(max(learned, lower), ADAPTIVE_TIMEOUT_MAX))
+
+    def check_regression(self, container: str, step: str, duration: float) -> Optional[str]:
+        samples = self.get_samples(container, step)
+        if len(samples) < self.min_samples:
+            return None
+
+        baseline = percentile(samples, 50)
+        if duration > baseline * READY_REGRESSION_FACTOR and duration - baseline > 5:
+            return (
+                f'{STEP_LABELS.get(step, step)}耗时 {duration:.1f}s，'
+                f'明显慢于历史中位数 {baseline:.1f}s'
+            )
+        return None
+
+
+class InventoryRevisionStore:
+    def __init__(self, revisions_file: Path, max_revisions: int = 16):
+        self.revisions_file = revisions_file
+        self.max_revisions = max_revisions
+
+    def get(self, revision: str) -> Optional[Dict[str, str]]:
+        data = safe_read_json(self.revisions_file, default={})
+        entry = data.get('revisions', {}).get(revision)
+        return dict(entry['containers']) if entry else None
+
+    def record(self, revision: str, container_hashes: Dict[str, str]):
+        def updater(data: Dict) -> Dict:
+            revisions = data.setdefault('revisions', {})
+            entry = revisions.setdefault(revision, {'containers': container_hashes})
+            entry['seen_at'] = time.time()
+            if len(revisions) > self.max_revisions:
+                ordered = sorted(revisions, key=lambda key: float(revisions[key].get('seen_at', 0) or 0))
+                for key in ordered[:len(revisions) - self.max_revisions]:
+                    revisions.pop(key, None)
+            return data
+
+        safe_update_json(self.revisions_file, updater, default={})
+
+
+class QuietMomentPlanner:
+    EXPLORE_RATIO = 0.37
+
+    def __init__(self, window: int, interval: int, quiet_cpu: float, quiet_net_kbps: float):
+        self.window = window
+        self.interval = interval
+        self.quiet_cpu = quiet_cpu
+        self.quiet_net_kbps = quiet_net_kbps
+
+    def score(self, sample: Dict[str, Any]) -> float:
+        cpu = sample.get('cpu_percent') or 0.0
+        net = sample.get('net_kbps') or 0.0
+        return cpu / max(self.quiet_cpu, 0.1) + net / max(self.quiet_net_kbps, 0.1)
+
+    def is_quiet(self, sample: Dict[str, Any]) -> bool:
+        return (
+            (sample.get('cpu_percent') or 0.0) <= self.quiet_cpu
+            and (sample.get('net_kbps') or 0.0) <= self.quiet_net_kbps
+        )
+
+    def wait(self, sample_fn: Callable[[], Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        started_at = time.time()
+        deadline = started_at + self.window
+        explore_until = started_at + self.window * self.EXPLORE_RATIO
+        best_score = None
+        previous_net = None
+        schedule = {'samples': 0, 'peak_cpu': 0.0, 'peak_net_kbps': 0.0}
+
+        while not shutdown_flag.is_set():
+            raw = sample_fn() or {}
+            now = time.time()
+            reason = None
+            if raw:
+                net_kbps = None
+                if raw.get('net_bytes') is not None:
+                    if previous_net and now > previous_net[1]:
+                        net_kbps = max(raw['net_bytes'] - previous_net[0], 0) / (now - previous_net[1]) / 1024
+                    previous_net = (raw['net_bytes'], now)
+
+                # 首次采样只能得到网络累计值，无法判断流量
+                if net_kbps is not None or raw.get('net_bytes') is None:
+                    sample = {'cpu_percent': raw.get('cpu_percent'), 'net_kbps': net_kbps}
+                    current_score = self.score(sample)
+                    schedule['samples'] += 1
+                    schedule['peak_cpu'] = max(schedule['peak_cpu'], sample['cpu_percent'] or 0.0)
+                    schedule['peak_net_kbps'] = max(schedule['peak_net_kbps'], net_kbps or 0.0)
+                    if self.is_quiet(sample):
+                        reason = 'quiet'
+                    elif now >= explore_until and best_score is not None and current_score <= best_score:
+                        reason = 'quietest'
+                    best_score = current_score if best_score is None else min(best_score, current_score)
+                    schedule.update(sample)
+
+            if not reason and now >= deadline:
+                reason = 'deadline'
+            if reason:
+                schedule.update({'reason': reason, 'decided_at': now, 'waited': now - started_at})
+                return schedule
+
+            time.sleep(max(min(self.interval, deadline - now), 0.5))
+
+        return None
+
+
+class CgroupResourceSampler:
+    def __init__(self, cgroup_root: Path, max_sample_age: float = 60.0):
+        self.cgroup_root = cgroup_root
+        self.max_sample_age = max_sample_age
+        self._paths: Dict[str, Path] = {}
+        self._previous: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return (self.cgroup_root / 'cgroup.controllers').exists()
+
+    def resolve_path(self, container_id: str) -> Optional[Path]:
+        cached = self._paths.get(container_id)
+        if cached and cached.exists():
+            return cached
+
+        candidates = [
+            self.cgroup_root / 'system.slice' / f'docker-{container_id}.scope',
+            self.cgroup_root / 'docker' / container_id,
+            self.cgroup_root / f'docker-{container_id}.scope',
+        ]
+        candidates.extend(self.cgroup_root.glob(f'*/docker-{container_id}.scope'))
+        candidates.extend(self.cgroup_root.glob(f'*/*/docker-{container_id}.scope'))
+        for candidate in candidates:
+            if (candidate / 'cpu.stat').exists():
+                self._paths[container_id] = candidate
+                return candidate
+        return None
+
+    @staticmethod
+    def _read_counters(path: Path) -> Dict[str, float]:
+        cpu_usec = 0
+        for line in (path / 'cpu.stat').read_text(encoding='utf-8').splitlines():
+            key, _, value = line.partition(' ')
+            if key == 'usage_usec':
+                cpu_usec = int(value)
+                break
+
+        memory_bytes = int((path / 'memory.current').read_text(encoding='utf-8').strip() or 0)
+        memory_stat = path / 'memory.stat'
+        if memory_stat.exists():
+            for line in memory_stat.read_text(encoding='utf-8').splitlines():
+                key, _, value = line.partition(' ')
+                if key == 'inactive_file':
+                    memory_bytes = max(memory_bytes - int(value), 0)
+                    break
+
+        read_bytes = 0
+        write_bytes = 0
+        io_stat = path / 'io.stat'
+        if io_stat.exists():
+            for line in io_stat.read_text(encoding='utf-8').splitlines():
+                for field in line.split()[1:]:
+                    key, _, value = field.partition('=')
+                    if key == 'rbytes':
+                        read_bytes += int(value)
+                    elif key == 'wbytes':
+                        write_bytes += int(value)
+
+        return {
+            'cpu_usec': cpu_usec,
+            'memory_bytes': memory_bytes,
+            'io_read_bytes': read_bytes,
+            'io_write_bytes': write_bytes,
+            'at': time.monotonic(),
+        }
+
+    def _read_all(self, containers: Dict[str, str]) -> Dict[str, Dict[str, float]]:
+        counters = {}
+        for container_id in containers:
+            path = self.resolve_path(container_id)
+            if not path:
+                continue
+            try:
+                counters[container_id] = self._read_counters(path)
+            except (OSError, ValueError) as e:
+                self._paths.pop(container_id, None)
+                logger.debug(f'读取 cgroup 统计失败: {container_id[:12]} - {e}')
+        return counters
+
+    def sample(self, containers: Dict[str, str], settle: float = 1.0) -> List[Dict[str, Any]]:
+        with self._lock:
+            current = self._read_all(containers)
+            now = time.monotonic()
+            missing = [
+                container_id for container_id in current
+                if container_id not in self._previous
+                or now - self._previous[container_id]['at'] > self.max_sample_age
+            ]
+            if missing:
+                for container_id in missing:
+                    self._previous[container_id] = current[container_id]
+                time.sleep(settle)
+                current.update(self._read_all({container_id: containers[container_id] for container_id in missing}))
+
+            samples = []
+            for container_id, counters in current.items():
+                previous = self._previous.get(container_id, counters)
+                elapsed = max(counters['at'] - previous['at'], 1e-6)
+                samples.append({
+                    'id': container_id,
+                    'name': containers[container_id],
+                    'cpu_percent': max(counters['cpu_usec'] - previous['cpu_usec'], 0) / (elapsed * 1_000_000) * 100,
+                    'memory_bytes': counters['memory_bytes'],
+                    'io_read_bps': max(counters['io_read_bytes'] - previous['io_read_bytes'], 0) / elapsed,
+                    'io_write_bps': max(counters['io_write_bytes'] - previous['io_write_bytes'], 0) / elapsed,
+                })
+                self._previous[container_id] = counters
+
+            # 单容器采样与全量采样共用同一份基准，按时间淘汰，避免一次单容器调用清空其他容器的基准
+            for container_id in list(self._previous.keys()):
+                if now - self._previous[container_id]['at'] > self.max_sample_age:
+                    self._previous.pop(container_id, None)
+            for container_id in list(self._paths.keys()):
+                if container_id not in self._previous:
+                    self._paths.pop(container_id, None)
+
+            return samples
+
+
+class FileChangeWatcher:
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, directory: Path, names: Set[str]):
+        self.directory = directory
+        self.names = set(names)
+        self._fd: Optional[int] = None
+        self._open()
+
+    def _open(self):
+        try:
+            import ctypes
+            import ctypes.util
+
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+            self.directory.mkdir(parents=True, exist_ok=True)
+            mask = self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+            if libc.inotify_add_watch(fd, os.fsencode(str(self.directory)), mask) < 0:
+                error = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(error, f'inotify_add_watch 失败: {self.directory}')
+            self._fd = fd
+        except (OSError, AttributeError) as e:
+            logger.warning(f'inotify 不可用，回退为每 {REMOTE_QUEUE_FALLBACK_POLL} 秒轮询: {e}')
+
+    @property
+    def available(self) -> bool:
+        return self._fd is not None
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.time() + max(timeout, 0)
+        while not shutdown_flag.is_set():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            if self._fd is None:
+                shutdown_flag.wait(remaining)
+                return False
+            ready, _, _ = select.select([self._fd], [], [], min(remaining, 5))
+            if ready and self._drain():
+                return True
+        return False
+
+    def _drain(self) -> bool:
+        changed = False
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                logger.warning(f'读取 inotify 事件失败: {e}')
+                break
+            if not data:
+                break
+            offset = 0
+            while offset + self.EVENT_HEADER.size <= len(data):
+                _, _, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+                start = offset + self.EVENT_HEADER.size
+                name = os.fsdecode(data[start:start + length].split(b'\0', 1)[0])
+                offset = start + length
+                if name in self.names:
+                    changed = True
+        return changed
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
 class RemoteCommandQueue:
+    FINISHED_STATUSES = {'done', 'failed', 'expired'}
+
     def __init__(self, queue_file: Path):
         self.queue_file = queue_file
+        self.queue_dir = queue_file.with_name(queue_file.stem)
+        self._migrate_legacy()
+
+    def _target_dir(self, target_server: str) -> Path:
+        return self.queue_dir / sanitize_file_component(target_server)
+
+    def _index_file(self, target_server: str) -> Path:
+        return self._target_dir(target_server) / 'index.json'
+
+    def _job_file(self, target_server: str, job_id: str) -> Path:
+        return self._target_dir(target_server) / 'jobs' / f'{job_id}.json'
+
+    def _archive_file(self, target_server: str) -> Path:
+        return self._target_dir(target_server) / 'archive.json'
+
+    def wakeup_marker(self, target_server: str) -> Path:
+        return self._target_dir(target_server) / 'wake'
+
+    def progress_file(self, target_server: str, job_id: str) -> Path:
+        return self._target_dir(target_server) / 'progress' / f'{job_id}.json'
+
+    def publish_progress(self, target_server: str, job_id: str, text: Optional[str] = None,
+                         targets: Optional[List[Tuple[str, str]]] = None, status: Optional[str] = None):
+        progress_file = self.progress_file(target_server, job_id)
+        record = self._peek(progress_file) or {'job_id': job_id, 'seq': 0}
+        record['seq'] = int(record.get('seq', 0)) + 1
+        record['updated_at'] = time.time()
+        if text is not None:
+            record['text'] = text
+        if targets is not None:
+            record['targets'] = [list(target) for target in targets]
+        if status:
+            record['status'] = status
+        try:
+            progress_file.parent.mkdir(parents=True, exist_ok=True)
+            self._write_atomic(progress_file, record)
+        except OSError as e:
+            logger.debug(f'写入任务进度失败: {job_id} - {e}')
+
+    def read_progress(self, target_server: str, job_id: str) -> Dict:
+        return self._peek(self.progress_file(target_server, job_id))
+
+    def clear_progress(self, target_server: str, job_id: str):
+        self.progress_file(target_server, job_id).unlink(missing_ok=True)
+
+    def is_active(self, target_server: str, job_id: str) -> bool:
+        index = self._peek(self._index_file(target_server))
+        return job_id in index.get('processing', {}) or any(
+            entry[2] == job_id for entry in index.get('pending', [])
+        )
+
+    def _signal(self, target_server: str):
+        try:
+            self.wakeup_marker(target_server).write_text(str(time.time()), encoding='utf-8')
+        except OSError as e:
+            logger.debug(f'写入任务唤醒标记失败: {target_server} - {e}')
+
+    @staticmethod
+    def _peek(file_path: Path) -> Dict:
+        try:
+            content = file_path.read_text(encoding='utf-8').strip()
+            return json.loads(content) if content else {}
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    @staticmethod
+    def _write_atomic(file_path: Path, data: Dict):
+        temp_path = file_path.with_name(f'{file_path.name}.{uuid.uuid4().hex}.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        temp_path.replace(file_path)
+
+    @staticmethod
+    def _has_claimable(index: Dict, now: float) -> bool:
+        if index.get('pending'):
+            return True
+        return any(
+            now - float(entry.get('claimed_at', 0) or 0) > REMOTE_JOB_PROCESSING_TIMEOUT
+            for entry in index.get('processing', {}).values()
+        )
 
-    def enqueue(self, target_server: str, action: str, payload: Dict) -> Optional[str]:
+    def enqueue(self, target_server: str, action: str, payload: Dict,
+                priority: Optional[int] = None, ttl: Optional[int] = None) -> Optional[str]:
         job_id = f"{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}"
+        now = time.time()
+        priority = self._job_priority(payload) if priority is None else priority
+        job = {
+            'id': job_id,
+            'target_server': target_server,
+            'action': action,
+            'payload': payload,
+            'status': 'pending',
+            'priority': priority,
+            'created_at': now,
+            'expires_at': now + (ttl or REMOTE_JOB_TTL)
+        }
 
-        def updater(data: Dict) -> Dict:
-            jobs = data.setdefault('jobs', [])
-            jobs.append({
-                'id': job_id,
-                'target_server': target_server,
-                'action': action,
-                'payload': payload,
-                'status': 'pending',
-                'created_at': time.time()
-            })
-            cutoff = time.time() - 86400
-            data['jobs'] = [job for job in jobs if job.get('created_at', 0) >= cutoff and job.get('status') != 'done']
-            return data
+        job_file = self._job_file(target_server, job_id)
+        key = self._coalesce_key(action, payload)
+        subscriber = {'chat_id': str(payload.get('chat_id', '')), 'message_id': str(payload.get('message_id', ''))}
+        outcome: Dict[str, Any] = {}
+
+        def updater(index: Dict) -> Dict:
+            pending = index.setdefault('pending', [])
+            processing = index.setdefault('processing', {})
+            keys = index.setdefault('keys', {})
+            existing_id = keys.get(key) if key else None
+            if existing_id and (existing_id in processing or any(entry[2] == existing_id for entry in pending)):
+                existing_file = self._job_file(target_server, existing_id)
+                existing = self._peek(existing_file)
+                if existing:
+                    subscribers = existing.setdefault('payload', {}).setdefault('subscribers', [])
+                    if subscriber['message_id'] and subscriber not in subscribers:
+                        subscribers.append(subscriber)
+                    self._write_atomic(existing_file, existing)
+                    outcome['job_id'] = existing_id
+                    outcome['attached'] = True
+                    return index
+
+            self._write_atomic(job_file, job)
+            bisect.insort(pending, [priority, now, job_id, job['expires_at']])
+            if key:
+                keys[key] = job_id
+            outcome['job_id'] = job_id
+            return index
 
-        updated = safe_update_json(self.queue_file, updater, default={})
-        if updated is None:
-            logger.error(f'远程任务入队失败: {target_server} {action} -> {job_id}')
+        try:
+            job_file.parent.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            logger.error(f'远程任务入队失败: {target_server} {action} -> {job_id}: {e}')
             return None
 
-        jobs = updated.get('jobs', [])
-        if not any(job.get('id') == job_id for job in jobs):
-            logger.error(f'远程任务入队后未找到任务记录: {target_server} {action} -> {job_id}')
+        updated = safe_update_json(self._index_file(target_server), updater, default={})
+        if updated is None or not outcome.get('job_id'):
+            logger.error(f'远程任务入队失败: {target_server} {action} -> {job_id}')
+            job_file.unlink(missing_ok=True)
             return None
 
+        if outcome.get('attached'):
+            logger.info(f"远程任务已合并到现有任务: {target_server} {action} {payload.get('container')} -> {outcome['job_id']}")
+            return outcome['job_id']
+
+        self._signal(target_server)
         return job_id
 
+    @staticmethod
+    def _job_priority(payload: Dict) -> int:
+        # 按来源区分优先级：有人在聊天里等结果的任务优先，与容器数量无关
+        source = payload.get('source') or ('interactive' if payload.get('message_id') else None)
+        return REMOTE_JOB_PRIORITIES.get(source, REMOTE_JOB_DEFAULT_PRIORITY)
+
+    @staticmethod
+    def _coalesce_key(action: str, payload: Dict) -> Optional[str]:
+        container = payload.get('container')
+        if container:
+            return f'{action}:{container}'
+        containers = payload.get('containers')
+        return f"{action}:{','.join(sorted(containers))}" if containers else None
+
+    def subscribers(self, job: Dict) -> List[Tuple[str, str]]:
+        current = self._peek(self._job_file(job.get('target_server', ''), job.get('id', '')))
+        payload = current.get('payload') or job.get('payload', {})
+        return [
+            (str(item.get('chat_id', '')), str(item.get('message_id', '')))
+            for item in payload.get('subscribers', [])
+            if item.get('chat_id') and item.get('message_id')
+        ]
+
+    def _targets(self) -> List[Path]:
+        try:
+            return [path for path in self.queue_dir.iterdir() if path.is_dir()]
+        except OSError:
+            return []
+
     def count_pending(self, target_server: Optional[str] = None) -> int:
-        data = safe_read_json(self.queue_file, default={})
-        jobs = data.get('jobs', [])
-        if target_server is None:
-            return sum(1 for job in jobs if job.get('status') in {'pending', 'processing'})
-        return sum(
-            1 for job in jobs
-            if job.get('target_server') == target_server and job.get('status') in {'pending', 'processing'}
-        )
+        target_dirs = self._targets() if target_server is None else [self._target_dir(target_server)]
+        total = 0
+        for target_dir in target_dirs:
+            index = self._peek(target_dir / 'index.json')
+            total += len(index.get('pending', [])) + len(index.get('processing', {}))
+        return total
 
     def claim(self, target_server: str) -> Optional[Dict]:
-        claimed = {}
+        index_file = self._index_file(target_server)
+        if not self._has_claimable(self._peek(index_file), time.time()):
+            return None
 
+        claimed: Dict = {}
+        expired: List[Dict] = []
         try:
-            with FileLock(self.queue_file, timeout=5):
-                data = {}
-                if self.queue_file.exists():
-                    with open(self.queue_file, 'r', encoding='utf-8') as f:
-                        content = f.read().strip()
-                        if content:
-                            data = json.loads(content)
-
-                jobs = data.setdefault('jobs', [])
+            with FileLock(index_file, timeout=5):
+                index = self._peek(index_file)
+                pending = index.setdefault('pending', [])
+                processing = index.setdefault('processing', {})
                 now = time.time()
-                for job in jobs:
-                    if job.get('target_server') != target_server:
+
+                job_id = None
+                dropped: Set[str] = set()
+                for stale_id, entry in list(processing.items()):
+                    if now - float(entry.get('claimed_at', 0) or 0) <= REMOTE_JOB_PROCESSING_TIMEOUT:
                         continue
-                    status = job.get('status')
-                    claimed_at = float(job.get('claimed_at', 0) or 0)
-                    is_stale_processing = (
-                        status == 'processing'
-                        and claimed_at > 0
-                        and now - claimed_at > REMOTE_JOB_PROCESSING_TIMEOUT
-                    )
-                    if status != 'pending' and not is_stale_processing:
+                    stale_file = self._job_file(target_server, stale_id)
+                    stale_job = self._peek(stale_file)
+                    if not stale_job.get('id') or stale_job.get('status') in self.FINISHED_STATUSES:
+                        # 任务已结束但索引未能更新，丢弃残留记录而不是把空任务重新领取出去
+                        processing.pop(stale_id, None)
+                        stale_file.unlink(missing_ok=True)
+                        dropped.add(stale_id)
+                        continue
+                    job_id = stale_id
+                    break
+                if dropped:
+                    logger.warning(f"丢弃缺少任务文件的处理中记录: {target_server} {', '.join(sorted(dropped))}")
+                    index['keys'] = {
+                        key: value for key, value in index.get('keys', {}).items() if value not in dropped
+                    }
+                reclaimed = job_id is not None
+                while job_id is None and pending:
+                    _, _, candidate, expires_at = pending.pop(0)
+                    job = self._peek(self._job_file(target_server, candidate))
+                    if not job:
+                        continue
+                    if expires_at and expires_at < now:
+                        expired.append(job)
                         continue
+                    job_id = candidate
+
+                if job_id is not None:
+                    job_file = self._job_file(target_server, job_id)
+                    job = self._peek(job_file)
                     job['status'] = 'processing'
                     job['claimed_at'] = now
                     job['attempts'] = int(job.get('attempts', 0) or 0) + 1
-                    if is_stale_processing:
+                    if reclaimed:
                         job['reclaimed_at'] = now
+                    self._write_atomic(job_file, job)
+                    processing[job_id] = {'claimed_at': now, 'attempts': job['attempts']}
                     claimed.update(job)
-                    break
 
-                if not claimed:
-                    return None
-
-                temp_path = self.queue_file.with_name(f'{self.queue_file.name}.{uuid.uuid4().hex}.tmp')
-                with open(temp_path, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-                    f.flush()
-                    os.fsync(f.fileno())
-                temp_path.replace(self.queue_file)
-        except (json.JSONDecodeError, TimeoutError) as e:
-            logger.error(f"远程任务领取失败: {self.queue_file} - {e}")
+                if expired:
+                    expired_ids = {job.get('id') for job in expired}
+                    index['keys'] = {
+                        key: value for key, value in index.get('keys', {}).items() if value not in expired_ids
+                    }
+                if claimed or expired or dropped:
+                    self._write_atomic(index_file, index)
+        except TimeoutError as e:
+            logger.error(f"远程任务领取失败: {index_file} - {e}")
             return None
         except Exception as e:
             logger.error(f"远程任务领取失败: {e}")
             return None
 
-        return claimed
+        for job in expired:
+            logger.warning(f"远程任务已过期: {target_server} {job.get('action')} -> {job.get('id')}")
+            self._archive(target_server, job, 'expired', '任务超过有效期未被执行')
+        return claimed or None
 
-    def complete(self, job_id: str, error: Optional[str] = None):
-        def updater(data: Dict) -> Dict:
-            jobs = data.setdefault('jobs', [])
-            for job in jobs:
-                if job.get('id') == job_id:
-                    job['status'] = 'done'
-                    job['completed_at'] = time.time()
-                    if error:
-                        job['error'] = error[:300]
-                    break
-            cutoff = time.time() - 3600
-            data['jobs'] = [job for job in jobs if not (job.get('status') == 'done' and job.get('completed_at', 0) < cutoff)]
-            return data
+    def _locate(self, job_id: str) -> Optional[Path]:
+        for target_dir in self._targets():
+            if (target_dir / 'jobs' / f'{job_id}.json').exists():
+                return target_dir
+        return None
 
-        safe_update_json(self.queue_file, updater, default={})
+    def _archive(self, target_server: str, job: Dict, status: str, error: Optional[str] = None,
+                 remove_job: bool = True):
+        job.update({'status': status, 'completed_at': time.time()})
+        if error:
+            job['error'] = error[:300]
 
-    def fail(self, job_id: str, error: str):
         def updater(data: Dict) -> Dict:
             jobs = data.setdefault('jobs', [])
-            for job in jobs:
-                if job.get('id') == job_id:
-                    job['status'] = 'failed'
-                    job['completed_at'] = time.time()
-                    job['error'] = (error or '未知错误')[:300]
-                    break
-            cutoff = time.time() - 86400
-            data['jobs'] = [
-                job for job in jobs
-                if not (
-                    job.get('status') in {'done', 'failed'}
-                    and job.get('completed_at', 0) < cutoff
-                )
-            ]
+            jobs.append(job)
+            data['jobs'] = jobs[-REMOTE_JOB_ARCHIVE_SIZE:]
             return data
 
-        safe_update_json(self.queue_file, updater, default={})
+        safe_update_json(self._archive_file(target_server), updater, default={})
+        payload = job.get('payload', {})
+        if payload.get('progress_channel'):
+            targets = [(str(payload.get('chat_id', '')), str(payload.get('message_id', '')))] + [
+                (str(item.get('chat_id', '')), str(item.get('message_id', '')))
+                for item in payload.get('subscribers', [])
+            ]
+            self.publish_progress(target_server, job['id'], targets=[target for target in targets if all(target)],
+                                  status=status)
+        if remove_job:
+            self._job_file(target_server, job['id']).unlink(missing_ok=True)
+        else:
+            # 索引仍登记着该任务，保留带终态的任务文件，由下次领取时清理，避免被当作未完成任务重新执行
+            self._write_atomic(self._job_file(target_server, job['id']), job)
 
+    def _finish(self, job_id: str, status: str, error: Optional[str] = None):
+        target_dir = self._locate(job_id)
+        if target_dir is None:
+            logger.warning(f'未找到远程任务记录: {job_id}')
+            return
+        job_file = target_dir / 'jobs' / f'{job_id}.json'
+        job = self._peek(job_file)
+        target_server = job.get('target_server', target_dir.name)
+
+        def updater(index: Dict) -> Dict:
+            index.setdefault('processing', {}).pop(job_id, None)
+            index['pending'] = [entry for entry in index.get('pending', []) if entry[2] != job_id]
+            index['keys'] = {key: value for key, value in index.get('keys', {}).items() if value != job_id}
+            # 合并订阅与此处都持有索引锁，重新读取可拿到最后一刻附加的订阅者
+            job.update(self._peek(job_file) or {})
+            return index
+
+        updated = safe_update_json(self._index_file(target_server), updater, default={})
+        if updated is None:
+            logger.warning(f'更新远程任务索引失败，保留任务文件待下次领取时清理: {job_id}')
+        self._archive(target_server, job, status, error, remove_job=updated is not None)
 
-class RemoteServerController:
-    def __init__(self, local_server_name: str, docker: 'DockerManager',
-                 config: 'ConfigManager', registry: 'ServerRegistry'):
-        self.local_server_name = local_server_name
-        self.docker = docker
-        self.config = config
-        self.registry = registry
-        self._inventory_cache: Dict[str, Dict[str, Any]] = {}
+    def renew(self, target_server: str, job_ids: List[str]):
+        if not job_ids:
+            return
 
-    def is_local_server(self, server: str) -> bool:
-        return server == self.local_server_name
+        def updater(index: Dict) -> Dict:
+            processing = index.setdefault('processing', {})
+            now = time.time()
+            for job_id in job_ids:
+                if job_id in processing:
+                    processing[job_id]['claimed_at'] = now
+            return index
 
-    def uses_ssh(self, server: str) -> bool:
-        if self.is_local_server(server) or REMOTE_CONTROL_MODE == 'queue':
-            return False
-        config = REMOTE_SERVER_CONFIGS.get(server)
-        return bool(config and config.get('transport') == 'ssh')
+        safe_update_json(self._index_file(target_server), updater, default={})
 
-    def uses_queue(self, server: str) -> bool:
-        if self.is_local_server(server):
-            return False
-        if REMOTE_CONTROL_MODE == 'ssh':
-            return not self.uses_ssh(server)
-        config = REMOTE_SERVER_CONFIGS.get(server)
-        if config and config.get('transport') == 'queue':
-            return True
-        return not self.uses_ssh(server)
+    def complete(self, job_id: str, error: Optional[str] = None):
+        self._finish(job_id, 'done', error)
 
-    def invalidate_cache(self, server: str):
-        self._inventory_cache.pop(server, None)
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, 'failed', error or '未知错误')
 
-    def _build_local_inventory(self) -> Dict[str, Any]:
-        return build_inventory_payload(self.local_server_name, self.docker, self.config)
+    def archived(self, target_server: str) -> List[Dict]:
+        return self._peek(self._archive_file(target_server)).get('jobs', [])
 
-    def _build_legacy_inventory(self, server: str) -> Dict[str, Any]:
+    def _migrate_legacy(self):
+        if not self.queue_file.exists():
+            return
+        try:
+            with FileLock(self.queue_file, timeout=5):
+                if not self.queue_file.exists():
+                    return
+                jobs = self._peek(self.queue_file).get('jobs', [])
+                migrated = 0
+                for job in jobs:
+                    status = job.get('status')
+                    target_server = job.get('target_server')
+                    if status not in {'pending', 'processing'} or not target_server:
+                        continue
+                    created_at = float(job.get('created_at', 0) or time.time())
+                    if created_at + REMOTE_JOB_TTL < time.time():
+                        continue
+                    priority = self._job_priority(job.get('payload') or {})
+                    job.update({'priority': priority, 'expires_at': created_at + REMOTE_JOB_TTL})
+                    job_file = self._job_file(target_server, job['id'])
+                    job_file.parent.mkdir(parents=True, exist_ok=True)
+                    self._write_atomic(job_file, job)
+
+                    def updater(index: Dict) -> Dict:
+                        if status == 'processing':
+                            index.setdefault('processing', {})[job['id']] = {
+                                'claimed_at': float(job.get('claimed_at', 0) or 0),
+                                'attempts': int(job.get('attempts', 0) or 0)
+                            }
+                        else:
+                            bisect.insort(
+                                index.setdefault('pending', []),
+                                [priority, created_at, job['id'], job['expires_at']]
+                            )
+                        return index
+
+                    safe_update_json(self._index_file(target_server), updater, default={})
+                    migrated += 1
+                self.queue_file.replace(self.queue_file.with_name(f'{self.queue_file.name}.migrated'))
+            if migrated:
+                logger.info(f'已迁移 {migrated} 个旧版共享队列任务到 {self.queue_dir}')
+        except Exception as e:
+            logger.error(f'迁移旧版共享任务队列失败: {e}')
+
+
+class RemoteUnreachableError(RuntimeError):
+    pass
+
+
+class ServerHealthDirectory:
+    def __init__(self, threshold: int = SERVER_QUARANTINE_THRESHOLD, base_delay: int = SERVER_QUARANTINE_BASE,
+                 max_delay: int = SERVER_QUARANTINE_MAX, history_size: int = 20):
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.history_size = history_size
+        self._servers: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, server: str) -> Dict[str, Any]:
+        return self._servers.setdefault(server, {
+            'rtt_ms': [],
+            'results': [],
+            'consecutive_failures': 0,
+            'unreachable_since': None,
+            'next_probe_at': 0.0,
+            'probing': False,
+            'last_error': '',
+            'last_success_at': None,
+        })
+
+    def record_success(self, server: str, rtt_ms: Optional[float] = None):
+        with self._lock:
+            entry = self._entry(server)
+            if entry['unreachable_since']:
+                logger.info(f'服务器 {server} 已恢复连接')
+            entry['results'] = (entry['results'] + [True])[-self.history_size:]
+            if rtt_ms is not None:
+                entry['rtt_ms'] = (entry['rtt_ms'] + [round(rtt_ms, 1)])[-self.history_size:]
+            entry.update({
+                'consecutive_failures': 0,
+                'unreachable_since': None,
+                'next_probe_at': 0.0,
+                'probing': False,
+                'last_success_at': time.time(),
+            })
+
+    def record_failure(self, server: str, error: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entry(server)
+            entry['results'] = (entry['results'] + [False])[-self.history_size:]
+            entry['consecutive_failures'] += 1
+            entry['last_error'] = error[:200]
+            entry['probing'] = False
+            entry['unreachable_since'] = entry['unreachable_since'] or now
+            failures_over = entry['consecutive_failures'] - self.threshold
+            if failures_over >= 0:
+                delay = min(self.base_delay * (2 ** failures_over), self.max_delay)
+                entry['next_probe_at'] = now + delay
+                logger.warning(f'服务器 {server} 连续失败 {entry["consecutive_failures"]} 次，隔离 {delay} 秒')
+
+    def check(self, server: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._servers.get(server)
+            if not entry or entry['consecutive_failures'] < self.threshold:
+                return None
+            if now >= entry['next_probe_at'] and not entry['probing']:
+                # 隔离到期，放行一次请求作为探测
+                entry['probing'] = True
+                return None
+            since = datetime.fromtimestamp(entry['unreachable_since']).strftime('%m-%d %H:%M:%S')
+            retry_in = max(int(entry['next_probe_at'] - now), 0)
+            return f'服务器 {server} 自 {since} 起不可达（{entry["last_error"] or "连接失败"}），{retry_in} 秒后重试'
+
+    def is_quarantined(self, server: str) -> bool:
+        with self._lock:
+            entry = self._servers.get(server)
+            return bool(entry and entry['consecutive_failures'] >= self.threshold)
+
+    def due_for_probe(self) -> List[str]:
+        now = time.time()
+        with self._lock:
+            return [
+                server for server, entry in self._servers.items()
+                if entry['consecutive_failures'] >= self.threshold
+                and not entry['probing'] and now >= entry['next_probe_at']
+            ]
+
+    def snapshot(self, server: str) -> Dict[str, Any]:
+        with self._lock:
+            entry = self._servers.get(server)
+            if not entry:
+                return {}
+            results = entry['results']
+            return {
+                'success_rate': sum(results) / len(results) if results else None,
+                'rtt_ms': list(entry['rtt_ms']),
+                'rtt_p50_ms': percentile(entry['rtt_ms'], 50) if entry['rtt_ms'] else None,
+                'consecutive_failures': entry['consecutive_failures'],
+                'quarantined': entry['consecutive_failures'] >= self.threshold,
+                'unreachable_since': entry['unreachable_since'],
+                'last_error': entry['last_error'],
+                'last_success_at': entry['last_success_at'],
+            }
+
+
+class RPCSessionError(RuntimeError):
+    def __init__(self, message: str, sent: bool, broken: bool = True):
+        super().__init__(message)
+        self.sent = sent
+        self.broken = broken
+
+
+class RemoteRPCSession:
+    def __init__(self, server: str, command: List[str]):
+        self.server = server
+        self.command = command
+        self._process: Optional[subprocess.Popen] = None
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.last_returncode: Optional[int] = None
+
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def _ensure_started(self) -> subprocess.Popen:
+        with self._lock:
+            if self.is_alive():
+                return self._process
+            process = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                bufsize=1,
+            )
+            self._process = process
+        threading.Thread(
+            target=self._read_responses,
+            args=(process,),
+            name=f'rpc-session-{self.server}',
+            daemon=True
+        ).start()
+        logger.info(f'已建立到 {self.server} 的 RPC 会话')
+        return process
+
+    def _read_responses(self, process: subprocess.Popen):
+        for line in process.stdout:
+            try:
+                response = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            with self._lock:
+                waiter = self._pending.get(str(response.get('id')))
+            if not waiter:
+                continue
+            if 'event' in response:
+                if waiter['on_event']:
+                    try:
+                        waiter['on_event'](response['event'])
+                    except Exception as exc:
+                        logger.warning(f'处理 {self.server} RPC 进度事件失败: {exc}')
+                continue
+            waiter['payload'] = response.get('payload')
+            waiter['event'].set()
+
+        try:
+            returncode = process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            returncode = None
+        with self._lock:
+            self.last_returncode = returncode
+            if self._process is process:
+                self._process = None
+            pending = [waiter for waiter in self._pending.values() if not waiter['event'].is_set()]
+        for waiter in pending:
+            waiter['error'] = 'RPC 会话已断开'
+            waiter['event'].set()
+
+    def request(self, rpc_args: List[str], timeout: float,
+                on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        try:
+            process = self._ensure_started()
+        except Exception as exc:
+            raise RPCSessionError(f'RPC 会话启动失败: {exc}', sent=False) from exc
+
+        request_id = uuid.uuid4().hex
+        waiter = {'event': threading.Event(), 'payload': None, 'error': '', 'on_event': on_event}
+        with self._lock:
+            self._pending[request_id] = waiter
+        try:
+            try:
+                with self._write_lock:
+                    process.stdin.write(json.dumps({'id': request_id, 'args': list(rpc_args)}) + '\n')
+                    process.stdin.flush()
+            except (OSError, ValueError) as exc:
+                self.close()
+                raise RPCSessionError(f'RPC 会话写入失败: {exc}', sent=False) from exc
+
+            if not waiter['event'].wait(timeout):
+                # 单个请求超时不代表会话断开，其他并发请求仍可继续使用
+                raise RPCSessionError(f'RPC 会话请求超时: {self.server}', sent=True, broken=False)
+            if waiter['error'] or waiter['payload'] is None:
+                raise RPCSessionError(waiter['error'] or 'RPC 会话返回为空', sent=True)
+            return waiter['payload']
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    def close(self):
+        with self._lock:
+            process, self._process = self._process, None
+        if not process or process.poll() is not None:
+            return
+        try:
+            process.stdin.close()
+            process.wait(timeout=5)
+        except Exception:
+            process.kill()
+
+
+class RemoteServerController:
+    IDEMPOTENT_RPC_COMMANDS = {'ping', 'inventory', 'top'}
+
+    def __init__(self, local_server_name: str, docker: 'DockerManager',
+                 config: 'ConfigManager', registry: 'ServerRegistry'):
+        self.local_server_name = local_server_name
+        self.docker = docker
+        self.config = config
+        self.registry = registry
+        self._inventory_cache: Dict[str, Dict[str, Any]] = {}
+        self._legacy_inventory_servers: Set[str] = set()
+        self._refresh_waiters: Dict[str, List[Callable[[Dict[str, Any]], None]]] = {}
+        self._refresh_lock = threading.Lock()
+        self._connection_stats: Dict[str, Dict[str, Any]] = {}
+        self._connection_locks: Dict[str, threading.Lock] = {}
+        self._connection_guard = threading.Lock()
+        self._discovery_cache: Dict[str, Dict[str, Any]] = {}
+        self._discovery_lock = threading.Lock()
+        self._rpc_sessions: Dict[str, RemoteRPCSession] = {}
+        self._rpc_sessions_lock = threading.Lock()
+        self._legacy_session_servers: Set[str] = set()
+        self._agent_sessions: Dict[str, 'requests.Session'] = {}
+        self._agent_sessions_lock = threading.Lock()
+        self.health = ServerHealthDirectory()
+
+    def is_local_server(self, server: str) -> bool:
+        return server == self.local_server_name
+
+    def uses_ssh(self, server: str) -> bool:
+        if self.is_local_server(server) or REMOTE_CONTROL_MODE == 'queue':
+            return False
+        config = remote_server_configs().get(server)
+        return bool(config and config.get('transport') == 'ssh')
+
+    def uses_agent(self, server: str) -> bool:
+        if self.is_local_server(server) or REMOTE_CONTROL_MODE == 'queue':
+            return False
+        config = remote_server_configs().get(server)
+        return bool(config and config.get('transport') == 'agent')
+
+    def uses_rpc(self, server: str) -> bool:
+        return self.uses_ssh(server) or self.uses_agent(server)
+
+    def transport_of(self, server: str) -> str:
+        if self.is_local_server(server):
+            return 'local'
+        if self.uses_rpc(server):
+            return remote_server_configs()[server]['transport']
+        return 'queue'
+
+    def uses_queue(self, server: str) -> bool:
+        if self.is_local_server(server):
+            return False
+        if REMOTE_CONTROL_MODE == 'ssh':
+            return not self.uses_rpc(server)
+        config = remote_server_configs().get(server)
+        if config and config.get('transport') == 'queue':
+            return True
+        return not self.uses_rpc(server)
+
+    def invalidate_cache(self, server: str):
+        self._inventory_cache.pop(server, None)
+
+    def _build_local_inventory(self) -> Dict[str, Any]:
+        return build_inventory_payload(self.local_server_name, self.docker, self.config)
+
+    def _build_legacy_inventory(self, server: str) -> Dict[str, Any]:
         update_state = safe_read_json(UPDATE_STATE_FILE, default={})
         server_state = dict(update_state.get(server, {}))
         snapshots = dict(server_state.get('containers', {}))
@@ -684,7 +2045,8 @@ class RemoteServerController:
             'containers': containers,
         }
 
-    def _build_ssh_command(self, config: Dict[str, Any], remote_command: str) -> List[str]:
+    def _build_ssh_command(self, config: Dict[str, Any], remote_command: Optional[str],
+                           extra_options: Optional[List[str]] = None) -> List[str]:
         ssh_command = ['ssh', '-o', 'BatchMode=yes']
         ssh_command.extend(['-o', f'ConnectTimeout={config["connect_timeout"]}'])
         ssh_command.extend(['-o', 'ServerAliveInterval=15'])
@@ -702,20 +2064,315 @@ class RemoteServerController:
             ssh_command.extend(['-o', 'StrictHostKeyChecking=no'])
             ssh_command.extend(['-o', f'UserKnownHostsFile={known_hosts_file or "/dev/null"}'])
 
+        if extra_options:
+            ssh_command.extend(extra_options)
         ssh_command.extend(['-p', str(config['port'])])
 
         user = config.get('user', '').strip()
         host = config.get('host', '').strip()
         target = f'{user}@{host}' if user else host
         ssh_command.append(target)
-        ssh_command.append(remote_command)
+        if remote_command is not None:
+            ssh_command.append(remote_command)
         return ssh_command
 
-    def _run_remote_rpc(self, server: str, *rpc_args: str, timeout: Optional[int] = None) -> Dict[str, Any]:
-        config = REMOTE_SERVER_CONFIGS.get(server)
+    def _control_path(self, server: str) -> Path:
+        return SSH_CONTROL_DIR / f"{hashlib.sha1(server.encode('utf-8')).hexdigest()[:16]}.sock"
+
+    def _control_options(self, server: str, master: str = 'no') -> List[str]:
+        if SSH_CONTROL_PERSIST <= 0:
+            return []
+        return [
+            '-o', f'ControlPath={self._control_path(server)}',
+            '-o', f'ControlMaster={master}',
+            '-o', f'ControlPersist={SSH_CONTROL_PERSIST}',
+        ]
+
+    def _connection_lock(self, server: str) -> threading.Lock:
+        with self._connection_guard:
+            return self._connection_locks.setdefault(server, threading.Lock())
+
+    def _check_master(self, server: str, config: Dict[str, Any]) -> bool:
+        if not self._control_path(server).exists():
+            return False
+        try:
+            result = subprocess.run(
+                self._build_ssh_command(config, None, self._control_options(server) + ['-O', 'check']),
+                capture_output=True,
+                text=True,
+                timeout=5,
+            )
+        except Exception:
+            return False
+        return result.returncode == 0
+
+    def _start_master(self, server: str, config: Dict[str, Any]) -> Tuple[bool, str]:
+        SSH_CONTROL_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        command = self._build_ssh_command(config, None, self._control_options(server, 'yes') + ['-f', '-N'])
+        # 后台 master 进程会继承输出句柄，不能用管道读取，否则会一直阻塞
+        with tempfile.TemporaryFile(mode='w+') as stderr_file:
+            try:
+                result = subprocess.run(
+                    command,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=stderr_file,
+                    timeout=config['connect_timeout'] + 10,
+                )
+            except subprocess.TimeoutExpired:
+                return False, 'SSH 建立连接超时'
+            stderr_file.seek(0)
+            error = stderr_file.read().strip()[:200]
+        return result.returncode == 0, error
+
+    def ensure_connection(self, server: str) -> Dict[str, Any]:
+        config = remote_server_configs().get(server)
+        if SSH_CONTROL_PERSIST <= 0 or not config:
+            return {'reused': False, 'setup_ms': None}
+
+        with self._connection_lock(server):
+            started_at = time.time()
+            if self._check_master(server, config):
+                connection = {'reused': True, 'setup_ms': (time.time() - started_at) * 1000}
+            else:
+                established, error = self._start_master(server, config)
+                connection = {'reused': False, 'setup_ms': (time.time() - started_at) * 1000}
+                if established:
+                    logger.info(f'已建立到 {server} 的 SSH 复用连接，耗时 {connection["setup_ms"]:.0f}ms')
+                else:
+                    connection['error'] = error or 'SSH 复用连接建立失败'
+                    logger.warning(f'建立到 {server} 的 SSH 复用连接失败: {connection["error"]}')
+
+            stats = self._connection_stats.setdefault(server, {})
+            stats.update(connection)
+            stats['connected'] = 'error' not in connection
+            stats['checked_at'] = time.time()
+            if not stats['connected']:
+                stats.pop('established_at', None)
+            elif not connection['reused'] or 'established_at' not in stats:
+                stats['established_at'] = stats['checked_at']
+            return dict(connection)
+
+    def close_connection(self, server: str):
+        config = remote_server_configs().get(server)
+        if SSH_CONTROL_PERSIST <= 0 or not config or not self._control_path(server).exists():
+            return
+        try:
+            subprocess.run(
+                self._build_ssh_command(config, None, self._control_options(server) + ['-O', 'exit']),
+                capture_output=True,
+                text=True,
+                timeout=5,
+            )
+        except Exception as exc:
+            logger.debug(f'关闭 {server} 的 SSH 复用连接失败: {exc}')
+        self._connection_stats.pop(server, None)
+
+    def get_connection_stats(self, server: str) -> Dict[str, Any]:
+        return dict(self._connection_stats.get(server, {}))
+
+    def _ssh_servers(self) -> List[str]:
+        return [server for server in remote_server_configs() if self.uses_ssh(server)]
+
+    def _rpc_servers(self) -> List[str]:
+        return [server for server in remote_server_configs() if self.uses_rpc(server)]
+
+    def start_connection_keeper(self):
+        if SSH_CONTROL_PERSIST <= 0 or not self._ssh_servers():
+            return
+
+        def keep_connections():
+            while not shutdown_flag.is_set():
+                for server in self._ssh_servers():
+                    if shutdown_flag.is_set():
+                        break
+                    try:
+                        self.ensure_connection(server)
+                    except Exception as exc:
+                        logger.debug(f'检查 {server} 的 SSH 复用连接失败: {exc}')
+                shutdown_flag.wait(SSH_CONTROL_CHECK_INTERVAL)
+
+            with self._rpc_sessions_lock:
+                sessions = list(self._rpc_sessions.values())
+            for session in sessions:
+                session.close()
+            for server in self._ssh_servers():
+                self.close_connection(server)
+
+        threading.Thread(target=keep_connections, name='ssh-connection-keeper', daemon=True).start()
+
+    def _get_rpc_session(self, server: str, config: Dict[str, Any]) -> RemoteRPCSession:
+        with self._rpc_sessions_lock:
+            session = self._rpc_sessions.get(server)
+            if session is None:
+                remote_command = shlex.join([
+                    config['docker_bin'],
+                    'exec',
+                    '-i',
+                    config['monitor_container'],
+                    config['python_bin'],
+                    config['rpc_path'],
+                    'rpc',
+                    'serve',
+                ])
+                command = self._build_ssh_command(config, remote_command, self._control_options(server))
+                session = RemoteRPCSession(server, command)
+                self._rpc_sessions[server] = session
+            return session
+
+    def _handshake_rpc_session(self, server: str, session: RemoteRPCSession) -> bool:
+        try:
+            session.request(['ping'], REMOTE_PING_TIMEOUT)
+        except RPCSessionError as exc:
+            session.close()
+            # SSH 自身失败返回 255；远程进程未应答就正常退出说明不支持 rpc serve
+            if exc.broken and session.last_returncode not in {None, 255}:
+                self._legacy_session_servers.add(server)
+                logger.info(f'{server} 不支持 RPC 会话，改用单次调用')
+            else:
+                logger.warning(f'{server} RPC 会话握手失败，本次回退到单次调用: {exc}')
+            return False
+        return True
+
+    def _run_session_rpc(self, server: str, config: Dict[str, Any], rpc_args: Tuple[str, ...],
+                         timeout: Optional[int],
+                         on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Optional[Dict[str, Any]]:
+        if server in self._legacy_session_servers:
+            return None
+        session = self._get_rpc_session(server, config)
+        if not session.is_alive() and not self._handshake_rpc_session(server, session):
+            return None
+        started_at = time.time()
+        try:
+            payload = session.request(list(rpc_args), timeout or config['command_timeout'], on_event)
+        except RPCSessionError as exc:
+            if exc.broken:
+                session.close()
+            if exc.sent and rpc_args[0] not in self.IDEMPOTENT_RPC_COMMANDS:
+                raise RuntimeError(f'{exc}，操作结果未知，请确认后重试') from exc
+            logger.warning(f'{server} RPC 会话不可用，回退到单次调用: {exc}')
+            return None
+
+        if not payload.get('ok', False):
+            raise RuntimeError(str(payload.get('error') or '远程命令返回失败'))
+        payload['connection'] = {
+            'reused': True,
+            'session': True,
+            'setup_ms': None,
+            'rpc_ms': (time.time() - started_at) * 1000,
+        }
+        return payload
+
+    def _run_remote_rpc(self, server: str, *rpc_args: str, timeout: Optional[int] = None,
+                        on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        config = remote_server_configs().get(server)
         if not config:
             raise RuntimeError(f'未找到服务器 {server} 的远程配置')
 
+        quarantine_message = self.health.check(server)
+        if quarantine_message:
+            raise RemoteUnreachableError(quarantine_message)
+
+        started_at = time.time()
+        try:
+            payload = self._invoke_remote_rpc(server, config, rpc_args, timeout, on_event)
+        except RemoteUnreachableError as exc:
+            self.health.record_failure(server, str(exc))
+            raise
+        except RuntimeError:
+            # 远程命令本身失败说明链路可达
+            self.health.record_success(server)
+            raise
+        except Exception as exc:
+            self.health.record_failure(server, str(exc))
+            raise
+
+        rtt_ms = (time.time() - started_at) * 1000 if rpc_args and rpc_args[0] == 'ping' else None
+        self.health.record_success(server, rtt_ms)
+        return payload
+
+    def _get_agent_session(self, server: str, config: Dict[str, Any]) -> 'requests.Session':
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        with self._agent_sessions_lock:
+            session = self._agent_sessions.get(server)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=AGENT_POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['Authorization'] = f"Bearer {config['token']}"
+                self._agent_sessions[server] = session
+            return session
+
+    def _invoke_agent_rpc(self, server: str, config: Dict[str, Any], rpc_args: Tuple[str, ...],
+                          timeout: Optional[int],
+                          on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        import requests
+
+        session = self._get_agent_session(server, config)
+        idempotent = bool(rpc_args) and rpc_args[0] in self.IDEMPOTENT_RPC_COMMANDS
+        started_at = time.time()
+        try:
+            response = session.post(
+                f"{config['url']}/rpc",
+                json={'args': list(rpc_args)},
+                stream=True,
+                timeout=(config['connect_timeout'], timeout or config['command_timeout']),
+            )
+        except requests.exceptions.ConnectionError as exc:
+            raise RemoteUnreachableError(f'Agent 连接失败: {exc}') from exc
+        except requests.exceptions.Timeout as exc:
+            raise RemoteUnreachableError(f'Agent 请求超时: {server}') from exc
+
+        payload = None
+        try:
+            with response:
+                if response.status_code in {401, 403}:
+                    raise RuntimeError('Agent 认证失败，请检查 token 配置')
+                if response.status_code != 200:
+                    raise RuntimeError(f'Agent 返回 HTTP {response.status_code}: {response.text[:200]}')
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    message = json.loads(line)
+                    if 'event' in message:
+                        if on_event:
+                            try:
+                                on_event(message['event'])
+                            except Exception as exc:
+                                logger.warning(f'处理远程进度事件失败: {exc}')
+                    elif 'payload' in message:
+                        payload = message['payload']
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exc:
+            if idempotent:
+                raise RemoteUnreachableError(f'Agent 响应中断: {exc}') from exc
+            raise RuntimeError(f'Agent 响应中断，操作结果未知，请确认后重试: {exc}') from exc
+        except json.JSONDecodeError as exc:
+            raise RuntimeError(f'Agent 返回内容不是有效 JSON: {exc}') from exc
+
+        if payload is None:
+            raise RuntimeError('Agent 响应缺少结果')
+        if not payload.get('ok', False):
+            raise RuntimeError(str(payload.get('error') or '远程命令返回失败'))
+        payload['connection'] = {
+            'transport': 'agent',
+            'rpc_ms': (time.time() - started_at) * 1000,
+        }
+        return payload
+
+    def _invoke_remote_rpc(self, server: str, config: Dict[str, Any], rpc_args: Tuple[str, ...],
+                           timeout: Optional[int],
+                           on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        if config.get('transport') == 'agent':
+            return self._invoke_agent_rpc(server, config, rpc_args, timeout, on_event)
+
+        if REMOTE_RPC_SESSIONS:
+            payload = self._run_session_rpc(server, config, rpc_args, timeout, on_event)
+            if payload is not None:
+                return payload
+
         remote_command = shlex.join([
             config['docker_bin'],
             'exec',
@@ -725,22 +2382,38 @@ class RemoteServerController:
             'rpc',
             *rpc_args,
         ])
-        ssh_command = self._build_ssh_command(config, remote_command)
+        connection = self.ensure_connection(server)
+        ssh_command = self._build_ssh_command(config, remote_command, self._control_options(server))
 
+        started_at = time.time()
         try:
-            result = subprocess.run(
-                ssh_command,
-                capture_output=True,
-                text=True,
-                timeout=timeout or config['command_timeout'],
-            )
+            if on_event:
+                result = self._run_streaming_command(ssh_command, timeout or config['command_timeout'], on_event)
+            else:
+                result = subprocess.run(
+                    ssh_command,
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout or config['command_timeout'],
+                )
         except subprocess.TimeoutExpired as exc:
+            if rpc_args and rpc_args[0] in self.IDEMPOTENT_RPC_COMMANDS:
+                raise RemoteUnreachableError(f'SSH 远程命令超时: {server}') from exc
             raise RuntimeError(f'SSH 远程命令超时: {server}') from exc
         except Exception as exc:
-            raise RuntimeError(f'SSH 执行失败: {exc}') from exc
+            raise RemoteUnreachableError(f'SSH 执行失败: {exc}') from exc
+        connection['rpc_ms'] = (time.time() - started_at) * 1000
+        setup_text = f"{connection['setup_ms']:.0f}ms" if connection.get('setup_ms') is not None else '未复用'
+        logger.debug(f"SSH RPC {server} {rpc_args[0] if rpc_args else ''}: 建连 {setup_text}, 执行 {connection['rpc_ms']:.0f}ms")
+
+        if result.returncode == 255 and connection.get('reused'):
+            # ssh 自身失败时复用连接可能已失效，下次调用重新建立
+            self.close_connection(server)
 
         if result.returncode != 0:
             message = (result.stderr or result.stdout or '未知错误').strip()[:300]
+            if result.returncode == 255:
+                raise RemoteUnreachableError(f'SSH 连接失败: {message}')
             raise RuntimeError(f'SSH 远程命令失败: {message}')
 
         try:
@@ -751,18 +2424,78 @@ class RemoteServerController:
         if not payload.get('ok', False):
             raise RuntimeError(str(payload.get('error') or '远程命令返回失败'))
 
+        payload['connection'] = connection
         return payload
 
+    @staticmethod
+    def _run_streaming_command(command: List[str], timeout: float,
+                               on_event: Callable[[Dict[str, Any]], None]) -> subprocess.CompletedProcess:
+        with tempfile.TemporaryFile(mode='w+') as stderr_file:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file, text=True, bufsize=1)
+            timer = threading.Timer(timeout, process.kill)
+            timer.start()
+            output_lines = []
+            try:
+                for line in process.stdout:
+                    try:
+                        message = json.loads(line)
+                    except json.JSONDecodeError:
+                        output_lines.append(line)
+                        continue
+                    if isinstance(message, dict) and 'event' in message and 'ok' not in message:
+                        try:
+                            on_event(message)
+                        except Exception as exc:
+                            logger.warning(f'处理远程进度事件失败: {exc}')
+                    else:
+                        output_lines.append(line)
+                returncode = process.wait()
+            finally:
+                timed_out = not timer.is_alive()
+                timer.cancel()
+            if timed_out:
+                raise subprocess.TimeoutExpired(command, timeout)
+            stderr_file.seek(0)
+            return subprocess.CompletedProcess(command, returncode, ''.join(output_lines), stderr_file.read())
+
     def _fetch_inventory_via_ssh(self, server: str) -> Dict[str, Any]:
-        payload = self._run_remote_rpc(server, 'inventory', timeout=60)
-        payload['transport'] = 'ssh'
+        cached = self._inventory_cache.get(server, {}).get('payload') or {}
+        transport = self.transport_of(server)
+        if server in self._legacy_inventory_servers:
+            payload = self._run_remote_rpc(server, 'inventory', timeout=60)
+            payload['transport'] = transport
+            return payload
+
+        options = []
+        if REMOTE_INVENTORY_FIELDS:
+            options.extend(['--fields', ','.join(REMOTE_INVENTORY_FIELDS)])
+        if REMOTE_INVENTORY_COMPRESS:
+            options.append('--compress')
+        since = ['--since', cached['revision']] if cached.get('revision') else []
+
+        try:
+            payload = decode_rpc_payload(self._run_remote_rpc(server, 'inventory', *since, *options, timeout=60))
+        except RuntimeError as exc:
+            if not (since or options) or 'usage:' not in str(exc):
+                raise
+            # 远程仍是旧版本，不认识增量参数
+            logger.info(f'{server} 不支持增量 inventory，改用完整拉取')
+            self._legacy_inventory_servers.add(server)
+            payload = self._run_remote_rpc(server, 'inventory', timeout=60)
+
+        if payload.get('delta'):
+            if payload.get('base_revision') == cached.get('revision'):
+                payload = merge_inventory_delta(cached, payload)
+            else:
+                payload = decode_rpc_payload(self._run_remote_rpc(server, 'inventory', *options, timeout=60))
+        payload['transport'] = transport
         return payload
 
     def get_inventory(self, server: str, force_refresh: bool = False) -> Dict[str, Any]:
         if self.is_local_server(server):
             return self._build_local_inventory()
 
-        if self.uses_ssh(server):
+        if self.uses_rpc(server):
             cache_entry = self._inventory_cache.get(server, {})
             if not force_refresh and cache_entry:
                 cached_at = float(cache_entry.get('cached_at', 0) or 0)
@@ -778,6 +2511,98 @@ class RemoteServerController:
 
         return self._build_legacy_inventory(server)
 
+    def get_cached_inventory(self, server: str,
+                             on_refresh: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        if not self.uses_rpc(server):
+            return self.get_inventory(server)
+
+        cache_entry = self._inventory_cache.get(server)
+        if not cache_entry:
+            return self.get_inventory(server, force_refresh=True)
+
+        age = time.time() - float(cache_entry.get('cached_at', 0) or 0)
+        if age > REMOTE_STALE_MAX_AGE:
+            try:
+                return self.get_inventory(server, force_refresh=True)
+            except Exception as exc:
+                logger.warning(f'刷新服务器 {server} 状态失败，使用缓存数据: {exc}')
+
+        payload = dict(cache_entry['payload'])
+        payload['cache_age'] = age
+        if age >= REMOTE_CACHE_TTL:
+            payload['refreshing'] = True
+            self.refresh_inventory_async(server, on_refresh)
+        return payload
+
+    def refresh_inventory_async(self, server: str,
+                                callback: Optional[Callable[[Dict[str, Any]], None]] = None):
+        with self._refresh_lock:
+            waiters = self._refresh_waiters.get(server)
+            if waiters is not None:
+                if callback:
+                    waiters.append(callback)
+                return
+            self._refresh_waiters[server] = [callback] if callback else []
+
+        def refresh():
+            payload = None
+            try:
+                payload = self.get_inventory(server, force_refresh=True)
+            except Exception as exc:
+                logger.warning(f'后台刷新服务器 {server} 状态失败: {exc}')
+            finally:
+                with self._refresh_lock:
+                    waiters = self._refresh_waiters.pop(server, [])
+            if payload is None:
+                return
+            for waiter in waiters:
+                try:
+                    waiter(dict(payload))
+                except Exception as exc:
+                    logger.warning(f'刷新服务器 {server} 视图失败: {exc}')
+
+        threading.Thread(target=refresh, name=f'inventory-refresh-{server}', daemon=True).start()
+
+    def start_inventory_refreshers(self):
+        if REMOTE_REFRESH_INTERVAL <= 0:
+            return
+
+        def keep_inventory_warm(server: str):
+            failures = 0
+            while not shutdown_flag.is_set():
+                try:
+                    self.get_inventory(server, force_refresh=True)
+                    failures = 0
+                except Exception as exc:
+                    failures += 1
+                    logger.debug(f'预热服务器 {server} 状态失败: {exc}')
+                shutdown_flag.wait(min(REMOTE_REFRESH_INTERVAL * (2 ** min(failures, 4)), 600))
+
+        for server in self._rpc_servers():
+            threading.Thread(
+                target=keep_inventory_warm,
+                args=(server,),
+                name=f'inventory-refresher-{server}',
+                daemon=True
+            ).start()
+
+    def start_health_prober(self):
+        if not self._rpc_servers():
+            return
+
+        def probe_quarantined():
+            while not shutdown_flag.wait(5):
+                for server in self.health.due_for_probe():
+                    try:
+                        self._run_remote_rpc(server, 'ping', timeout=REMOTE_PING_TIMEOUT)
+                        self.invalidate_cache(server)
+                        with self._discovery_lock:
+                            self._discovery_cache.pop(server, None)
+                    except Exception as exc:
+                        logger.debug(f'探测隔离中的服务器 {server} 失败: {exc}')
+
+        threading.Thread(target=probe_quarantined, name='server-health-prober', daemon=True).start()
+
     def get_available_servers(self) -> List[str]:
         servers: List[str] = []
 
@@ -789,18 +2614,75 @@ class RemoteServerController:
                 servers.append(server)
 
         if REMOTE_CONTROL_MODE != 'queue':
-            for server, config in REMOTE_SERVER_CONFIGS.items():
-                if config.get('transport') != 'ssh' or server in servers:
-                    continue
-                try:
-                    self.get_inventory(server)
-                    servers.append(server)
-                except Exception as exc:
-                    logger.warning(f'远程服务器 {server} 不可达，暂不加入在线列表: {exc}')
+            candidates = [
+                server for server in remote_server_configs()
+                if self.uses_rpc(server) and server not in servers
+            ]
+            reachability = self._discover_ssh_servers(candidates)
+            servers.extend(server for server in candidates if reachability.get(server))
 
         return servers
 
-    def execute_action(self, action: str, server: str, container: str) -> Dict[str, Any]:
+    def _ping_budget(self, server: str) -> float:
+        # ping 本身受 REMOTE_PING_TIMEOUT 限制，但建立 SSH 复用连接和 RPC 会话握手在它之前，需要额外预留时间
+        config = remote_server_configs().get(server) or {}
+        budget = float(REMOTE_PING_TIMEOUT)
+        if config.get('transport') == 'agent':
+            return budget + config.get('connect_timeout', SSH_CONNECT_TIMEOUT)
+        if SSH_CONTROL_PERSIST > 0 and not self._connection_stats.get(server, {}).get('connected'):
+            budget += config.get('connect_timeout', SSH_CONNECT_TIMEOUT) + 10
+        if REMOTE_RPC_SESSIONS and server not in self._legacy_session_servers:
+            with self._rpc_sessions_lock:
+                session = self._rpc_sessions.get(server)
+            if session is None or not session.is_alive():
+                budget += REMOTE_PING_TIMEOUT
+        return budget
+
+    def _discover_ssh_servers(self, candidates: List[str]) -> Dict[str, bool]:
+        now = time.time()
+        reachability: Dict[str, bool] = {}
+        stale: List[str] = []
+        with self._discovery_lock:
+            for server in candidates:
+                entry = self._discovery_cache.get(server)
+                if entry and now - entry['checked_at'] < REMOTE_DISCOVERY_TTL:
+                    reachability[server] = entry['reachable']
+                else:
+                    stale.append(server)
+
+        if not stale:
+            return reachability
+
+        import concurrent.futures
+
+        # 每台服务器一个线程同时开始 ping，总耗时受最慢的单台预算限制；超时未返回的线程在后台自行结束
+        budgets = {server: self._ping_budget(server) for server in stale}
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(stale))
+        futures = {
+            executor.submit(self._run_remote_rpc, server, 'ping', timeout=REMOTE_PING_TIMEOUT): server
+            for server in stale
+        }
+        done, _ = concurrent.futures.wait(futures, timeout=max(budgets.values()) + 1)
+        executor.shutdown(wait=False)
+
+        checked_at = time.time()
+        for future, server in futures.items():
+            error = None
+            if future not in done:
+                error = f'ping 超过 {budgets[server]:.0f} 秒未响应'
+            elif future.exception() is not None:
+                error = str(future.exception())
+            reachability[server] = error is None
+            if error:
+                logger.warning(f'远程服务器 {server} 不可达，暂不加入在线列表: {error}')
+
+        with self._discovery_lock:
+            for server in stale:
+                self._discovery_cache[server] = {'reachable': reachability[server], 'checked_at': checked_at}
+        return reachability
+
+    def execute_action(self, action: str, server: str, container: str,
+                       on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
         rpc_action = {
             'confirm_update': 'update',
             'confirm_restart': 'restart',
@@ -814,10 +2696,41 @@ class RemoteServerController:
             '--container',
             container,
             timeout=max(SSH_COMMAND_TIMEOUT, 600),
+            on_event=on_event,
+        )
+        self.invalidate_cache(server)
+        return payload
+
+    def execute_batch(self, action: str, server: str, containers: List[str],
+                      on_event: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+        rpc_action = {
+            'update': 'update-batch',
+            'restart': 'restart-batch',
+        }.get(action)
+        if not rpc_action:
+            raise RuntimeError(f'不支持的批量动作: {action}')
+
+        rounds = (len(containers) + BATCH_CONCURRENCY - 1) // BATCH_CONCURRENCY
+        payload = self._run_remote_rpc(
+            server,
+            rpc_action,
+            '--containers',
+            ','.join(containers),
+            '--concurrency',
+            str(BATCH_CONCURRENCY),
+            timeout=max(SSH_COMMAND_TIMEOUT, 600) * max(rounds, 1),
+            on_event=on_event,
         )
         self.invalidate_cache(server)
         return payload
 
+    def get_top(self, server: str, limit: int = TOP_CONTAINER_LIMIT) -> Dict[str, Any]:
+        if self.is_local_server(server):
+            return build_top_payload(server, self.docker, limit)
+        if not self.uses_rpc(server):
+            raise RuntimeError('队列模式服务器不支持实时资源查询')
+        return self._run_remote_rpc(server, 'top', '--limit', str(limit), timeout=60)
+
     def update_monitor_membership(self, action: str, server: str, container: str) -> Dict[str, Any]:
         rpc_action = {
             'add': 'monitor-add',
@@ -851,7 +2764,7 @@ class CommandCoordinator:
        if any(command.startswith(cmd) for cmd in global_commands):
            return True
 
-       coordinated_commands = ['/status', '/update', '/restart', '/monitor', '/help', '/servers']
+       coordinated_commands = ['/status', '/update', '/restart', '/monitor', '/help', '/servers', '/top']
 
        if not any(command.startswith(cmd) for cmd in coordinated_commands):
            return True
@@ -873,67 +2786,385 @@ class CommandCoordinator:
        logger.debug(f"从服务器忽略回调: {action} (仅主服务器处理 Bot 回调)")
        return False
 
+class NotificationOutbox:
+    COMPACT_THRESHOLD = 200
+
+    def __init__(self, outbox_file: Path):
+        self.outbox_file = outbox_file
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._delivered: Dict[str, float] = {}
+        self._records = 0
+        self._load()
+
+    def _load(self):
+        try:
+            lines = self.outbox_file.read_text(encoding='utf-8').splitlines()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.error(f'读取通知发件箱失败: {e}')
+            return
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 进程在写入途中退出时，最后一行可能不完整
+                continue
+            if record.get('op') == 'add':
+                self._pending[record['id']] = record
+            elif record.get('op') == 'done':
+                self._pending.pop(record.get('id'), None)
+                if record.get('key'):
+                    self._delivered[record['key']] = float(record.get('at') or 0)
+        self._records = len(lines)
+
+    def _append(self, record: Dict[str, Any]):
+        try:
+            with open(self.outbox_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._records += 1
+        except OSError as e:
+            logger.error(f'写入通知发件箱失败: {e}')
+
+    def _compact(self):
+        now = time.time()
+        self._delivered = {
+            key: delivered_at for key, delivered_at in self._delivered.items()
+            if now - delivered_at < OUTBOX_DEDUP_WINDOW
+        }
+        records = list(self._pending.values()) + [
+            {'op': 'done', 'id': None, 'key': key, 'at': delivered_at}
+            for key, delivered_at in self._delivered.items()
+        ]
+        temp_path = self.outbox_file.with_name(f'{self.outbox_file.name}.{uuid.uuid4().hex}.tmp')
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            temp_path.replace(self.outbox_file)
+            self._records = len(records)
+        except OSError as e:
+            temp_path.unlink(missing_ok=True)
+            logger.error(f'压缩通知发件箱失败: {e}')
+
+    def add(self, text: str, priority: int, key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        key = key or hashlib.sha1(text.encode('utf-8')).hexdigest()
+        now = time.time()
+        with self._lock:
+            if any(entry['key'] == key for entry in self._pending.values()):
+                logger.info(f'跳过重复通知（待发送）: {key}')
+                return None
+            if now - self._delivered.get(key, float('-inf')) < OUTBOX_DEDUP_WINDOW:
+                logger.info(f'跳过重复通知（已发送）: {key}')
+                return None
+
+            entry = {
+                'op': 'add',
+                'id': f"{int(now * 1000)}_{uuid.uuid4().hex[:8]}",
+                'key': key,
+                'text': text,
+                'priority': priority,
+                'created_at': now,
+            }
+            self._append(entry)
+            self._pending[entry['id']] = entry
+            return entry
+
+    def mark_done(self, entry_id: str, delivered: bool = True):
+        with self._lock:
+            entry = self._pending.pop(entry_id, None)
+            if not entry:
+                return
+            now = time.time()
+            self._delivered[entry['key']] = now
+            self._append({'op': 'done', 'id': entry_id, 'key': entry['key'], 'at': now, 'delivered': delivered})
+            if self._records > self.COMPACT_THRESHOLD and self._records > 2 * (len(self._pending) + len(self._delivered)):
+                self._compact()
+
+    def pending(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return sorted(self._pending.values(), key=lambda entry: (entry['priority'], entry['created_at']))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            oldest = min((entry['created_at'] for entry in self._pending.values()), default=None)
+            return {
+                'pending': len(self._pending),
+                'oldest_created_at': oldest,
+                'oldest_age': round(time.time() - oldest, 1) if oldest else 0,
+            }
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class TelegramDispatcher:
+    CHAT_BURST = 3
+    MAX_RATE_LIMITED = 10
+
+    def __init__(self, deliver: Callable[[Dict[str, Any]], Dict[str, Any]]):
+        import concurrent.futures
+
+        self._future_class = concurrent.futures.Future
+        self.deliver = deliver
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+        self._pending: List[Tuple[int, int, Dict[str, Any]]] = []
+        self._sequence = 0
+        self._closing = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='telegram-dispatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, endpoint: str, payload: Dict, chat_id: Optional[str], priority: int,
+               timeout: int = 30, max_retries: Optional[int] = 3, allow_plain_fallback: bool = False,
+               transform: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        future = self._future_class()
+        with self._condition:
+            self._sequence += 1
+            job = {
+                'endpoint': endpoint,
+                'payload': payload,
+                'chat_id': str(chat_id) if chat_id is not None else None,
+                'priority': priority,
+                'sequence': self._sequence,
+                'timeout': timeout,
+                'max_retries': max(max_retries, 1) if max_retries is not None else None,
+                'allow_plain_fallback': allow_plain_fallback,
+                'transform': transform,
+                'future': future,
+                'attempts': 0,
+                'rate_limited': 0,
+                'not_before': 0.0,
+            }
+            self._insert(job)
+        return future
+
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def close(self, timeout: float = 10):
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def _insert(self, job: Dict[str, Any]):
+        bisect.insort(self._pending, (job['priority'], job['sequence'], job))
+        self._condition.notify_all()
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(TELEGRAM_CHAT_RATE_PER_MINUTE / 60, self.CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _next_job(self) -> Tuple[Optional[Dict[str, Any]], Optional[float]]:
+        now = time.monotonic()
+        global_wait = self.global_bucket.wait_time(now)
+        waits: List[float] = []
+        # 同一会话内保持顺序：某条消息还不能发送时，跳过该会话后面的消息，转而发送其他会话。
+        # 无限重试的发件箱通知单独成一条通道，离线期间不会挡住有限重试的回复和编辑
+        blocked_lanes: Set[Tuple[Optional[str], bool]] = set()
+        for index, (_, _, job) in enumerate(self._pending):
+            chat_id = job['chat_id']
+            lane = (chat_id, job['max_retries'] is None)
+            if lane in blocked_lanes:
+                continue
+            delay = max(
+                job['not_before'] - now,
+                self._chat_bucket(chat_id).wait_time(now) if chat_id else 0.0,
+                global_wait,
+            )
+            if delay <= 0:
+                del self._pending[index]
+                self.global_bucket.consume()
+                if chat_id:
+                    self._chat_bucket(chat_id).consume()
+                return job, None
+            blocked_lanes.add(lane)
+            waits.append(delay)
+        return None, min(waits) if waits else None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                job, wait = self._next_job()
+                if job is None:
+                    if self._closing and not self._pending:
+                        return
+                    self._condition.wait(wait)
+                    continue
+
+            try:
+                result = self.deliver(job)
+            except Exception as exc:
+                logger.error(f"Telegram 发送异常 [{job['endpoint']}]: {exc}")
+                result = {'ok': False, 'data': {}}
+
+            if self._reschedule(job, result):
+                continue
+            try:
+                value = job['transform'](result) if job['transform'] else result
+            except Exception as exc:
+                logger.error(f'处理 Telegram 返回结果失败: {exc}')
+                value = None
+            job['future'].set_result(value)
+
+    def _reschedule(self, job: Dict[str, Any], result: Dict[str, Any]) -> bool:
+        if result.get('ok') or result.get('permanent'):
+            return False
+
+        # max_retries 为 None 的任务（如发件箱通知）会一直重试直到送达
+        unlimited = job['max_retries'] is None
+        now = time.monotonic()
+        retry_after = result.get('retry_after')
+        if retry_after is not None:
+            job['rate_limited'] += 1
+            if not unlimited and job['rate_limited'] > self.MAX_RATE_LIMITED:
+                return False
+            until = now + retry_after
+            with self._condition:
+                bucket = self._chat_bucket(job['chat_id']) if job['chat_id'] else self.global_bucket
+                bucket.block(until)
+                job['not_before'] = until
+                self._insert(job)
+            return True
+
+        job['attempts'] += 1
+        if not unlimited and job['attempts'] >= job['max_retries']:
+            return False
+        with self._condition:
+            job['not_before'] = now + min(job['attempts'] * 2, 10)
+            self._insert(job)
+        return True
+
+
 class TelegramBot:
-    def __init__(self, token: str, chat_id: str, server_name: str):
+    PRIORITY_CRITICAL = 0
+    PRIORITY_INTERACTIVE = 1
+    PRIORITY_INFO = 2
+    EDIT_INTERVAL = 0.5
+    RESULT_TIMEOUT = 60
+
+    def __init__(self, token: str, chat_id: str, server_name: str,
+                 outbox: Optional['NotificationOutbox'] = None):
+        import requests
+
         self.api_url = f"https://api.telegram.org/bot{token}"
         self.chat_id = chat_id
         self.server_name = server_name
         self.session = requests.Session()
         self.session.headers.update({'Connection': 'keep-alive'})
-        self._last_edit = {}
-
-    def _request(self, endpoint: str, payload: Dict, timeout: int = 30,
-                 max_retries: int = 3, allow_plain_fallback: bool = False) -> Dict:
+        self._edits: Dict[str, Dict[str, Any]] = {}
+        self._edit_lock = threading.Lock()
+        self.dispatcher = TelegramDispatcher(
+            lambda job: self._attempt(job['endpoint'], job['payload'], job['timeout'], job['allow_plain_fallback'])
+        )
+        self.outbox = outbox
+        if outbox:
+            pending = outbox.pending()
+            if pending:
+                logger.info(f'发件箱中有 {len(pending)} 条未送达的通知，开始补发')
+            for entry in pending:
+                self._deliver_outbox_entry(entry)
+
+    def _attempt(self, endpoint: str, payload: Dict, timeout: int = 30,
+                 allow_plain_fallback: bool = False) -> Dict:
         current_payload = dict(payload)
 
-        for attempt in range(max_retries):
+        while True:
             try:
                 response = self.session.post(
                     f"{self.api_url}/{endpoint}",
                     json=current_payload,
                     timeout=timeout
                 )
+            except Exception as e:
+                logger.error(f"Telegram 请求失败 [{endpoint}]: {e}")
+                return {'ok': False, 'data': {}}
 
-                try:
-                    data = response.json()
-                except Exception:
-                    data = {'ok': False, 'description': response.text[:200] or '未知错误'}
-
-                if response.status_code == 200 and data.get('ok'):
-                    return {'ok': True, 'data': data}
-
-                description = str(data.get('description', response.text[:200] or '未知错误'))
-                description_lower = description.lower()
+            try:
+                data = response.json()
+            except Exception:
+                data = {'ok': False, 'description': response.text[:200] or '未知错误'}
 
-                if allow_plain_fallback and current_payload.get('parse_mode') == 'HTML':
-                    if 'parse entities' in description_lower or "can\'t parse" in description_lower:
-                        logger.warning('Telegram HTML 解析失败，尝试纯文本回退发送')
-                        current_payload.pop('parse_mode', None)
-                        current_payload['text'] = strip_html(str(current_payload.get('text', '')))
-                        allow_plain_fallback = False
-                        continue
+            if response.status_code == 200 and data.get('ok'):
+                return {'ok': True, 'data': data}
 
-                if endpoint == 'editMessageText' and 'message is not modified' in description_lower:
-                    return {'ok': True, 'data': data}
+            description = str(data.get('description', response.text[:200] or '未知错误'))
+            description_lower = description.lower()
 
-                if response.status_code == 429:
-                    retry_after = int(data.get('parameters', {}).get('retry_after', attempt + 1))
-                    logger.warning(f"Telegram 触发限流，{retry_after} 秒后重试")
-                    time.sleep(min(max(retry_after, 1), 60))
+            if allow_plain_fallback and current_payload.get('parse_mode') == 'HTML':
+                if 'parse entities' in description_lower or "can\'t parse" in description_lower:
+                    logger.warning('Telegram HTML 解析失败，尝试纯文本回退发送')
+                    current_payload.pop('parse_mode', None)
+                    current_payload['text'] = strip_html(str(current_payload.get('text', '')))
+                    allow_plain_fallback = False
                     continue
 
-                logger.error(f"Telegram API 错误 [{endpoint}]: {description}")
+            if endpoint == 'editMessageText' and 'message is not modified' in description_lower:
+                return {'ok': True, 'data': data}
 
-            except Exception as e:
-                logger.error(f"Telegram 请求失败 [{endpoint}]: {e}")
+            if response.status_code == 429:
+                retry_after = int(data.get('parameters', {}).get('retry_after', 1))
+                logger.warning(f"Telegram 触发限流，{retry_after} 秒后重试")
+                return {'ok': False, 'data': data, 'retry_after': min(max(retry_after, 1), 60)}
+
+            logger.error(f"Telegram API 错误 [{endpoint}]: {description}")
+            # 请求本身有问题（如会话不存在、机器人被屏蔽），重试也不会成功
+            return {'ok': False, 'data': data, 'permanent': response.status_code in {400, 403}}
 
+    def _request(self, endpoint: str, payload: Dict, timeout: int = 30,
+                 max_retries: int = 3, allow_plain_fallback: bool = False) -> Dict:
+        for attempt in range(max_retries):
+            result = self._attempt(endpoint, payload, timeout, allow_plain_fallback)
+            if result.get('ok'):
+                return result
             if attempt < max_retries - 1:
-                time.sleep(min((attempt + 1) * 2, 10))
+                time.sleep(result.get('retry_after') or min((attempt + 1) * 2, 10))
 
         return {'ok': False, 'data': {}}
 
-    def send_message(self, text: str, reply_markup: Optional[Dict] = None,
-                     max_retries: int = 3) -> bool:
+    @staticmethod
+    def _result_message_id(result: Dict) -> Optional[str]:
+        if not result.get('ok'):
+            return None
+        message_id = (result['data'].get('result') or {}).get('message_id')
+        return str(message_id) if message_id else None
+
+    def close(self, timeout: float = 10):
+        self.dispatcher.close(timeout)
+
+    def send_message_async(self, text: str, reply_markup: Optional[Dict] = None,
+                           priority: int = PRIORITY_INTERACTIVE, max_retries: int = 3):
         payload = {
             'chat_id': self.chat_id,
             'text': text,
@@ -942,45 +3173,159 @@ class TelegramBot:
         if reply_markup:
             payload['reply_markup'] = json.dumps(reply_markup)
 
-        result = self._request(
+        return self.dispatcher.submit(
             'sendMessage',
             payload,
+            self.chat_id,
+            priority,
             timeout=30,
             max_retries=max_retries,
+            allow_plain_fallback=True,
+            transform=self._result_message_id
+        )
+
+    def send_message(self, text: str, reply_markup: Optional[Dict] = None,
+                     max_retries: int = 3, priority: int = PRIORITY_INTERACTIVE) -> 'concurrent.futures.Future':
+        return self.send_message_async(text, reply_markup, priority=priority, max_retries=max_retries)
+
+    def notify(self, text: str, priority: int = PRIORITY_INFO, key: Optional[str] = None) -> bool:
+        if not self.outbox:
+            self.send_message(text, priority=priority)
+            return True
+
+        entry = self.outbox.add(text, priority, key)
+        if entry:
+            self._deliver_outbox_entry(entry)
+        return True
+
+    def _deliver_outbox_entry(self, entry: Dict[str, Any]):
+        future = self.dispatcher.submit(
+            'sendMessage',
+            {'chat_id': self.chat_id, 'text': entry['text'], 'parse_mode': 'HTML'},
+            self.chat_id,
+            entry['priority'],
+            timeout=30,
+            max_retries=None,
             allow_plain_fallback=True
         )
-        return result.get('ok', False)
+
+        def on_done(done):
+            delivered = done.result().get('ok', False)
+            if not delivered:
+                logger.error(f"通知无法送达，已从发件箱移除: {entry['key']}")
+            self.outbox.mark_done(entry['id'], delivered)
+
+        future.add_done_callback(on_done)
+
+    def send_message_get_id(self, text: str, reply_markup: Optional[Dict] = None) -> Optional[str]:
+        import concurrent.futures
+
+        try:
+            return self.send_message_async(text, reply_markup).result(timeout=self.RESULT_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            logger.warning(f'发送消息超过 {self.RESULT_TIMEOUT} 秒未完成，放弃等待')
+            return None
 
     def edit_message(self, chat_id: str, message_id: str, text: str,
-                     reply_markup: Optional[Dict] = None, max_retries: int = 3) -> bool:
+                     reply_markup: Optional[Dict] = None, max_retries: int = 3,
+                     final: bool = False) -> bool:
         edit_key = f"{chat_id}:{message_id}"
-        current_time = time.time()
-        if edit_key in self._last_edit and current_time - self._last_edit[edit_key] < 0.5:
-            logger.debug(f"跳过频繁编辑: {message_id}")
-            return False
+        content = (text, json.dumps(reply_markup, sort_keys=True) if reply_markup else None)
+        with self._edit_lock:
+            state = self._edits.get(edit_key)
+            if state is None:
+                self._prune_edits()
+                state = {'submitted': None, 'pending': None, 'sent_at': 0.0, 'timer': None}
+                self._edits[edit_key] = state
+            state['updated_at'] = time.monotonic()
+
+            if content == state['submitted']:
+                # 与已提交的内容一致：丢弃尚未发送的旧内容，无需再调用 API
+                state['pending'] = None
+                return True
 
-        self._last_edit[edit_key] = current_time
+            delay = state['sent_at'] + self.EDIT_INTERVAL - time.monotonic()
+            if delay > 0 and not final:
+                # 节流期内只保留最新内容，到期后统一发送
+                state['pending'] = (chat_id, message_id, content, reply_markup, max_retries)
+                if state['timer'] is None:
+                    state['timer'] = threading.Timer(delay, self._flush_edit, args=(edit_key,))
+                    state['timer'].daemon = True
+                    state['timer'].start()
+                return True
+
+            state['pending'] = None
+            state['submitted'] = content
+            state['sent_at'] = time.monotonic()
+            future = self._enqueue_edit(chat_id, message_id, content, reply_markup, max_retries)
+        if not final:
+            # 进度编辑不等待发送结果：回调可能正处在 docker rm 与 docker run 之间，不能被限流拖住
+            future.add_done_callback(lambda done: self._edit_done(edit_key, content, done.result()))
+            return True
+        import concurrent.futures
+
+        try:
+            result = future.result(timeout=self.RESULT_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            # Telegram 不可达时不能让调用方（如远程任务线程）无限期卡住
+            logger.warning(f'编辑消息超过 {self.RESULT_TIMEOUT} 秒未完成，放弃等待')
+            result = {'ok': False}
+        return self._edit_done(edit_key, content, result)
+
+    def _flush_edit(self, edit_key: str):
+        with self._edit_lock:
+            state = self._edits.get(edit_key)
+            if not state:
+                return
+            state['timer'] = None
+            pending, state['pending'] = state['pending'], None
+            if not pending or pending[2] == state['submitted']:
+                return
+            state['submitted'] = pending[2]
+            state['sent_at'] = time.monotonic()
+            future = self._enqueue_edit(*pending)
+        future.add_done_callback(lambda done: self._edit_done(edit_key, pending[2], done.result()))
+
+    def _enqueue_edit(self, chat_id: str, message_id: str, content: Tuple[str, Optional[str]],
+                      reply_markup: Optional[Dict], max_retries: int):
+        # 在持有编辑锁时入队，保证同一消息的编辑按提交顺序到达
         payload = {
             'chat_id': chat_id,
             'message_id': message_id,
-            'text': text,
+            'text': content[0],
             'parse_mode': 'HTML'
         }
         if reply_markup:
             payload['reply_markup'] = json.dumps(reply_markup)
 
-        result = self._request(
+        return self.dispatcher.submit(
             'editMessageText',
             payload,
+            chat_id,
+            self.PRIORITY_INTERACTIVE,
             timeout=30,
             max_retries=max_retries,
             allow_plain_fallback=True
         )
+
+    def _edit_done(self, edit_key: str, content: Tuple[str, Optional[str]], result: Dict[str, Any]) -> bool:
         if result.get('ok'):
             return True
 
+        with self._edit_lock:
+            state = self._edits.get(edit_key)
+            if state and state['submitted'] == content:
+                state['submitted'] = None
         return False
 
+    def _prune_edits(self):
+        if len(self._edits) < 500:
+            return
+        expired_before = time.monotonic() - 3600
+        for edit_key, state in list(self._edits.items()):
+            if state['updated_at'] < expired_before and not state['pending']:
+                del self._edits[edit_key]
+
     def answer_callback(self, callback_query_id: str, text: str = '', show_alert: bool = False) -> bool:
         payload = {
             'callback_query_id': callback_query_id,
@@ -989,8 +3334,10 @@ class TelegramBot:
         if text:
             payload['text'] = text
 
-        result = self._request('answerCallbackQuery', payload, timeout=10, max_retries=2)
-        return result.get('ok', False)
+        # 回调应答不计入会话限流，也不需要等待结果
+        self.dispatcher.submit('answerCallbackQuery', payload, None, self.PRIORITY_INTERACTIVE,
+                               timeout=10, max_retries=2)
+        return True
 
     def get_updates(self, offset: int = 0, timeout: int = 30) -> Optional[List]:
         payload = {'offset': offset, 'timeout': timeout}
@@ -999,7 +3346,62 @@ class TelegramBot:
             return result['data'].get('result', [])
         return None
 
+class NotificationDigest:
+    # 分类: (图标, 标题, 优先级, 提示)；按发送顺序排列，失败类在前
+    CATEGORIES = {
+        'update_failure': ('❌', '自动更新失败', TelegramBot.PRIORITY_CRITICAL, ''),
+        'check_error': ('⚠️', '检查更新失败', TelegramBot.PRIORITY_CRITICAL, ''),
+        'update_success': ('✨', '容器更新成功', TelegramBot.PRIORITY_INFO, ''),
+        'update_available': ('🆕', '发现可用更新', TelegramBot.PRIORITY_INFO, '💡 当前为仅通知模式，可通过 /update 手动更新'),
+    }
+
+    def __init__(self, server_name: str):
+        self.server_name = server_name
+        self._events: Dict[str, List[Dict[str, str]]] = {}
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def add(self, category: str, message: str, line: str, key: str) -> bool:
+        with self._lock:
+            if self._closed:
+                return False
+            self._events.setdefault(category, []).append({'message': message, 'line': line, 'key': key})
+            return True
+
+    def close(self) -> List[Tuple[str, int, str]]:
+        with self._lock:
+            self._closed = True
+            events = self._events
+
+        messages: List[Tuple[str, int, str]] = []
+        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for category, (icon, title, priority, hint) in self.CATEGORIES.items():
+            items = events.get(category) or []
+            if len(items) == 1:
+                messages.append((items[0]['message'], priority, items[0]['key']))
+                continue
+            if not items:
+                continue
+
+            digest_key = hashlib.sha1('\n'.join(sorted(item['key'] for item in items)).encode('utf-8')).hexdigest()[:16]
+            footer = f'⏰ <b>时间</b>\n  <code>{current_time}</code>'
+            if hint:
+                footer += f'\n\n{hint}'
+            parts = split_message_blocks(
+                f'<b>[{escape_html(self.server_name)}]</b> {icon} <b>{title} ({len(items)})</b>',
+                [item['line'] for item in items],
+                footer
+            )
+            for index, text in enumerate(parts):
+                messages.append((text, priority, f'digest:{category}:{digest_key}:{index}'))
+        return messages
+
+
 class DockerManager:
+    update_journal: Optional[UpdateJournal] = None
+    step_timings: Optional[StepTimingStore] = None
+    resource_sampler: Optional[CgroupResourceSampler] = None
+
     @staticmethod
     def _shorten_message(message: str, limit: int = 300) -> str:
         message = (message or '').strip()
@@ -1227,6 +3629,11 @@ class DockerManager:
             logger.debug(f'获取镜像 {image} ID 失败: {e}')
         return ''
 
+    @staticmethod
+    def _has_target_image(image: str, target_image_id: Optional[str]) -> bool:
+        # 检查阶段已拉取并确定目标版本时，只要本地标签仍指向它就不再访问镜像仓库
+        return bool(target_image_id) and DockerManager.get_image_id(image) == target_image_id
+
     @staticmethod
     def pull_image(image: str, timeout: int = 300) -> Dict:
         result = {
@@ -1241,7 +3648,15 @@ class DockerManager:
         try:
             attempts = 3
             for attempt in range(1, attempts + 1):
-                pull_result = DockerManager._run(['docker', 'pull', image], timeout=timeout)
+                # 只统计单次尝试的耗时，重试间隔不计入学习到的拉取超时
+                attempt_started_at = time.time()
+                try:
+                    pull_result = DockerManager._run(['docker', 'pull', image], timeout=timeout)
+                except subprocess.TimeoutExpired:
+                    result['attempt_seconds'] = time.time() - attempt_started_at
+                    result['timed_out'] = True
+                    raise
+                result['attempt_seconds'] = time.time() - attempt_started_at
                 if pull_result.returncode == 0:
                     break
 
@@ -1278,46 +3693,560 @@ class DockerManager:
             return result
 
     @staticmethod
-    def wait_container_ready(container: str, timeout: int = 90) -> bool:
-        deadline = time.time() + timeout
-        while time.time() < deadline:
-            info = DockerManager.get_container_inspect(container)
-            if not info:
-                time.sleep(2)
-                continue
+    def wait_container_ready(container: str, timeout: int = 90) -> bool:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            info = DockerManager.get_container_inspect(container)
+            if not info:
+                time.sleep(2)
+                continue
+
+            state = info.get('State', {})
+            if not state.get('Running', False):
+                time.sleep(2)
+                continue
+
+            health = state.get('Health')
+            if not health:
+                return True
+
+            status = health.get('Status')
+            if status == 'healthy':
+                return True
+            if status == 'unhealthy':
+                return False
+
+            time.sleep(2)
+
+        return False
+
+    @staticmethod
+    def get_container_ids() -> Dict[str, str]:
+        try:
+            result = DockerManager._run(
+                ['docker', 'ps', '--no-trunc', '--format', '{{.ID}}\t{{.Names}}'],
+                timeout=10
+            )
+            if result.returncode == 0:
+                containers = {}
+                for line in result.stdout.splitlines():
+                    container_id, _, name = line.partition('\t')
+                    if container_id.strip() and name.strip():
+                        containers[container_id.strip()] = name.strip()
+                return containers
+        except Exception as e:
+            logger.error(f'获取容器 ID 列表失败: {e}')
+        return {}
+
+    @staticmethod
+    def _parse_docker_stats_line(data: Dict[str, Any]) -> Dict[str, Any]:
+        memory_usage = str(data.get('MemUsage', '')).split('/')[0]
+        net_io = str(data.get('NetIO', '')).split('/')
+        return {
+            'id': str(data.get('ID', '')),
+            'name': str(data.get('Name', '')),
+            'cpu_percent': float(str(data.get('CPUPerc', '0')).rstrip('%') or 0),
+            'memory_bytes': parse_byte_size(memory_usage),
+            'io_read_bps': None,
+            'io_write_bps': None,
+            'net_bytes': sum(parse_byte_size(part) for part in net_io) if data.get('NetIO') else None,
+        }
+
+    @staticmethod
+    def get_resource_usage() -> Dict[str, Any]:
+        sampler = DockerManager.resource_sampler
+        if sampler and sampler.available():
+            containers = DockerManager.get_container_ids()
+            samples = sampler.sample(containers)
+            if samples or not containers:
+                return {'source': 'cgroup', 'containers': samples}
+
+        result = DockerManager._run(['docker', 'stats', '--no-stream', '--format', '{{json .}}'], timeout=30)
+        if result.returncode != 0:
+            raise RuntimeError((result.stderr or result.stdout or 'docker stats 执行失败').strip()[:200])
+
+        samples = []
+        for line in result.stdout.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                samples.append(DockerManager._parse_docker_stats_line(json.loads(line)))
+            except (json.JSONDecodeError, ValueError):
+                continue
+        return {'source': 'docker_stats', 'containers': samples}
+
+    @staticmethod
+    def sample_container_resources(container: str) -> Dict[str, Any]:
+        inspect = DockerManager.get_container_inspect(container)
+        if not inspect:
+            return {}
+
+        usage = {}
+        sampler = DockerManager.resource_sampler
+        container_id = inspect.get('Id', '')
+        if sampler and container_id and sampler.available():
+            samples = sampler.sample({container_id: container}, settle=0.5)
+            if samples:
+                usage = samples[0]
+
+        if not usage:
+            try:
+                stats = DockerManager._run(
+                    ['docker', 'stats', '--no-stream', '--format', '{{json .}}', container],
+                    timeout=15
+                )
+                if stats.returncode != 0:
+                    return {}
+                usage = DockerManager._parse_docker_stats_line(extract_json_payload(stats.stdout))
+            except Exception as e:
+                logger.debug(f'采集容器 {container} 资源失败: {e}')
+                return {}
+
+        return {
+            'cpu_percent': usage['cpu_percent'],
+            'memory_bytes': usage['memory_bytes'],
+            'restart_count': int(inspect.get('RestartCount', 0) or 0),
+            'running': bool((inspect.get('State') or {}).get('Running', False)),
+            'sampled_at': time.time(),
+        }
+
+    @staticmethod
+    def sample_container_activity(container: str) -> Dict[str, Any]:
+        try:
+            stats = DockerManager._run(
+                ['docker', 'stats', '--no-stream', '--format', '{{json .}}', container],
+                timeout=15
+            )
+            if stats.returncode != 0:
+                return {}
+            usage = DockerManager._parse_docker_stats_line(extract_json_payload(stats.stdout))
+        except Exception as e:
+            logger.debug(f'采集容器 {container} 活动失败: {e}')
+            return {}
+
+        sampler = DockerManager.resource_sampler
+        if sampler and usage['id'] and sampler.available():
+            samples = sampler.sample({usage['id']: container}, settle=0.5)
+            if samples:
+                usage['cpu_percent'] = samples[0]['cpu_percent']
+
+        return {'cpu_percent': usage['cpu_percent'], 'net_bytes': usage['net_bytes']}
+
+    @staticmethod
+    def collect_resource_profile(container: str, duration: int, warmup: int = 0) -> Dict[str, Any]:
+        samples = []
+        failed = 0
+        running = True
+        started_at = time.time()
+        deadline = started_at + duration
+        while True:
+            sample = DockerManager.sample_container_resources(container)
+            if sample:
+                sample['offset'] = time.time() - started_at
+                samples.append(sample)
+            else:
+                # 单次采样失败（如 docker stats 超时）不结束观察，除非容器确实已停止
+                failed += 1
+                inspect = DockerManager.get_container_inspect(container)
+                running = bool((inspect.get('State') or {}).get('Running', False))
+                if not running:
+                    break
+            if time.time() + PERF_SAMPLE_INTERVAL > deadline or shutdown_flag.is_set():
+                break
+            time.sleep(PERF_SAMPLE_INTERVAL)
+
+        if not samples:
+            return {'samples': 0, 'failed_samples': failed, 'running': running}
+
+        # 新容器启动初期的 CPU 尖峰不代表稳定负载，预热窗口内的样本不计入均值
+        cpu_samples = [sample for sample in samples if sample['offset'] >= warmup] or samples[-1:]
+        return {
+            'samples': len(samples),
+            'failed_samples': failed,
+            'cpu_percent': sum(sample['cpu_percent'] for sample in cpu_samples) / len(cpu_samples),
+            'memory_bytes': samples[-1]['memory_bytes'],
+            'memory_peak_bytes': max(sample['memory_bytes'] for sample in samples),
+            'restart_count_start': samples[0]['restart_count'],
+            'restart_count': samples[-1]['restart_count'],
+            'running': samples[-1]['running'] and running,
+        }
+
+    @staticmethod
+    def detect_performance_regression(baseline: Dict[str, Any], observed: Dict[str, Any]) -> Optional[str]:
+        if not observed or observed.get('samples') == 0:
+            # 全部采样失败时只有确认容器已停止才算回退，否则可能只是采集链路暂时不可用
+            if observed.get('running') is False:
+                return '观察期内无法采集新容器资源数据，容器已停止运行'
+            return None
+
+        if not observed.get('running', True):
+            return '观察期内新容器已停止运行'
+
+        restarts = int(observed.get('restart_count', 0)) - int(observed.get('restart_count_start', 0))
+        if restarts > 0:
+            return f'观察期内新容器重启了 {restarts} 次'
+
+        base_cpu = float(baseline.get('cpu_percent', 0))
+        new_cpu = float(observed.get('cpu_percent', 0))
+        if new_cpu - base_cpu > PERF_CPU_MIN_DELTA and new_cpu > base_cpu * PERF_CPU_REGRESSION_FACTOR:
+            return f'CPU 占用从 {base_cpu:.1f}% 升至 {new_cpu:.1f}%'
+
+        base_memory = float(baseline.get('memory_bytes', 0))
+        new_memory = float(observed.get('memory_bytes', 0))
+        if (
+            new_memory - base_memory > PERF_MEMORY_MIN_DELTA_MB * 1024 * 1024
+            and new_memory > base_memory * PERF_MEMORY_REGRESSION_FACTOR
+        ):
+            return f'内存占用从 {format_byte_size(base_memory)} 升至 {format_byte_size(new_memory)}'
+
+        return None
+
+    @staticmethod
+    def _collect_update_baseline(container: str, progress_callback=None) -> Dict[str, Any]:
+        if POST_UPDATE_OBSERVE_SECONDS <= 0:
+            return {}
+        if progress_callback:
+            progress_callback('📈 正在采集更新前资源基线...')
+        baseline = DockerManager.collect_resource_profile(container, PERF_BASELINE_SECONDS)
+        return baseline if baseline.get('samples') else {}
+
+    @staticmethod
+    def _observe_post_update(container: str, baseline: Dict[str, Any], result: Dict[str, Any],
+                             progress_callback=None) -> Optional[str]:
+        if not baseline or POST_UPDATE_OBSERVE_SECONDS <= 0:
+            return None
+
+        if progress_callback:
+            progress_callback(f'🔬 正在观察新版本资源表现 ({POST_UPDATE_OBSERVE_SECONDS}s)...')
+        observed = DockerManager.collect_resource_profile(container, POST_UPDATE_OBSERVE_SECONDS, PERF_WARMUP_SECONDS)
+        result['resource_profile'] = {'baseline': baseline, 'observed': observed}
+        regression = DockerManager.detect_performance_regression(baseline, observed)
+        if regression:
+            logger.warning(f'容器 {container} 更新后性能回退: {regression}')
+            result['perf_regression'] = regression
+        return regression
+
+    @staticmethod
+    def get_readiness_probe(container: str, container_config: Dict) -> Optional[Dict[str, Any]]:
+        labels = ((container_config.get('Config') or {}).get('Labels') or {})
+        probe = None
+        label_spec = labels.get(READINESS_PROBE_LABEL)
+        if label_spec:
+            try:
+                probe = parse_probe_spec(label_spec)
+            except (TypeError, ValueError):
+                probe = None
+            if not probe:
+                logger.warning(f'容器 {container} 的就绪探测标签无效: {label_spec}')
+        if not probe:
+            probe = readiness_probes().get(container)
+        if not probe:
+            return None
+
+        probe = dict(probe)
+        expected_status = labels.get(f'{READINESS_PROBE_LABEL}.status', '')
+        if probe['type'] == 'http' and str(expected_status).isdigit():
+            probe['expected_status'] = int(expected_status)
+
+        networks = ((container_config.get('NetworkSettings') or {}).get('Networks') or {})
+        container_ip = next((net.get('IPAddress') for net in networks.values() if net.get('IPAddress')), '')
+        for key in ('url', 'host'):
+            if key in probe and '{ip}' in str(probe[key]):
+                probe[key] = str(probe[key]).replace('{ip}', container_ip or '127.0.0.1')
+        return probe
+
+    @staticmethod
+    def _probe_once(container: str, probe: Dict[str, Any], timeout: float,
+                    since: str = '') -> Dict[str, Any]:
+        started_at = time.time()
+        if probe['type'] == 'http':
+            import requests
+
+            response = requests.get(probe['url'], timeout=timeout, allow_redirects=False)
+            latency_ms = (time.time() - started_at) * 1000
+            expected = probe.get('expected_status')
+            success = response.status_code == expected if expected else 200 <= response.status_code < 400
+            return {'success': success, 'latency_ms': latency_ms, 'detail': f'HTTP {response.status_code}'}
+
+        if probe['type'] == 'tcp':
+            with socket.create_connection((probe['host'], probe['port']), timeout=timeout):
+                latency_ms = (time.time() - started_at) * 1000
+            return {'success': True, 'latency_ms': latency_ms, 'detail': 'TCP 已连通'}
+
+        command = ['docker', 'logs']
+        if since:
+            command.extend(['--since', since])
+        command.append(container)
+        logs = DockerManager._run(command, timeout=max(int(timeout), 5))
+        output = f'{logs.stdout or ""}\n{logs.stderr or ""}'
+        matched = re.search(probe['pattern'], output) is not None
+        return {'success': matched, 'latency_ms': None, 'detail': '日志已匹配' if matched else '日志未匹配'}
+
+    @staticmethod
+    def run_readiness_probe(container: str, probe: Dict[str, Any], timeout: int,
+                            container_config: Optional[Dict] = None) -> Dict[str, Any]:
+        target = probe.get('url') or probe.get('pattern') or f"{probe.get('host')}:{probe.get('port')}"
+        outcome = {
+            'type': probe['type'],
+            'target': target,
+            'success': False,
+            'attempts': 0,
+            'latency_ms': None,
+            'detail': '',
+        }
+        since = ((container_config or {}).get('State') or {}).get('StartedAt', '')
+        started_at = time.time()
+        deadline = started_at + timeout
+        while time.time() < deadline and not shutdown_flag.is_set():
+            outcome['attempts'] += 1
+            try:
+                attempt = DockerManager._probe_once(container, probe, min(5.0, max(deadline - time.time(), 1.0)), since)
+                outcome['detail'] = attempt['detail']
+                if attempt['success']:
+                    outcome['success'] = True
+                    outcome['latency_ms'] = attempt['latency_ms']
+                    break
+            except Exception as e:
+                outcome['detail'] = str(e)[:200]
+            time.sleep(1)
+
+        outcome['elapsed'] = time.time() - started_at
+        return outcome
+
+    @staticmethod
+    def _probe_ready_timed(container: str, result: Dict[str, Any]) -> bool:
+        container_config = DockerManager.get_container_inspect(container)
+        probe = DockerManager.get_readiness_probe(container, container_config) if container_config else None
+        if not probe:
+            return True
 
-            state = info.get('State', {})
-            if not state.get('Running', False):
-                time.sleep(2)
-                continue
+        timeout = DockerManager.step_timeout(container, 'probe', READINESS_PROBE_TIMEOUT)
+        outcome = DockerManager.run_readiness_probe(container, probe, timeout, container_config)
+        result['probe'] = {key: value for key, value in outcome.items() if key != 'elapsed'}
+        if outcome['success']:
+            DockerManager._record_step(container, 'probe', outcome['elapsed'], result.setdefault('timings', {}))
+            return True
 
-            health = state.get('Health')
-            if not health:
-                return True
+        if outcome['elapsed'] >= timeout:
+            DockerManager._record_step(container, 'probe', outcome['elapsed'])
+        result['readiness_error'] = f"就绪探测未通过 ({probe['type']}): {outcome['detail'] or '超时'}"
+        logger.warning(f'容器 {container} {result["readiness_error"]}')
+        return False
 
-            status = health.get('Status')
-            if status == 'healthy':
-                return True
-            if status == 'unhealthy':
-                return False
+    @staticmethod
+    def step_timeout(container: str, step: str, default: int) -> int:
+        store = DockerManager.step_timings
+        if not store or not ADAPTIVE_TIMEOUTS:
+            return default
+        return store.timeout_for(container, step, default)
 
-            time.sleep(2)
+    @staticmethod
+    def _record_step(container: str, step: str, duration: float, timings: Optional[Dict[str, float]] = None,
+                     censored: bool = False):
+        if timings is not None:
+            timings[step] = round(duration, 1)
+        store = DockerManager.step_timings
+        if store:
+            store.record(container, step, duration, censored)
+
+    @staticmethod
+    def _run_timed_step(container: str, step: str, command: List[str], default_timeout: int,
+                        timings: Optional[Dict[str, float]] = None) -> subprocess.CompletedProcess:
+        timeout = DockerManager.step_timeout(container, step, default_timeout)
+        started_at = time.time()
+        try:
+            completed = DockerManager._run(command, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            DockerManager._record_step(container, step, time.time() - started_at, censored=True)
+            raise
+        if completed.returncode == 0:
+            DockerManager._record_step(container, step, time.time() - started_at, timings)
+        return completed
 
+    @staticmethod
+    def _wait_ready_timed(container: str, result: Dict[str, Any], default_timeout: int = 90) -> bool:
+        timings = result.setdefault('timings', {})
+        timeout = DockerManager.step_timeout(container, 'ready', default_timeout)
+        started_at = time.time()
+        ready = DockerManager.wait_container_ready(container, timeout=timeout)
+        elapsed = time.time() - started_at
+        if ready:
+            store = DockerManager.step_timings
+            regression = store.check_regression(container, 'ready', elapsed) if store else None
+            if regression:
+                logger.warning(f'容器 {container} 就绪时间回归: {regression}')
+                result['timing_alert'] = regression
+            DockerManager._record_step(container, 'ready', elapsed, timings)
+            return DockerManager._probe_ready_timed(container, result)
+        if elapsed >= timeout:
+            DockerManager._record_step(container, 'ready', elapsed)
         return False
 
     @staticmethod
     def restart_container(container: str) -> bool:
         try:
-            result = DockerManager._run(['docker', 'restart', container], timeout=60)
+            result = DockerManager._run_timed_step(container, 'restart', ['docker', 'restart', container], 60)
             if result.returncode != 0:
                 return False
-            return DockerManager.wait_container_ready(container, timeout=60)
+            return DockerManager._wait_ready_timed(container, {}, default_timeout=60)
         except Exception as e:
             logger.error(f'重启容器 {container} 失败: {e}')
             return False
 
+    RUN_CONFIG_KEYS = ('WorkingDir', 'User', 'Hostname', 'Env', 'Labels', 'Healthcheck', 'Entrypoint', 'Cmd')
+    RUN_HOST_CONFIG_KEYS = (
+        'NetworkMode', 'RestartPolicy', 'Privileged', 'ReadonlyRootfs', 'ShmSize', 'NanoCpus', 'Memory',
+        'PidsLimit', 'LogConfig', 'ExtraHosts', 'CapAdd', 'CapDrop', 'Dns', 'DnsSearch', 'PortBindings',
+    )
+    RUN_MOUNT_KEYS = ('Name', 'Source', 'Destination', 'Mode', 'RW')
+
+    @staticmethod
+    def run_config_snapshot(container_config: Dict) -> Dict:
+        # 只保留 build_run_command 用到的字段，避免把完整 inspect 结果写入更新日志
+        config_section = container_config.get('Config') or {}
+        host_config = container_config.get('HostConfig') or {}
+        return {
+            'Config': {key: config_section[key] for key in DockerManager.RUN_CONFIG_KEYS if key in config_section},
+            'HostConfig': {key: host_config[key] for key in DockerManager.RUN_HOST_CONFIG_KEYS if key in host_config},
+            'Mounts': [
+                {key: mount[key] for key in DockerManager.RUN_MOUNT_KEYS if key in mount}
+                for mount in container_config.get('Mounts') or []
+            ],
+        }
+
+    @staticmethod
+    def build_run_command(container: str, container_config: Dict, image_ref: str,
+                          preserve_compose_labels: bool = False) -> List[str]:
+        host_config = container_config.get('HostConfig', {})
+        config_section = container_config.get('Config', {})
+        run_cmd = ['docker', 'run', '-d', '--name', container]
+
+        network_mode = host_config.get('NetworkMode', 'bridge')
+        if network_mode:
+            run_cmd.extend(['--network', network_mode])
+
+        restart_policy = host_config.get('RestartPolicy', {}) or {}
+        restart_name = restart_policy.get('Name')
+        if restart_name:
+            if restart_name == 'on-failure' and restart_policy.get('MaximumRetryCount'):
+                run_cmd.extend(['--restart', f"{restart_name}:{restart_policy['MaximumRetryCount']}"])
+            else:
+                run_cmd.extend(['--restart', restart_name])
+
+        if host_config.get('Privileged'):
+            run_cmd.append('--privileged')
+        if host_config.get('ReadonlyRootfs'):
+            run_cmd.append('--read-only')
+        if host_config.get('ShmSize'):
+            run_cmd.extend(['--shm-size', str(host_config['ShmSize'])])
+        if host_config.get('NanoCpus'):
+            run_cmd.extend(['--cpus', str(host_config['NanoCpus'] / 1_000_000_000)])
+        if host_config.get('Memory'):
+            run_cmd.extend(['--memory', str(host_config['Memory'])])
+        if host_config.get('PidsLimit') and host_config.get('PidsLimit') > 0:
+            run_cmd.extend(['--pids-limit', str(host_config['PidsLimit'])])
+
+        if config_section.get('WorkingDir'):
+            run_cmd.extend(['-w', config_section['WorkingDir']])
+        if config_section.get('User'):
+            run_cmd.extend(['-u', config_section['User']])
+        if config_section.get('Hostname'):
+            run_cmd.extend(['--hostname', config_section['Hostname']])
+
+        for env in config_section.get('Env', []) or []:
+            run_cmd.extend(['-e', env])
+
+        labels = config_section.get('Labels') or {}
+        for key, value in labels.items():
+            if key.startswith('com.docker.compose.') and not preserve_compose_labels:
+                continue
+            run_cmd.extend(['--label', key if value in (None, '') else f'{key}={value}'])
+
+        log_config = host_config.get('LogConfig', {}) or {}
+        if log_config.get('Type'):
+            run_cmd.extend(['--log-driver', log_config['Type']])
+            for key, value in (log_config.get('Config') or {}).items():
+                run_cmd.extend(['--log-opt', f'{key}={value}'])
+
+        healthcheck = config_section.get('Healthcheck') or {}
+        test = healthcheck.get('Test') or []
+        if test:
+            if test[0] == 'CMD-SHELL' and len(test) > 1:
+                run_cmd.extend(['--health-cmd', test[1]])
+            elif test[0] == 'CMD' and len(test) > 1:
+                run_cmd.extend(['--health-cmd', ' '.join(shlex.quote(part) for part in test[1:])])
+            elif test[0] == 'NONE':
+                run_cmd.extend(['--no-healthcheck'])
+
+            if healthcheck.get('Interval'):
+                run_cmd.extend(['--health-interval', f"{max(int(healthcheck['Interval'] / 1_000_000_000), 1)}s"])
+            if healthcheck.get('Timeout'):
+                run_cmd.extend(['--health-timeout', f"{max(int(healthcheck['Timeout'] / 1_000_000_000), 1)}s"])
+            if healthcheck.get('StartPeriod'):
+                run_cmd.extend(['--health-start-period', f"{max(int(healthcheck['StartPeriod'] / 1_000_000_000), 1)}s"])
+            if healthcheck.get('Retries') is not None:
+                run_cmd.extend(['--health-retries', str(healthcheck['Retries'])])
+
+        for extra_host in host_config.get('ExtraHosts') or []:
+            run_cmd.extend(['--add-host', extra_host])
+        for cap in host_config.get('CapAdd') or []:
+            run_cmd.extend(['--cap-add', cap])
+        for cap in host_config.get('CapDrop') or []:
+            run_cmd.extend(['--cap-drop', cap])
+        for dns in host_config.get('Dns') or []:
+            run_cmd.extend(['--dns', dns])
+        for dns_search in host_config.get('DnsSearch') or []:
+            run_cmd.extend(['--dns-search', dns_search])
+
+        for mount in container_config.get('Mounts', []) or []:
+            source = mount.get('Name') or mount.get('Source')
+            destination = mount.get('Destination')
+            if not source or not destination:
+                continue
+
+            mount_spec = f'{source}:{destination}'
+            mode = mount.get('Mode') or ''
+            if mode:
+                mount_spec += f':{mode}'
+            elif mount.get('RW') is False:
+                mount_spec += ':ro'
+            run_cmd.extend(['-v', mount_spec])
+
+        if network_mode != 'host':
+            port_bindings = host_config.get('PortBindings', {}) or {}
+            for container_port, host_configs in port_bindings.items():
+                for host_cfg in host_configs or []:
+                    host_port = host_cfg.get('HostPort', '')
+                    if not host_port:
+                        continue
+                    host_ip = host_cfg.get('HostIp', '')
+                    mapping = ''
+                    if host_ip and host_ip != '0.0.0.0':
+                        mapping += f'{host_ip}:'
+                    mapping += f'{host_port}:{container_port}'
+                    run_cmd.extend(['-p', mapping])
+
+        entrypoint = config_section.get('Entrypoint')
+        cmd_args = []
+        if isinstance(entrypoint, list) and entrypoint:
+            run_cmd.extend(['--entrypoint', entrypoint[0]])
+            cmd_args.extend(entrypoint[1:])
+        elif isinstance(entrypoint, str) and entrypoint:
+            run_cmd.extend(['--entrypoint', entrypoint])
+
+        cmd = config_section.get('Cmd')
+        if isinstance(cmd, list):
+            cmd_args.extend(cmd)
+        elif isinstance(cmd, str) and cmd:
+            cmd_args.append(cmd)
+
+        run_cmd.append(image_ref)
+        run_cmd.extend(cmd_args)
+        return run_cmd
+
     @staticmethod
-    def update_container(container: str, progress_callback=None) -> Dict:
+    def update_container(container: str, progress_callback=None, target_image_id: Optional[str] = None) -> Dict:
         result = {
             'success': False,
             'message': '',
@@ -1328,153 +4257,36 @@ class DockerManager:
 
         try:
             with FileLock(container_lock_path(container), timeout=1):
-                return DockerManager._update_container_internal(container, progress_callback)
+                return DockerManager._update_container_internal(container, progress_callback, target_image_id)
         except TimeoutError:
             result['busy'] = True
             result['message'] = '容器正在执行其他更新任务，请稍后再试'
             return result
 
     @staticmethod
-    def _update_container_internal(container: str, progress_callback=None) -> Dict:
+    def _update_container_internal(container: str, progress_callback=None,
+                                   target_image_id: Optional[str] = None) -> Dict:
         result = {
             'success': False,
             'message': '',
             'old_version': '',
-            'new_version': ''
+            'new_version': '',
+            'timings': {}
         }
 
         backup_tag = None
         config = {}
         old_image_id = ''
         preserve_compose_labels = False
+        journal = DockerManager.update_journal
+        op_id = None
+        op_state = ''
 
-        def build_run_cmd(container_config: Dict, image_ref: str) -> List[str]:
-            host_config = container_config.get('HostConfig', {})
-            config_section = container_config.get('Config', {})
-            run_cmd = ['docker', 'run', '-d', '--name', container]
-
-            network_mode = host_config.get('NetworkMode', 'bridge')
-            if network_mode:
-                run_cmd.extend(['--network', network_mode])
-
-            restart_policy = host_config.get('RestartPolicy', {}) or {}
-            restart_name = restart_policy.get('Name')
-            if restart_name:
-                if restart_name == 'on-failure' and restart_policy.get('MaximumRetryCount'):
-                    run_cmd.extend(['--restart', f"{restart_name}:{restart_policy['MaximumRetryCount']}"])
-                else:
-                    run_cmd.extend(['--restart', restart_name])
-
-            if host_config.get('Privileged'):
-                run_cmd.append('--privileged')
-            if host_config.get('ReadonlyRootfs'):
-                run_cmd.append('--read-only')
-            if host_config.get('ShmSize'):
-                run_cmd.extend(['--shm-size', str(host_config['ShmSize'])])
-            if host_config.get('NanoCpus'):
-                run_cmd.extend(['--cpus', str(host_config['NanoCpus'] / 1_000_000_000)])
-            if host_config.get('Memory'):
-                run_cmd.extend(['--memory', str(host_config['Memory'])])
-            if host_config.get('PidsLimit') and host_config.get('PidsLimit') > 0:
-                run_cmd.extend(['--pids-limit', str(host_config['PidsLimit'])])
-
-            if config_section.get('WorkingDir'):
-                run_cmd.extend(['-w', config_section['WorkingDir']])
-            if config_section.get('User'):
-                run_cmd.extend(['-u', config_section['User']])
-            if config_section.get('Hostname'):
-                run_cmd.extend(['--hostname', config_section['Hostname']])
-
-            for env in config_section.get('Env', []) or []:
-                run_cmd.extend(['-e', env])
-
-            labels = config_section.get('Labels') or {}
-            for key, value in labels.items():
-                if key.startswith('com.docker.compose.') and not preserve_compose_labels:
-                    continue
-                run_cmd.extend(['--label', key if value in (None, '') else f'{key}={value}'])
-
-            log_config = host_config.get('LogConfig', {}) or {}
-            if log_config.get('Type'):
-                run_cmd.extend(['--log-driver', log_config['Type']])
-                for key, value in (log_config.get('Config') or {}).items():
-                    run_cmd.extend(['--log-opt', f'{key}={value}'])
-
-            healthcheck = config_section.get('Healthcheck') or {}
-            test = healthcheck.get('Test') or []
-            if test:
-                if test[0] == 'CMD-SHELL' and len(test) > 1:
-                    run_cmd.extend(['--health-cmd', test[1]])
-                elif test[0] == 'CMD' and len(test) > 1:
-                    run_cmd.extend(['--health-cmd', ' '.join(shlex.quote(part) for part in test[1:])])
-                elif test[0] == 'NONE':
-                    run_cmd.extend(['--no-healthcheck'])
-
-                if healthcheck.get('Interval'):
-                    run_cmd.extend(['--health-interval', f"{max(int(healthcheck['Interval'] / 1_000_000_000), 1)}s"])
-                if healthcheck.get('Timeout'):
-                    run_cmd.extend(['--health-timeout', f"{max(int(healthcheck['Timeout'] / 1_000_000_000), 1)}s"])
-                if healthcheck.get('StartPeriod'):
-                    run_cmd.extend(['--health-start-period', f"{max(int(healthcheck['StartPeriod'] / 1_000_000_000), 1)}s"])
-                if healthcheck.get('Retries') is not None:
-                    run_cmd.extend(['--health-retries', str(healthcheck['Retries'])])
-
-            for extra_host in host_config.get('ExtraHosts') or []:
-                run_cmd.extend(['--add-host', extra_host])
-            for cap in host_config.get('CapAdd') or []:
-                run_cmd.extend(['--cap-add', cap])
-            for cap in host_config.get('CapDrop') or []:
-                run_cmd.extend(['--cap-drop', cap])
-            for dns in host_config.get('Dns') or []:
-                run_cmd.extend(['--dns', dns])
-            for dns_search in host_config.get('DnsSearch') or []:
-                run_cmd.extend(['--dns-search', dns_search])
-
-            for mount in container_config.get('Mounts', []) or []:
-                source = mount.get('Name') or mount.get('Source')
-                destination = mount.get('Destination')
-                if not source or not destination:
-                    continue
-
-                mount_spec = f'{source}:{destination}'
-                mode = mount.get('Mode') or ''
-                if mode:
-                    mount_spec += f':{mode}'
-                elif mount.get('RW') is False:
-                    mount_spec += ':ro'
-                run_cmd.extend(['-v', mount_spec])
-
-            if network_mode != 'host':
-                port_bindings = host_config.get('PortBindings', {}) or {}
-                for container_port, host_configs in port_bindings.items():
-                    for host_cfg in host_configs or []:
-                        host_port = host_cfg.get('HostPort', '')
-                        if not host_port:
-                            continue
-                        host_ip = host_cfg.get('HostIp', '')
-                        mapping = ''
-                        if host_ip and host_ip != '0.0.0.0':
-                            mapping += f'{host_ip}:'
-                        mapping += f'{host_port}:{container_port}'
-                        run_cmd.extend(['-p', mapping])
-
-            entrypoint = config_section.get('Entrypoint')
-            cmd_args = []
-            if isinstance(entrypoint, list) and entrypoint:
-                run_cmd.extend(['--entrypoint', entrypoint[0]])
-                cmd_args.extend(entrypoint[1:])
-            elif isinstance(entrypoint, str) and entrypoint:
-                run_cmd.extend(['--entrypoint', entrypoint])
-
-            cmd = config_section.get('Cmd')
-            if isinstance(cmd, list):
-                cmd_args.extend(cmd)
-            elif isinstance(cmd, str) and cmd:
-                cmd_args.append(cmd)
-
-            run_cmd.append(image_ref)
-            run_cmd.extend(cmd_args)
-            return run_cmd
+        def record_step(state: str, **details: Any):
+            nonlocal op_state
+            op_state = state
+            if journal:
+                journal.advance(op_id, state, **details)
 
         def rollback_container(reason: str) -> str:
             if not ENABLE_ROLLBACK or not backup_tag:
@@ -1485,12 +4297,17 @@ class DockerManager:
                 progress_callback('↩️ 更新失败，正在自动回滚...')
 
             DockerManager._run(['docker', 'rm', '-f', container], timeout=30)
-            rollback_cmd = build_run_cmd(config, backup_tag)
-            rollback_result = DockerManager._run(rollback_cmd, timeout=60)
-            if rollback_result.returncode == 0 and DockerManager.wait_container_ready(container, timeout=90):
+            rollback_cmd = DockerManager.build_run_command(container, config, backup_tag, preserve_compose_labels)
+            rollback_result = DockerManager._run(rollback_cmd, timeout=DockerManager.step_timeout(container, 'start', 60))
+            if rollback_result.returncode == 0 and DockerManager.wait_container_ready(
+                container,
+                timeout=DockerManager.step_timeout(container, 'ready', 90)
+            ):
+                record_step('rolled_back', message=reason[:300])
                 return f'{reason}；已自动回滚到旧镜像'
 
             rollback_message = (rollback_result.stderr or rollback_result.stdout or '未知错误')[:200]
+            record_step('failed', message=f'{reason}；自动回滚失败: {rollback_message}'[:300])
             return f'{reason}；自动回滚失败: {rollback_message}'
 
         try:
@@ -1520,7 +4337,8 @@ class DockerManager:
                         config,
                         old_info,
                         compose_metadata,
-                        progress_callback
+                        progress_callback,
+                        target_image_id
                     )
 
                 if DockerManager.should_fallback_from_compose(validation_error):
@@ -1535,6 +4353,15 @@ class DockerManager:
                     result['message'] = validation_error
                     return result
 
+            if journal:
+                op_id = journal.begin(container, 'recreate', {
+                    'image': image,
+                    'old_image_id': old_image_id,
+                    'preserve_compose_labels': preserve_compose_labels,
+                    'container_config': DockerManager.run_config_snapshot(config),
+                })
+                op_state = 'planned'
+
             if ENABLE_ROLLBACK:
                 safe_container = sanitize_file_component(container.lower())
                 backup_tag = f'watchtower-rollback/{safe_container}:{int(time.time())}'
@@ -1545,22 +4372,36 @@ class DockerManager:
                 if backup_result.returncode != 0:
                     logger.warning(f"创建回滚镜像标签失败: {(backup_result.stderr or backup_result.stdout)[:200]}")
                     backup_tag = None
+                else:
+                    record_step('backup_tagged', backup_tag=backup_tag)
 
-            if progress_callback:
-                progress_callback(f'🔄 正在拉取镜像: {image}')
-
-            pull_result = DockerManager.pull_image(image)
-            if not pull_result['success']:
-                result['message'] = f"拉取镜像失败: {pull_result['message']}"
-                return result
+            if DockerManager._has_target_image(image, target_image_id):
+                new_image_id = target_image_id
+            else:
+                if progress_callback:
+                    progress_callback(f'🔄 正在拉取镜像: {image}')
+
+                pull_result = DockerManager.pull_image(image, timeout=DockerManager.step_timeout(container, 'pull', 300))
+                attempt_seconds = pull_result.get('attempt_seconds')
+                if pull_result.get('timed_out'):
+                    DockerManager._record_step(container, 'pull', attempt_seconds, censored=True)
+                if not pull_result['success']:
+                    result['message'] = f"拉取镜像失败: {pull_result['message']}"
+                    return result
+                if attempt_seconds is not None:
+                    DockerManager._record_step(container, 'pull', attempt_seconds, result['timings'])
+                new_image_id = pull_result['image_id']
 
-            new_image_id = pull_result['image_id']
             if new_image_id == old_image_id:
+                record_step('skipped')
                 result['success'] = True
                 result['new_version'] = result['old_version']
                 result['message'] = '镜像已是最新版本，无需更新'
                 return result
 
+            record_step('pulled', new_image_id=new_image_id)
+            baseline = DockerManager._collect_update_baseline(container, progress_callback)
+
             if progress_callback:
                 progress_callback('⏸️ 正在停止旧容器...')
 
@@ -1568,6 +4409,7 @@ class DockerManager:
             if stop_result.returncode != 0:
                 result['message'] = f"停止旧容器失败: {(stop_result.stderr or stop_result.stdout)[:200]}"
                 return result
+            record_step('stopped')
 
             if progress_callback:
                 progress_callback('🗑️ 正在删除旧容器...')
@@ -1576,19 +4418,26 @@ class DockerManager:
             if rm_result.returncode != 0:
                 result['message'] = f"删除旧容器失败: {(rm_result.stderr or rm_result.stdout)[:200]}"
                 return result
+            record_step('removed')
 
             if progress_callback:
                 progress_callback('🚀 正在启动新容器...')
 
-            run_cmd = build_run_cmd(config, image)
-            run_result = DockerManager._run(run_cmd, timeout=60)
+            run_cmd = DockerManager.build_run_command(container, config, image, preserve_compose_labels)
+            run_result = DockerManager._run_timed_step(container, 'start', run_cmd, 60, result['timings'])
             if run_result.returncode != 0:
                 result['message'] = rollback_container(
                     f"启动新容器失败: {(run_result.stderr or run_result.stdout)[:200]}"
                 )
                 return result
+            record_step('started')
+
+            if DockerManager._wait_ready_timed(container, result):
+                regression = DockerManager._observe_post_update(container, baseline, result, progress_callback)
+                if regression:
+                    result['message'] = rollback_container(f'新版本性能回退: {regression}')
+                    return result
 
-            if DockerManager.wait_container_ready(container, timeout=90):
                 new_info = DockerManager.get_container_info(container)
                 result['new_version'] = DockerManager._format_version_info(new_info or {
                     'image': image,
@@ -1596,8 +4445,9 @@ class DockerManager:
                 }, container)
                 result['success'] = True
                 result['message'] = '容器更新成功'
+                record_step('healthy')
             else:
-                result['message'] = rollback_container('容器启动失败，请检查日志')
+                result['message'] = rollback_container(result.get('readiness_error') or '容器启动失败，请检查日志')
 
             return result
 
@@ -1609,6 +4459,9 @@ class DockerManager:
             logger.error(f'更新容器 {container} 失败: {e}')
             return result
         finally:
+            if op_state in UpdateJournal.ACTIVE_STATES:
+                record_step('failed', message=(result.get('message') or '更新中断')[:300])
+
             if backup_tag and result.get('success'):
                 DockerManager._run(['docker', 'image', 'rm', backup_tag], timeout=20)
 
@@ -1617,12 +4470,14 @@ class DockerManager:
 
     @staticmethod
     def _update_compose_container(container: str, container_config: Dict, old_info: Dict,
-                                  compose_metadata: Dict[str, Any], progress_callback=None) -> Dict:
+                                  compose_metadata: Dict[str, Any], progress_callback=None,
+                                  target_image_id: Optional[str] = None) -> Dict:
         result = {
             'success': False,
             'message': '',
             'old_version': DockerManager._format_version_info(old_info, container),
-            'new_version': ''
+            'new_version': '',
+            'timings': {}
         }
 
         validation_error = DockerManager.validate_compose_metadata(compose_metadata)
@@ -1633,6 +4488,15 @@ class DockerManager:
         image = old_info['image']
         old_image_id = old_info['image_id']
         new_image_id = ''
+        journal = DockerManager.update_journal
+        op_id = None
+        op_state = ''
+
+        def record_step(state: str, **details: Any):
+            nonlocal op_state
+            op_state = state
+            if journal:
+                journal.advance(op_id, state, **details)
 
         def rollback_compose_service(reason: str) -> str:
             if not ENABLE_ROLLBACK:
@@ -1645,32 +4509,50 @@ class DockerManager:
             tag_result = DockerManager._run(['docker', 'image', 'tag', old_image_id, image], timeout=20)
             if tag_result.returncode != 0:
                 rollback_message = (tag_result.stderr or tag_result.stdout or '未知错误')[:200]
+                record_step('failed', message=f'{reason}；自动回滚失败: {rollback_message}'[:300])
                 return f'{reason}；自动回滚失败: {rollback_message}'
 
             rollback_cmd = DockerManager.build_compose_command(
                 compose_metadata,
                 ['up', '-d', '--no-deps', '--force-recreate', compose_metadata['service']]
             )
-            rollback_result = DockerManager._run(rollback_cmd, timeout=180)
-            if rollback_result.returncode == 0 and DockerManager.wait_container_ready(container, timeout=90):
+            rollback_result = DockerManager._run(
+                rollback_cmd,
+                timeout=DockerManager.step_timeout(container, 'compose_up', 180)
+            )
+            if rollback_result.returncode == 0 and DockerManager.wait_container_ready(
+                container,
+                timeout=DockerManager.step_timeout(container, 'ready', 90)
+            ):
                 DockerManager.cleanup_image_if_unused(new_image_id, keep_image_ids={old_image_id})
+                record_step('rolled_back', message=reason[:300])
                 return f'{reason}；已自动回滚到旧镜像'
 
             rollback_message = (rollback_result.stderr or rollback_result.stdout or '未知错误')[:200]
+            record_step('failed', message=f'{reason}；自动回滚失败: {rollback_message}'[:300])
             return f'{reason}；自动回滚失败: {rollback_message}'
 
+        if journal:
+            op_id = journal.begin(container, 'compose', {
+                'image': image,
+                'old_image_id': old_image_id,
+                'compose_metadata': compose_metadata,
+            })
+            op_state = 'planned'
+
         try:
-            if progress_callback:
-                progress_callback(f'🔄 正在通过 Compose 拉取镜像: {image}')
+            if not DockerManager._has_target_image(image, target_image_id):
+                if progress_callback:
+                    progress_callback(f'🔄 正在通过 Compose 拉取镜像: {image}')
 
-            pull_cmd = DockerManager.build_compose_command(
-                compose_metadata,
-                ['pull', compose_metadata['service']]
-            )
-            pull_result = DockerManager._run(pull_cmd, timeout=300)
-            if pull_result.returncode != 0:
-                result['message'] = f"拉取 Compose 镜像失败: {(pull_result.stderr or pull_result.stdout)[:200]}"
-                return result
+                pull_cmd = DockerManager.build_compose_command(
+                    compose_metadata,
+                    ['pull', compose_metadata['service']]
+                )
+                pull_result = DockerManager._run_timed_step(container, 'pull', pull_cmd, 300, result['timings'])
+                if pull_result.returncode != 0:
+                    result['message'] = f"拉取 Compose 镜像失败: {(pull_result.stderr or pull_result.stdout)[:200]}"
+                    return result
 
             new_image_id = DockerManager.get_image_id(image)
             if not new_image_id:
@@ -1678,11 +4560,14 @@ class DockerManager:
                 return result
 
             if new_image_id == old_image_id:
+                record_step('skipped')
                 result['success'] = True
                 result['new_version'] = result['old_version']
                 result['message'] = '镜像已是最新版本，无需更新'
                 return result
 
+            record_step('pulled', new_image_id=new_image_id)
+            baseline = DockerManager._collect_update_baseline(container, progress_callback)
             if progress_callback:
                 progress_callback('🚀 正在通过 Compose 重建服务...')
 
@@ -1690,14 +4575,20 @@ class DockerManager:
                 compose_metadata,
                 ['up', '-d', '--no-deps', '--force-recreate', compose_metadata['service']]
             )
-            up_result = DockerManager._run(up_cmd, timeout=180)
+            record_step('started')
+            up_result = DockerManager._run_timed_step(container, 'compose_up', up_cmd, 180, result['timings'])
             if up_result.returncode != 0:
                 result['message'] = rollback_compose_service(
                     f"Compose 重建服务失败: {(up_result.stderr or up_result.stdout)[:200]}"
                 )
                 return result
 
-            if DockerManager.wait_container_ready(container, timeout=90):
+            if DockerManager._wait_ready_timed(container, result):
+                regression = DockerManager._observe_post_update(container, baseline, result, progress_callback)
+                if regression:
+                    result['message'] = rollback_compose_service(f'新版本性能回退: {regression}')
+                    return result
+
                 new_info = DockerManager.get_container_info(container)
                 result['new_version'] = DockerManager._format_version_info(new_info or {
                     'image': image,
@@ -1705,16 +4596,146 @@ class DockerManager:
                 }, container)
                 result['success'] = True
                 result['message'] = '容器更新成功'
+                record_step('healthy')
             else:
-                result['message'] = rollback_compose_service('容器启动失败，请检查日志')
+                result['message'] = rollback_compose_service(result.get('readiness_error') or '容器启动失败，请检查日志')
 
             return result
         finally:
+            if op_state in UpdateJournal.ACTIVE_STATES:
+                record_step('failed', message=(result.get('message') or '更新中断')[:300])
+
             if result.get('success') and CLEANUP_OLD_IMAGES and old_image_id:
                 DockerManager.cleanup_image_if_unused(old_image_id, keep_image_ids={new_image_id})
             elif not result.get('success'):
                 DockerManager.cleanup_image_if_unused(new_image_id, keep_image_ids={old_image_id})
 
+    @staticmethod
+    def recover_interrupted_updates() -> List[Dict[str, Any]]:
+        journal = DockerManager.update_journal
+        if not journal:
+            return []
+
+        results = []
+        for record in journal.get_incomplete():
+            container = record.get('container', '')
+            if not container:
+                continue
+
+            logger.warning(f'发现中断的更新任务，开始恢复: {container} (阶段: {record.get("state")})')
+            try:
+                with FileLock(container_lock_path(container), timeout=5):
+                    outcome = DockerManager._recover_update_operation(record)
+            except TimeoutError:
+                logger.warning(f'容器 {container} 正被其他任务占用，暂不恢复')
+                continue
+            except Exception as e:
+                outcome = {'state': 'failed', 'message': f'恢复失败: {str(e)[:200]}'}
+
+            journal.advance(
+                record.get('id'),
+                outcome['state'],
+                message=outcome['message'][:300],
+                recovered_at=time.time()
+            )
+            logger.info(f'中断更新恢复完成: {container} -> {outcome["state"]} ({outcome["message"]})')
+            results.append({
+                'container': container,
+                'interrupted_state': record.get('state'),
+                'state': outcome['state'],
+                'message': outcome['message'],
+            })
+
+        return results
+
+    @staticmethod
+    def _recover_update_operation(record: Dict[str, Any]) -> Dict[str, str]:
+        container = record['container']
+        state = record.get('state')
+        image = record.get('image', '')
+        old_image_id = record.get('old_image_id', '')
+        new_image_id = record.get('new_image_id', '')
+        backup_tag = record.get('backup_tag', '')
+        info = DockerManager.get_container_info(container)
+
+        def finish(outcome_state: str, message: str) -> Dict[str, str]:
+            if backup_tag and outcome_state in {'healthy', 'rolled_back'}:
+                DockerManager._run(['docker', 'image', 'rm', backup_tag], timeout=20)
+            elif backup_tag:
+                # 恢复失败时备份标签是手动回滚的唯一依据，必须保留
+                logger.warning(f'容器 {container} 恢复失败，已保留备份镜像 {backup_tag} 供手动回滚')
+                message = f'{message}；备份镜像 {backup_tag} 已保留'
+            if outcome_state == 'healthy' and CLEANUP_OLD_IMAGES:
+                DockerManager.cleanup_image_if_unused(old_image_id, keep_image_ids={new_image_id})
+            elif outcome_state == 'rolled_back':
+                DockerManager.cleanup_image_if_unused(new_image_id, keep_image_ids={old_image_id})
+            return {'state': outcome_state, 'message': message}
+
+        if record.get('mode') == 'compose':
+            compose_metadata = record.get('compose_metadata') or {}
+            if state != 'started' and info:
+                return finish('rolled_back', '更新在重建服务前中断，旧容器保持不变')
+
+            if info and DockerManager.wait_container_ready(container, timeout=90):
+                current_image_id = DockerManager.get_container_info(container).get('image_id', '')
+                if current_image_id and current_image_id == old_image_id:
+                    return finish('rolled_back', '容器仍运行旧镜像，已放弃本次更新')
+                return finish('healthy', '中断前的更新已生效，容器运行正常')
+
+            up_cmd = DockerManager.build_compose_command(
+                compose_metadata,
+                ['up', '-d', '--no-deps', '--force-recreate', compose_metadata.get('service', '')]
+            )
+            up_result = DockerManager._run(up_cmd, timeout=180)
+            if up_result.returncode == 0 and DockerManager.wait_container_ready(container, timeout=90):
+                return finish('healthy', '已通过 Compose 完成中断的更新')
+
+            if not old_image_id:
+                return finish('failed', '缺少旧镜像信息，无法回滚')
+            DockerManager._run(['docker', 'image', 'tag', old_image_id, image], timeout=20)
+            rollback_result = DockerManager._run(up_cmd, timeout=180)
+            if rollback_result.returncode == 0 and DockerManager.wait_container_ready(container, timeout=90):
+                return finish('rolled_back', '新镜像无法正常启动，已通过 Compose 回滚到旧镜像')
+            rollback_message = (rollback_result.stderr or rollback_result.stdout or '未知错误')[:200]
+            return finish('failed', f'Compose 回滚失败: {rollback_message}')
+
+        container_config = record.get('container_config') or {}
+        preserve_compose_labels = bool(record.get('preserve_compose_labels'))
+        rollback_ref = backup_tag or old_image_id
+
+        def rollback(reason: str) -> Dict[str, str]:
+            if not container_config or not rollback_ref:
+                return finish('failed', f'{reason}；缺少旧容器配置，无法回滚')
+            DockerManager._run(['docker', 'rm', '-f', container], timeout=30)
+            rollback_cmd = DockerManager.build_run_command(
+                container, container_config, rollback_ref, preserve_compose_labels
+            )
+            rollback_result = DockerManager._run(rollback_cmd, timeout=60)
+            if rollback_result.returncode == 0 and DockerManager.wait_container_ready(container, timeout=90):
+                return finish('rolled_back', f'{reason}；已回滚到旧镜像')
+            rollback_message = (rollback_result.stderr or rollback_result.stdout or '未知错误')[:200]
+            return finish('failed', f'{reason}；回滚失败: {rollback_message}')
+
+        if state in {'planned', 'backup_tagged', 'pulled', 'stopped'} and info:
+            if not info.get('running'):
+                DockerManager._run(['docker', 'start', container], timeout=60)
+                if not DockerManager.wait_container_ready(container, timeout=90):
+                    return finish('failed', '更新在替换容器前中断，旧容器重新启动失败')
+            return finish('rolled_back', '更新在替换容器前中断，已保留旧容器')
+
+        if not info:
+            if not container_config:
+                return finish('failed', '旧容器已删除且缺少容器配置，无法恢复')
+            run_cmd = DockerManager.build_run_command(container, container_config, image, preserve_compose_labels)
+            run_result = DockerManager._run(run_cmd, timeout=60)
+            if run_result.returncode == 0 and DockerManager.wait_container_ready(container, timeout=90):
+                return finish('healthy', '已完成中断的更新，新容器运行正常')
+            return rollback('新容器无法启动')
+
+        if DockerManager.wait_container_ready(container, timeout=90):
+            return finish('healthy', '中断前的更新已生效，容器运行正常')
+        return rollback('新容器未能就绪')
+
     @staticmethod
     def _format_version_info(info: Dict, container: str) -> str:
         image_id = info.get('image_id', 'unknown')
@@ -1902,6 +4923,9 @@ class CommandHandler:
         self.command_queue = RemoteCommandQueue(COMMAND_QUEUE_FILE)
         self.remote_controller = RemoteServerController(bot.server_name, docker, config, registry)
         self._processing_callbacks = set()
+        self._batch_selections: Dict[str, Set[str]] = {}
+        self._progress_lock = threading.Lock()
+        self._progress_followers: Set[str] = set()
 
     def _is_local_server(self, server: str) -> bool:
         return self.remote_controller.is_local_server(server)
@@ -1912,9 +4936,13 @@ class CommandHandler:
     def _get_available_servers(self) -> List[str]:
         return self.remote_controller.get_available_servers()
 
-    def _get_server_inventory(self, server: str, force_refresh: bool = False) -> Dict[str, Any]:
+    def _get_server_inventory(self, server: str, force_refresh: bool = False,
+                              on_refresh: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
         try:
-            return self.remote_controller.get_inventory(server, force_refresh=force_refresh)
+            if force_refresh:
+                return self.remote_controller.get_inventory(server, force_refresh=True)
+            # 交互视图不等待 SSH 采集，过期缓存先返回，由后台刷新
+            return self.remote_controller.get_cached_inventory(server, on_refresh)
         except Exception as exc:
             logger.error(f'获取服务器 {server} 状态失败: {exc}')
             if self._is_local_server(server):
@@ -1939,25 +4967,39 @@ class CommandHandler:
     def _get_server_containers(self, server: str) -> List[str]:
         return sorted(self._get_server_snapshots(server).keys())
 
-    def _get_server_update_meta(self, server: str) -> Dict:
-        inventory = self._get_server_inventory(server)
-        return {
-            'mode': inventory.get('mode', 'unknown'),
-            'transport': inventory.get('transport', 'unknown'),
-            'updated_at': inventory.get('collected_at', 0),
-            'total_containers': inventory.get('total_containers', 0),
-            'monitored_containers': list(inventory.get('monitored_containers', [])),
-            'excluded_containers': list(inventory.get('excluded_containers', [])),
-        }
-
     def _send_or_edit(self, chat_id: str, text: str, reply_markup: Optional[Dict] = None,
                       message_id: Optional[str] = None):
         if message_id:
-            edited = self.bot.edit_message(chat_id, message_id, text, reply_markup)
-            if edited:
-                return True
+            if self.bot.edit_message(chat_id, message_id, text, reply_markup, final=True):
+                return
             logger.warning('编辑消息失败，回退为发送新消息')
-        return self.bot.send_message(text, reply_markup)
+        self.bot.send_message(text, reply_markup)
+
+    def _show_inventory_view(self, chat_id: str, server: str,
+                             render: Callable[[Dict[str, Any]], Tuple[str, Optional[Dict]]],
+                             message_id: Optional[str] = None):
+        view = {'message_id': message_id, 'rendered': None}
+        sent = threading.Event()
+
+        def on_refresh(fresh: Dict[str, Any]):
+            if not sent.wait(30) or not view['message_id']:
+                return
+            rendered = render(fresh)
+            if rendered != view['rendered']:
+                self.bot.edit_message(chat_id, view['message_id'], rendered[0], rendered[1])
+
+        try:
+            inventory = self._get_server_inventory(server, on_refresh=on_refresh)
+            view['rendered'] = render(inventory)
+            text, reply_markup = view['rendered']
+            if message_id:
+                # 需要根据结果决定是否回退为新消息，因此等待编辑完成
+                if self.bot.edit_message(chat_id, message_id, text, reply_markup, final=True):
+                    return
+                logger.warning('编辑消息失败，回退为发送新消息')
+            view['message_id'] = self.bot.send_message_get_id(text, reply_markup)
+        finally:
+            sent.set()
 
     def _run_async(self, target, *args):
         def runner():
@@ -1999,13 +5041,54 @@ class CommandHandler:
             transport = inventory.get('transport', 'unknown')
             server_msg += f"🖥️ <b>{escape_html(server)}{marker}</b> ({container_count}个容器)\n"
             server_msg += f"   通道: <code>{escape_html(transport)}</code>\n"
+            connection = self.remote_controller.get_connection_stats(server)
+            if connection:
+                connection_text = '复用连接' if connection.get('connected') else '直连'
+                if connection.get('setup_ms') is not None:
+                    connection_text += f" · 建连 {connection['setup_ms']:.0f}ms"
+                server_msg += f"   SSH: <code>{escape_html(connection_text)}</code>\n"
+            health_text = self._render_server_health(server)
+            if health_text:
+                server_msg += f"   健康: <code>{escape_html(health_text)}</code>\n"
             server_msg += f"   最后心跳: {time_text}\n\n"
 
+        offline = [
+            server for server in remote_server_configs()
+            if server not in servers and self.remote_controller.uses_rpc(server)
+        ]
+        for server in offline:
+            health = self.remote_controller.health.snapshot(server)
+            since = health.get('unreachable_since')
+            since_text = datetime.fromtimestamp(since).strftime('%m-%d %H:%M:%S') if since else '未知'
+            server_msg += f"⛔ <b>{escape_html(server)}</b> 不可达\n"
+            server_msg += f"   自: <code>{since_text}</code>\n"
+            if health.get('last_error'):
+                server_msg += f"   原因: {escape_html(health['last_error'][:120])}\n"
+            health_text = self._render_server_health(server)
+            if health_text:
+                server_msg += f"   健康: <code>{escape_html(health_text)}</code>\n"
+            server_msg += "\n"
+
         server_msg += '━━━━━━━━━━━━━━━━━━━━\n'
         server_msg += f"💡 主服务器: <code>{escape_html(primary_server or '未设置')}</code>\n"
         server_msg += f"⏰ 更新时间: <code>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</code>"
         self.bot.send_message(server_msg)
 
+    def _render_server_health(self, server: str) -> str:
+        health = self.remote_controller.health.snapshot(server)
+        if not health:
+            return ''
+        parts = []
+        if health.get('success_rate') is not None:
+            parts.append(f"成功率 {health['success_rate'] * 100:.0f}%")
+        if health.get('rtt_p50_ms') is not None:
+            parts.append(f"延迟 p50 {health['rtt_p50_ms']:.0f}ms")
+        if health.get('rtt_ms'):
+            parts.append('近期 ' + '/'.join(f'{value:.0f}' for value in health['rtt_ms'][-6:]) + 'ms')
+        if health.get('consecutive_failures'):
+            parts.append(f"连续失败 {health['consecutive_failures']} 次")
+        return ' · '.join(parts)
+
     def handle_status(self, chat_id: str):
         servers = self._get_available_servers()
         if len(servers) > 1:
@@ -2020,21 +5103,31 @@ class CommandHandler:
             self._show_server_status(chat_id, servers[0] if servers else SERVER_NAME)
 
     def _show_server_status(self, chat_id: str, server: str, message_id: Optional[str] = None):
-        inventory = self._get_server_inventory(server, force_refresh=True)
+        self._show_inventory_view(
+            chat_id,
+            server,
+            lambda inventory: (self._render_server_status(server, inventory), None),
+            message_id
+        )
+
+    def _render_server_status(self, server: str, inventory: Dict[str, Any]) -> str:
         snapshots = dict(inventory.get('containers', {}))
         all_containers = sorted(snapshots.keys())
         monitored = list(inventory.get('monitored_containers', []))
         excluded = list(inventory.get('excluded_containers', []))
-        update_meta = self._get_server_update_meta(server)
         registry_data = safe_read_json(self.registry.registry_file, default={})
         server_registry = registry_data.get(server, {})
-        mode = update_meta.get('mode') or server_registry.get('mode', 'unknown')
-        transport = update_meta.get('transport', 'unknown')
-        last_sync = update_meta.get('updated_at')
+        mode = inventory.get('mode') or server_registry.get('mode', 'unknown')
+        transport = inventory.get('transport', 'unknown')
+        last_sync = inventory.get('collected_at', 0)
         queue_count = self.command_queue.count_pending(server) if transport == 'queue' else 0
         sync_text = datetime.fromtimestamp(last_sync).strftime('%Y-%m-%d %H:%M:%S') if last_sync else '未同步'
-        if transport in {'ssh', 'local'} and last_sync:
+        if transport in {'ssh', 'agent', 'local'} and last_sync:
             sync_text = f"{sync_text} (实时)"
+        if inventory.get('cache_age') is not None and inventory['cache_age'] >= REMOTE_CACHE_TTL:
+            sync_text = f"缓存 {int(inventory['cache_age'])} 秒前"
+            if inventory.get('refreshing'):
+                sync_text += '，正在刷新…'
 
         status_msg = f"""📊 <b>服务器状态</b>
 
@@ -2071,7 +5164,48 @@ class CommandHandler:
                 status_msg += f"\n   • <code>{escape_html(container)}</code>"
 
         status_msg += "\n━━━━━━━━━━━━━━━━━━━━"
-        self._send_or_edit(chat_id, status_msg, message_id=message_id)
+        return status_msg
+
+    def _render_top_section(self, server: str, payload: Dict[str, Any]) -> str:
+        source = payload.get('source', 'unknown')
+        section = f"🖥️ <b>{escape_html(server)}</b> (<code>{escape_html(source)}</code>)"
+        containers = payload.get('containers', [])
+        if not containers:
+            return section + "\n   <i>暂无运行中的容器</i>"
+
+        for index, item in enumerate(containers, start=1):
+            line = (
+                f"\n   {index}. <code>{escape_html(item.get('name', 'unknown'))}</code> "
+                f"CPU {float(item.get('cpu_percent', 0)):.1f}% · "
+                f"内存 {format_byte_size(item.get('memory_bytes', 0))}"
+            )
+            if item.get('io_read_bps') is not None:
+                io_rate = float(item.get('io_read_bps') or 0) + float(item.get('io_write_bps') or 0)
+                line += f" · IO {format_byte_size(io_rate)}/s"
+            section += line
+        return section
+
+    def handle_top(self, chat_id: str):
+        servers = self._get_available_servers() or [self.bot.server_name]
+        sections = []
+        for server in servers:
+            try:
+                payload = self.remote_controller.get_top(server)
+                sections.append(self._render_top_section(server, payload))
+            except Exception as exc:
+                logger.warning(f'获取服务器 {server} 资源排行失败: {exc}')
+                sections.append(
+                    f"🖥️ <b>{escape_html(server)}</b>\n   ⚠️ {escape_html(str(exc)[:200])}"
+                )
+
+        body = '\n\n'.join(sections)
+        top_msg = f"""📈 <b>容器资源占用排行</b>
+
+━━━━━━━━━━━━━━━━━━━━
+{body}
+━━━━━━━━━━━━━━━━━━━━
+⏰ 时间: <code>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</code>"""
+        self.bot.send_message(top_msg)
 
     def handle_update(self, chat_id: str):
         servers = self._get_available_servers()
@@ -2090,19 +5224,54 @@ class CommandHandler:
             self._show_update_containers(chat_id, servers[0])
 
     def _show_update_containers(self, chat_id: str, server: str, message_id: Optional[str] = None):
-        inventory = self._get_server_inventory(server, force_refresh=True)
+        self._show_inventory_view(
+            chat_id,
+            server,
+            lambda inventory: self._render_update_containers(server, inventory),
+            message_id
+        )
+
+    def _render_update_containers(self, server: str, inventory: Dict[str, Any],
+                                  selected: Optional[Set[str]] = None) -> Tuple[str, Optional[Dict]]:
         containers = sorted(inventory.get('monitored_containers', []))
         if not containers:
-            self._send_or_edit(chat_id, f'⚠️ 服务器 <code>{escape_html(server)}</code> 没有可更新的容器', message_id=message_id)
-            return
-        buttons = {
-            'inline_keyboard': [
-                [{'text': f'📦 {container}', 'callback_data': f'update_cnt:{server}:{container}'}]
-                for container in containers
-            ]
-        }
-        text = f"🔄 <b>服务器 <code>{escape_html(server)}</code></b>\n\n请选择要更新的容器："
-        self._send_or_edit(chat_id, text, buttons, message_id)
+            return f'⚠️ 服务器 <code>{escape_html(server)}</code> 没有可更新的容器', None
+        text = f"🔄 <b>服务器 <code>{escape_html(server)}</code></b>\n\n请选择要更新的容器（可多选）："
+        return text, self._build_selection_keyboard('update', server, containers, selected)
+
+    @staticmethod
+    def _selection_key(chat_id: str, message_id: str, action: str, server: str) -> str:
+        # 按消息区分选择状态，多人同时操作同一服务器时互不影响
+        return f'{chat_id}:{message_id}:{action}:{server}'
+
+    def _build_selection_keyboard(self, action: str, server: str, containers: List[str],
+                                  selected: Optional[Set[str]] = None) -> Dict:
+        selected = selected if selected is not None else set()
+        selected &= set(containers)
+        action_text = '更新' if action == 'update' else '重启'
+        keyboard = [
+            [{
+                'text': f"{'☑️' if container in selected else '⬜'} {container}",
+                'callback_data': f'sel:{action}:{server}:{container}'
+            }]
+            for container in containers
+        ]
+        keyboard.append([
+            {'text': '🔘 全选/清空', 'callback_data': f'selall:{action}:{server}'},
+            {'text': f'✅ {action_text}所选 ({len(selected)})', 'callback_data': f'batch:{action}:{server}'},
+        ])
+        keyboard.append([{'text': '❌ 取消', 'callback_data': 'cancel'}])
+        return {'inline_keyboard': keyboard}
+
+    def _selection_candidates(self, action: str, server: str) -> List[str]:
+        if action == 'update':
+            return sorted(self._get_server_inventory(server).get('monitored_containers', []))
+        return self._get_server_containers(server)
+
+    def _render_selection(self, action: str, server: str, selected: Set[str]) -> Tuple[str, Optional[Dict]]:
+        if action == 'update':
+            return self._render_update_containers(server, self._get_server_inventory(server), selected)
+        return self._render_restart_containers(server, self._get_server_containers(server), selected)
 
     def handle_restart(self, chat_id: str):
         servers = self._get_available_servers()
@@ -2121,19 +5290,16 @@ class CommandHandler:
             self._show_restart_containers(chat_id, servers[0])
 
     def _show_restart_containers(self, chat_id: str, server: str, message_id: Optional[str] = None):
-        containers = self._get_server_containers(server)
-        if not containers:
-            self._send_or_edit(chat_id, f'⚠️ 服务器 <code>{escape_html(server)}</code> 没有可重启的容器', message_id=message_id)
-            return
-        buttons = {
-            'inline_keyboard': [
-                [{'text': f'🔄 {container}', 'callback_data': f'restart_cnt:{server}:{container}'}]
-                for container in containers
-            ]
-        }
-        text = f"🔄 <b>服务器 <code>{escape_html(server)}</code></b>\n\n请选择要重启的容器："
+        text, buttons = self._render_restart_containers(server, self._get_server_containers(server))
         self._send_or_edit(chat_id, text, buttons, message_id)
 
+    def _render_restart_containers(self, server: str, containers: List[str],
+                                   selected: Optional[Set[str]] = None) -> Tuple[str, Optional[Dict]]:
+        if not containers:
+            return f'⚠️ 服务器 <code>{escape_html(server)}</code> 没有可重启的容器', None
+        text = f"🔄 <b>服务器 <code>{escape_html(server)}</code></b>\n\n请选择要重启的容器（可多选）："
+        return text, self._build_selection_keyboard('restart', server, containers, selected)
+
     def handle_monitor(self, chat_id: str):
         if self.config.has_static_monitor_list():
             static_list = "\n".join(
@@ -2172,6 +5338,7 @@ class CommandHandler:
 
 /status - 查看服务器状态
 /servers - 查看所有服务器概览
+/top - 查看容器资源占用排行
 /update - 更新容器镜像
 /restart - 重启容器
 /monitor - 监控管理
@@ -2203,7 +5370,7 @@ class CommandHandler:
 🔄 <b>版本变更</b>
   旧: <code>{escape_html(result.get('old_version', 'unknown'))}</code>
   新: <code>{escape_html(result.get('new_version', 'unknown'))}</code>
-
+{render_update_diagnostics(result)}
 ⏰ 时间: <code>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</code>
 ━━━━━━━━━━━━━━━━━━━━
 
@@ -2217,7 +5384,7 @@ class CommandHandler:
 
 ❌ <b>错误信息</b>
   {escape_html(result.get('message', '未知错误'))}
-
+{render_update_diagnostics(result)}
 💡 <b>建议</b>
   • 检查镜像名称是否正确
   • 查看容器日志排查问题
@@ -2245,37 +5412,218 @@ class CommandHandler:
   {details}
 ━━━━━━━━━━━━━━━━━━━━"""
 
-    def _execute_update(self, chat_id: str, message_id: str, server: str, container: str):
-        current_msg = f'⏳ 正在更新容器 <code>{escape_html(container)}</code>...\n\n'
-        self.bot.edit_message(chat_id, message_id, current_msg + '📋 准备更新...')
-        last_progress = [time.time()]
+    def _message_editor(self, chat_id: str, message_id: str) -> Callable[..., None]:
+        return lambda text, final=False: self.bot.edit_message(chat_id, message_id, text, final=final)
 
-        def progress_update(msg):
-            if time.time() - last_progress[0] > 2:
-                self.bot.edit_message(chat_id, message_id, current_msg + escape_html(msg))
-                last_progress[0] = time.time()
+    def _job_editor(self, job: Dict) -> Callable[..., None]:
+        payload = job.get('payload', {})
+        primary = (str(payload.get('chat_id', '')), str(payload.get('message_id', '')))
 
-        result = self.docker.update_container(container, progress_update)
-        self.bot.edit_message(chat_id, message_id, self._render_update_result(server, container, result))
+        def edit(text: str, final: bool = False):
+            targets = [target for target in [primary] + self.command_queue.subscribers(job) if all(target)]
+            if payload.get('progress_channel'):
+                self.command_queue.publish_progress(job.get('target_server', ''), job['id'], text, targets)
+                return
+            for chat_id, message_id in targets:
+                self.bot.edit_message(chat_id, message_id, text, final=final)
+
+        return edit
+
+    def _follow_job_progress(self, server: str, job_id: str, chat_id: str, message_id: str):
+        with self._progress_lock:
+            if job_id in self._progress_followers:
+                return
+            self._progress_followers.add(job_id)
+
+        progress_file = self.command_queue.progress_file(server, job_id)
+        watcher = FileChangeWatcher(progress_file.parent, {progress_file.name})
+        last_text = None
+        last_edit = 0.0
+        delivered: Set[Tuple[str, str]] = set()
+        deadline = time.time() + REMOTE_JOB_TTL
+        try:
+            while not shutdown_flag.is_set() and time.time() < deadline:
+                record = self.command_queue.read_progress(server, job_id)
+                status = record.get('status')
+                text = record.get('text')
+                if status == 'expired' and not text:
+                    text = f"""⌛ <b>远程任务已过期</b>
+
+━━━━━━━━━━━━━━━━━━━━
+🖥️ 目标服务器: <code>{escape_html(server)}</code>
+🧾 任务号: <code>{escape_html(job_id)}</code>
 
-    def _execute_restart(self, chat_id: str, message_id: str, server: str, container: str):
-        self.bot.edit_message(chat_id, message_id, f'⏳ 正在重启容器 <code>{escape_html(container)}</code>...')
+目标服务器在有效期内未领取该任务，请确认其在线后重新提交。
+━━━━━━━━━━━━━━━━━━━━"""
+                targets = [tuple(target) for target in record.get('targets') or [[chat_id, message_id]]]
+                if text and text != last_text:
+                    wait = REMOTE_PROGRESS_EDIT_INTERVAL - (time.time() - last_edit)
+                    if wait > 0 and not status:
+                        time.sleep(wait)
+                        continue
+                    delivered.clear()
+                    last_text = text
+                    last_edit = time.time()
+                if text:
+                    # 任务结束时可能有新订阅者，它们也需要收到最终结果
+                    for target_chat, target_message in targets:
+                        if (target_chat, target_message) not in delivered:
+                            self.bot.edit_message(target_chat, target_message, text, final=bool(status))
+                            delivered.add((target_chat, target_message))
+                if status:
+                    break
+                if not watcher.wait(REMOTE_QUEUE_FALLBACK_POLL) and not self.command_queue.is_active(server, job_id):
+                    if not self.command_queue.read_progress(server, job_id).get('status'):
+                        logger.warning(f'远程任务已结束但没有进度记录: {server} -> {job_id}')
+                        break
+        finally:
+            watcher.close()
+            self.command_queue.clear_progress(server, job_id)
+            with self._progress_lock:
+                self._progress_followers.discard(job_id)
+
+    def _execute_update(self, chat_id: str, message_id: str, server: str, container: str,
+                        edit: Optional[Callable[..., None]] = None):
+        edit = edit or self._message_editor(chat_id, message_id)
+        current_msg = f'⏳ 正在更新容器 <code>{escape_html(container)}</code>...\n\n'
+        edit(current_msg + '📋 准备更新...')
+        result = self.docker.update_container(container, lambda msg: edit(current_msg + escape_html(msg)))
+        edit(self._render_update_result(server, container, result), final=True)
+
+    def _execute_restart(self, chat_id: str, message_id: str, server: str, container: str,
+                         edit: Optional[Callable[..., None]] = None):
+        edit = edit or self._message_editor(chat_id, message_id)
+        edit(f'⏳ 正在重启容器 <code>{escape_html(container)}</code>...')
         success = self.docker.restart_container(container)
-        self.bot.edit_message(chat_id, message_id, self._render_restart_result(server, container, success))
+        edit(self._render_restart_result(server, container, success), final=True)
+
+    def _render_batch_progress(self, action: str, server: str, states: Dict[str, Dict[str, Any]],
+                               finished: bool = False) -> str:
+        action_text = '更新' if action == 'update' else '重启'
+        succeeded = sum(1 for state in states.values() if state['status'] == 'success')
+        failed = sum(1 for state in states.values() if state['status'] == 'failed')
+        if not finished:
+            title = f'⏳ <b>批量{action_text}进行中</b>'
+        elif failed:
+            title = f'⚠️ <b>批量{action_text}完成（部分失败）</b>'
+        else:
+            title = f'✅ <b>批量{action_text}完成</b>'
+
+        icons = {'pending': '⏸️', 'running': '🔄', 'success': '✅', 'failed': '❌'}
+        lines = []
+        for container, state in states.items():
+            line = f"{icons[state['status']]} <code>{escape_html(container)}</code>"
+            if state.get('message'):
+                line += f"\n   {escape_html(state['message'][:120])}"
+            lines.append(line)
+        details = '\n'.join(lines)
+
+        return f"""{title}
+
+━━━━━━━━━━━━━━━━━━━━
+🖥️ 服务器: <code>{escape_html(server)}</code>
+📊 进度: <code>{succeeded + failed}/{len(states)}</code> (成功 {succeeded} · 失败 {failed})
+
+{details}
+━━━━━━━━━━━━━━━━━━━━
+⏰ 时间: <code>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</code>"""
+
+    def _execute_batch(self, chat_id: str, message_id: str, action: str, server: str,
+                       containers: List[str],
+                       runner: Callable[[Callable[[Dict[str, Any]], None]], Dict[str, Dict[str, Any]]],
+                       edit: Optional[Callable[..., None]] = None):
+        edit = edit or self._message_editor(chat_id, message_id)
+        states = {container: {'status': 'pending', 'message': '等待执行'} for container in containers}
+        lock = threading.Lock()
+
+        def apply_result(container: str, result: Dict[str, Any]):
+            state = states[container]
+            state['status'] = 'success' if result.get('success') else 'failed'
+            if result.get('success') and result.get('new_version'):
+                state['message'] = f"{result.get('old_version', 'unknown')} ➜ {result['new_version']}"
+            else:
+                state['message'] = result.get('message', '')
+
+        def on_event(event: Dict[str, Any]):
+            container = event.get('container')
+            if container not in states:
+                return
+            with lock:
+                if event.get('event') == 'start':
+                    states[container].update({'status': 'running', 'message': '开始执行'})
+                elif event.get('event') == 'progress':
+                    states[container].update({'status': 'running', 'message': str(event.get('message', ''))})
+                elif event.get('event') == 'done':
+                    apply_result(container, event.get('result') or {})
+                text = self._render_batch_progress(action, server, states)
+            edit(text)
+
+        edit(self._render_batch_progress(action, server, states))
+        try:
+            results = runner(on_event)
+        except Exception as exc:
+            logger.error(f'批量操作失败: server={server} action={action}: {exc}')
+            results = {
+                container: {'success': False, 'message': f'执行中断: {str(exc)[:200]}'}
+                for container, state in states.items() if state['status'] in {'pending', 'running'}
+            }
+
+        with lock:
+            for container, result in results.items():
+                if container in states:
+                    apply_result(container, result)
+            text = self._render_batch_progress(action, server, states, finished=True)
+        edit(text, final=True)
+
+    def _start_batch(self, chat_id: str, message_id: str, action: str, server: str, containers: List[str]):
+        if self._is_local_server(server):
+            runner = lambda on_event: run_batch_action(action, containers, BATCH_CONCURRENCY, self.docker, on_event)
+        elif self.remote_controller.uses_rpc(server):
+            runner = lambda on_event: self.remote_controller.execute_batch(
+                action, server, containers, on_event
+            ).get('results', {})
+        else:
+            job_id = self.command_queue.enqueue(server, f'batch_{action}', {
+                'server': server,
+                'containers': containers,
+                'chat_id': chat_id,
+                'message_id': message_id,
+                'source': 'interactive',
+                'progress_channel': True
+            })
+            if not job_id:
+                self.bot.edit_message(chat_id, message_id, '❌ 共享任务队列写入失败，请稍后重试')
+                return
+            self.bot.edit_message(
+                chat_id,
+                message_id,
+                f"⏳ 已提交批量任务...\n\n🖥️ 目标服务器: <code>{escape_html(server)}</code>\n"
+                f"🧾 任务号: <code>{escape_html(job_id)}</code>\n🧭 执行方式: <code>queue</code>"
+            )
+            self._run_async(self._follow_job_progress, server, job_id, chat_id, message_id)
+            return
+
+        self._run_async(self._execute_batch, chat_id, message_id, action, server, containers, runner)
 
     def _execute_remote_action_via_ssh(self, action: str, chat_id: str, message_id: str,
                                        server: str, container: str):
         action_text = '更新' if action == 'confirm_update' else '重启'
-        self.bot.edit_message(
-            chat_id,
-            message_id,
-            f'⏳ 正在通过 SSH 执行远程{action_text}...\n\n'
+        transport = self.remote_controller.transport_of(server).upper()
+        current_msg = (
+            f'⏳ 正在通过 {transport} 执行远程{action_text}...\n\n'
             f'🖥️ 目标服务器: <code>{escape_html(server)}</code>\n'
             f'📦 容器: <code>{escape_html(container)}</code>'
         )
+        self.bot.edit_message(chat_id, message_id, current_msg)
+        last_progress = [time.time()]
+
+        def on_event(event: Dict[str, Any]):
+            if event.get('event') == 'progress' and time.time() - last_progress[0] > 2:
+                self.bot.edit_message(chat_id, message_id, f"{current_msg}\n\n{escape_html(str(event.get('message', '')))}")
+                last_progress[0] = time.time()
 
         try:
-            payload = self.remote_controller.execute_action(action, server, container)
+            payload = self.remote_controller.execute_action(action, server, container, on_event)
             result = dict(payload.get('result', {}))
             if action == 'confirm_update':
                 message = self._render_update_result(server, container, result)
@@ -2290,14 +5638,14 @@ class CommandHandler:
             if action == 'confirm_update':
                 message = self._render_update_result(server, container, {
                     'success': False,
-                    'message': f'SSH 远程更新失败: {exc}',
+                    'message': f'{transport} 远程更新失败: {exc}',
                 })
             else:
                 message = self._render_restart_result(
                     server,
                     container,
                     False,
-                    f'SSH 远程重启失败: {exc}',
+                    f'{transport} 远程重启失败: {exc}',
                 )
 
         self.bot.edit_message(chat_id, message_id, message)
@@ -2310,9 +5658,17 @@ class CommandHandler:
         server = payload.get('server', self.bot.server_name)
         container = payload.get('container', '')
         if action == 'confirm_update' and container:
-            self._execute_update(chat_id, message_id, server, container)
+            self._execute_update(chat_id, message_id, server, container, self._job_editor(job))
         elif action == 'confirm_restart' and container:
-            self._execute_restart(chat_id, message_id, server, container)
+            self._execute_restart(chat_id, message_id, server, container, self._job_editor(job))
+        elif action in {'batch_update', 'batch_restart'} and payload.get('containers'):
+            batch_action = action.split('_', 1)[1]
+            containers = list(payload['containers'])
+            self._execute_batch(
+                chat_id, message_id, batch_action, server, containers,
+                lambda on_event: run_batch_action(batch_action, containers, BATCH_CONCURRENCY, self.docker, on_event),
+                self._job_editor(job)
+            )
         else:
             raise ValueError(f'不支持的远程任务: {action}')
 
@@ -2334,15 +5690,16 @@ class CommandHandler:
 ❌ <b>错误信息</b>
   {escape_html((error or '未知错误')[:300])}
 ━━━━━━━━━━━━━━━━━━━━"""
-        self.bot.edit_message(chat_id, message_id, failure_msg)
+        self._job_editor(job)(failure_msg)
 
     def _enqueue_remote_action(self, action: str, server: str, container: str, chat_id: str, message_id: str):
-        if self.remote_controller.uses_ssh(server):
+        if self.remote_controller.uses_rpc(server):
+            transport = self.remote_controller.transport_of(server)
             waiting = '⏳ 已提交远程更新任务...' if action == 'confirm_update' else '⏳ 已提交远程重启任务...'
             waiting += f"\n\n🖥️ 目标服务器: <code>{escape_html(server)}</code>"
             waiting += f"\n📦 容器: <code>{escape_html(container)}</code>"
-            waiting += '\n🧭 执行方式: <code>ssh</code>'
-            waiting += '\n\n请稍候，主服务器会通过 SSH 直连远程监控容器并继续回写此消息。'
+            waiting += f'\n🧭 执行方式: <code>{transport}</code>'
+            waiting += f'\n\n请稍候，主服务器会通过 {transport.upper()} 直连远程监控容器并继续回写此消息。'
             self.bot.edit_message(chat_id, message_id, waiting)
             self._run_async(self._execute_remote_action_via_ssh, action, chat_id, message_id, server, container)
             return
@@ -2351,7 +5708,9 @@ class CommandHandler:
             'server': server,
             'container': container,
             'chat_id': chat_id,
-            'message_id': message_id
+            'message_id': message_id,
+            'source': 'interactive',
+            'progress_channel': True
         })
         if not job_id:
             logger.error(f'远程任务提交失败: action={action} server={server} container={container}')
@@ -2374,6 +5733,33 @@ class CommandHandler:
         waiting += '\n🧭 执行方式: <code>queue</code>'
         waiting += '\n\n请稍候，目标服务器开始执行后会继续回写此消息。'
         self.bot.edit_message(chat_id, message_id, waiting)
+        self._run_async(self._follow_job_progress, server, job_id, chat_id, message_id)
+
+    def _render_single_confirm(self, action: str, server: str, container: str) -> Tuple[str, Dict]:
+        action_text = '更新' if action == 'update' else '重启'
+        notice = '⚠️ <b>注意：</b>容器将短暂停止服务\n\n' if action == 'update' else ''
+        confirm_msg = f"""⚠️ <b>确认{action_text}</b>
+
+━━━━━━━━━━━━━━━━━━━━
+🖥️ 服务器: <code>{escape_html(server)}</code>
+📦 容器: <code>{escape_html(container)}</code>
+
+{notice}是否继续？
+━━━━━━━━━━━━━━━━━━━━"""
+        buttons = {
+            'inline_keyboard': [
+                [{'text': f'✅ 确认{action_text}', 'callback_data': f'confirm_{action}:{server}:{container}'}],
+                [{'text': '❌ 取消', 'callback_data': 'cancel'}]
+            ]
+        }
+        return confirm_msg, buttons
+
+    def _start_single_action(self, action: str, chat_id: str, message_id: str, server: str, container: str):
+        if self._is_local_server(server):
+            target = self._execute_update if action == 'confirm_update' else self._execute_restart
+            threading.Thread(target=target, args=(chat_id, message_id, server, container), daemon=True).start()
+        else:
+            self._enqueue_remote_action(action, server, container, chat_id, message_id)
 
     def handle_callback(self, callback_data: str, callback_query_id: str,
                         chat_id: str, message_id: str):
@@ -2395,62 +5781,21 @@ class CommandHandler:
                 server = parts[1]
                 self.bot.edit_message(chat_id, message_id, f'✅ 已选择服务器：<code>{escape_html(server)}</code>')
                 self._show_server_status(chat_id, server)
-            elif action == 'update_srv':
-                server = parts[1]
-                self.bot.edit_message(chat_id, message_id, f'✅ 已选择服务器：<code>{escape_html(server)}</code>')
-                self._show_update_containers(chat_id, server)
-            elif action == 'update_cnt':
-                server, container = parts[1], parts[2]
-                confirm_msg = f"""⚠️ <b>确认更新</b>
-
-━━━━━━━━━━━━━━━━━━━━
-🖥️ 服务器: <code>{escape_html(server)}</code>
-📦 容器: <code>{escape_html(container)}</code>
-
-⚠️ <b>注意：</b>容器将短暂停止服务
-
-是否继续？
-━━━━━━━━━━━━━━━━━━━━"""
-                buttons = {
-                    'inline_keyboard': [
-                        [{'text': '✅ 确认更新', 'callback_data': f'confirm_update:{server}:{container}'}],
-                        [{'text': '❌ 取消', 'callback_data': 'cancel'}]
-                    ]
-                }
+            elif action == 'update_srv':
+                server = parts[1]
+                self.bot.edit_message(chat_id, message_id, f'✅ 已选择服务器：<code>{escape_html(server)}</code>')
+                self._show_update_containers(chat_id, server)
+            elif action in {'update_cnt', 'restart_cnt'}:
+                # 旧版本发出的单容器按钮仍可能留在聊天记录中
+                single_action = 'update' if action == 'update_cnt' else 'restart'
+                confirm_msg, buttons = self._render_single_confirm(single_action, parts[1], parts[2])
                 self.bot.edit_message(chat_id, message_id, confirm_msg, buttons)
-            elif action == 'confirm_update':
-                server, container = parts[1], parts[2]
-                if self._is_local_server(server):
-                    threading.Thread(target=self._execute_update, args=(chat_id, message_id, server, container), daemon=True).start()
-                else:
-                    self._enqueue_remote_action(action, server, container, chat_id, message_id)
+            elif action in {'confirm_update', 'confirm_restart'}:
+                self._start_single_action(action, chat_id, message_id, parts[1], parts[2])
             elif action == 'restart_srv':
                 server = parts[1]
                 self.bot.edit_message(chat_id, message_id, f'✅ 已选择服务器：<code>{escape_html(server)}</code>')
                 self._show_restart_containers(chat_id, server)
-            elif action == 'restart_cnt':
-                server, container = parts[1], parts[2]
-                confirm_msg = f"""⚠️ <b>确认重启</b>
-
-━━━━━━━━━━━━━━━━━━━━
-🖥️ 服务器: <code>{escape_html(server)}</code>
-📦 容器: <code>{escape_html(container)}</code>
-
-是否继续？
-━━━━━━━━━━━━━━━━━━━━"""
-                buttons = {
-                    'inline_keyboard': [
-                        [{'text': '✅ 确认重启', 'callback_data': f'confirm_restart:{server}:{container}'}],
-                        [{'text': '❌ 取消', 'callback_data': 'cancel'}]
-                    ]
-                }
-                self.bot.edit_message(chat_id, message_id, confirm_msg, buttons)
-            elif action == 'confirm_restart':
-                server, container = parts[1], parts[2]
-                if self._is_local_server(server):
-                    threading.Thread(target=self._execute_restart, args=(chat_id, message_id, server, container), daemon=True).start()
-                else:
-                    self._enqueue_remote_action(action, server, container, chat_id, message_id)
             elif action == 'monitor_action':
                 action_type = parts[1]
                 if action_type == 'list':
@@ -2472,19 +5817,81 @@ class CommandHandler:
                 self._handle_monitor_server(chat_id, message_id, parts[1], parts[2])
             elif action == 'add_mon':
                 server, container = parts[1], parts[2]
-                if self.remote_controller.uses_ssh(server):
+                if self.remote_controller.uses_rpc(server):
                     self.remote_controller.update_monitor_membership('add', server, container)
                 else:
                     self.config.remove_excluded(container, server)
                 self.bot.edit_message(chat_id, message_id, f'✅ <b>添加成功</b>\n\n已将 <code>{escape_html(container)}</code> 添加到服务器 <code>{escape_html(server)}</code> 的监控列表')
             elif action == 'rem_mon':
                 server, container = parts[1], parts[2]
-                if self.remote_controller.uses_ssh(server):
+                if self.remote_controller.uses_rpc(server):
                     self.remote_controller.update_monitor_membership('remove', server, container)
                 else:
                     self.config.add_excluded(container, server)
                 self.bot.edit_message(chat_id, message_id, f'✅ <b>移除成功</b>\n\n已将 <code>{escape_html(container)}</code> 从服务器 <code>{escape_html(server)}</code> 的监控列表移除')
+            elif action == 'sel':
+                batch_action, server, container = parts[1], parts[2], parts[3]
+                selection_key = self._selection_key(chat_id, message_id, batch_action, server)
+                selected = self._batch_selections.setdefault(selection_key, set())
+                selected.symmetric_difference_update({container})
+                text, buttons = self._render_selection(batch_action, server, selected)
+                self.bot.edit_message(chat_id, message_id, text, buttons)
+            elif action == 'selall':
+                batch_action, server = parts[1], parts[2]
+                candidates = set(self._selection_candidates(batch_action, server))
+                selection_key = self._selection_key(chat_id, message_id, batch_action, server)
+                selected = self._batch_selections.setdefault(selection_key, set())
+                if candidates and candidates <= selected:
+                    selected.clear()
+                else:
+                    selected.update(candidates)
+                text, buttons = self._render_selection(batch_action, server, selected)
+                self.bot.edit_message(chat_id, message_id, text, buttons)
+            elif action == 'batch':
+                batch_action, server = parts[1], parts[2]
+                selection_key = self._selection_key(chat_id, message_id, batch_action, server)
+                selected = sorted(self._batch_selections.get(selection_key, set()))
+                if not selected:
+                    text, buttons = self._render_selection(batch_action, server, set())
+                    self.bot.edit_message(chat_id, message_id, '⚠️ 请先选择容器\n\n' + text, buttons)
+                    return
+                if len(selected) == 1:
+                    # 只选了一个容器时走单容器流程，结果中保留耗时、就绪探测等诊断信息
+                    self._batch_selections.pop(selection_key, None)
+                    confirm_msg, buttons = self._render_single_confirm(batch_action, server, selected[0])
+                    self.bot.edit_message(chat_id, message_id, confirm_msg, buttons)
+                    return
+                action_text = '更新' if batch_action == 'update' else '重启'
+                container_lines = '\n'.join(f'  • <code>{escape_html(container)}</code>' for container in selected)
+                confirm_msg = f"""⚠️ <b>确认批量{action_text}</b>
+
+━━━━━━━━━━━━━━━━━━━━
+🖥️ 服务器: <code>{escape_html(server)}</code>
+📦 容器 ({len(selected)}):
+{container_lines}
+
+⚙️ 并发数: <code>{BATCH_CONCURRENCY}</code>
+
+是否继续？
+━━━━━━━━━━━━━━━━━━━━"""
+                buttons = {
+                    'inline_keyboard': [
+                        [{'text': f'✅ 确认{action_text}', 'callback_data': f'batch_ok:{batch_action}:{server}'}],
+                        [{'text': '❌ 取消', 'callback_data': 'cancel'}]
+                    ]
+                }
+                self.bot.edit_message(chat_id, message_id, confirm_msg, buttons)
+            elif action == 'batch_ok':
+                batch_action, server = parts[1], parts[2]
+                selection_key = self._selection_key(chat_id, message_id, batch_action, server)
+                selected = sorted(self._batch_selections.pop(selection_key, set()))
+                if selected:
+                    self._start_batch(chat_id, message_id, batch_action, server, selected)
+                else:
+                    self.bot.edit_message(chat_id, message_id, '⚠️ 选择已失效，请重新发起操作')
             elif action == 'cancel':
+                for selection_key in [key for key in self._batch_selections if key.startswith(f'{chat_id}:{message_id}:')]:
+                    self._batch_selections.pop(selection_key, None)
                 self.bot.edit_message(chat_id, message_id, '❌ 操作已取消')
         except Exception as e:
             logger.error(f'处理回调异常: {e}')
@@ -2495,12 +5902,19 @@ class CommandHandler:
             threading.Thread(target=cleanup, daemon=True).start()
 
     def _handle_monitor_server(self, chat_id: str, message_id: str, action: str, server: str):
-        inventory = self._get_server_inventory(server, force_refresh=True)
+        self._show_inventory_view(
+            chat_id,
+            server,
+            lambda inventory: self._render_monitor_server(action, server, inventory),
+            message_id
+        )
+
+    def _render_monitor_server(self, action: str, server: str,
+                               inventory: Dict[str, Any]) -> Tuple[str, Optional[Dict]]:
         if action == 'add':
             excluded = sorted(inventory.get('excluded_containers', []))
             if not excluded:
-                self.bot.edit_message(chat_id, message_id, f'✅ 服务器 <code>{escape_html(server)}</code> 所有容器都已在监控中')
-                return
+                return f'✅ 服务器 <code>{escape_html(server)}</code> 所有容器都已在监控中', None
             buttons = {
                 'inline_keyboard': [
                     [{'text': f'➕ {container}', 'callback_data': f'add_mon:{server}:{container}'}]
@@ -2508,52 +5922,157 @@ class CommandHandler:
                 ]
             }
             text = f'📡 <b>添加监控</b>\n\n🖥️ 服务器: <code>{escape_html(server)}</code>\n\n请选择要添加监控的容器：'
-            self.bot.edit_message(chat_id, message_id, text, buttons)
-        else:
-            monitored = sorted(inventory.get('monitored_containers', []))
-            if not monitored:
-                self.bot.edit_message(chat_id, message_id, f'⚠️ 服务器 <code>{escape_html(server)}</code> 当前没有监控中的容器')
-                return
-            buttons = {
-                'inline_keyboard': [
-                    [{'text': f'➖ {container}', 'callback_data': f'rem_mon:{server}:{container}'}]
-                    for container in monitored
-                ]
-            }
-            text = f'📡 <b>移除监控</b>\n\n🖥️ 服务器: <code>{escape_html(server)}</code>\n\n请选择要移除监控的容器：'
-            self.bot.edit_message(chat_id, message_id, text, buttons)
+            return text, buttons
+
+        monitored = sorted(inventory.get('monitored_containers', []))
+        if not monitored:
+            return f'⚠️ 服务器 <code>{escape_html(server)}</code> 当前没有监控中的容器', None
+        buttons = {
+            'inline_keyboard': [
+                [{'text': f'➖ {container}', 'callback_data': f'rem_mon:{server}:{container}'}]
+                for container in monitored
+            ]
+        }
+        text = f'📡 <b>移除监控</b>\n\n🖥️ 服务器: <code>{escape_html(server)}</code>\n\n请选择要移除监控的容器：'
+        return text, buttons
 
 class RemoteCommandWorker(threading.Thread):
-    def __init__(self, handler: CommandHandler, queue: RemoteCommandQueue, server_name: str, health_reporter: HealthReporter):
+    def __init__(self, handler: CommandHandler, queue: RemoteCommandQueue, server_name: str, health_reporter: HealthReporter,
+                 concurrency: int = REMOTE_WORKER_CONCURRENCY):
+        import concurrent.futures
+
         super().__init__(daemon=True)
         self.handler = handler
         self.queue = queue
         self.server_name = server_name
         self.health = health_reporter
+        self.concurrency = max(concurrency, 1)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix='remote-job'
+        )
+        self._lock = threading.Lock()
+        self._active: Dict[str, Dict] = {}
+        self._busy_containers: Set[str] = set()
+        self._deferred: List[Dict] = []
+        self._slot_freed = threading.Event()
+        self._wakeup_mode = 'poll'
 
     def run(self):
-        logger.info('远程命令工作线程已启动')
+        marker = self.queue.wakeup_marker(self.server_name)
+        watcher = FileChangeWatcher(marker.parent, {marker.name})
+        self._wakeup_mode = 'inotify' if watcher.available else 'poll'
+        logger.info(
+            f"远程命令工作线程已启动 (唤醒方式: {'inotify' if watcher.available else '轮询'}, 并发: {self.concurrency})"
+        )
+        try:
+            self._run_loop(watcher)
+        finally:
+            watcher.close()
+            self._executor.shutdown(wait=False)
+
+    def _run_loop(self, watcher: FileChangeWatcher):
+        renew_interval = REMOTE_JOB_PROCESSING_TIMEOUT / 3
+        last_renewal = time.time()
         while not shutdown_flag.is_set():
             try:
-                self.health.beat('remote_worker', details={'server': self.server_name})
+                self._report()
+                if time.time() - last_renewal >= renew_interval:
+                    with self._lock:
+                        held = list(self._active) + [job['id'] for job in self._deferred]
+                    self.queue.renew(self.server_name, held)
+                    last_renewal = time.time()
+
+                self._dispatch_deferred()
+                self._slot_freed.clear()
+                with self._lock:
+                    saturated = (
+                        len(self._active) >= self.concurrency
+                        or len(self._deferred) >= self.concurrency * 4
+                    )
+                    waiting_on_locks = bool(self._deferred)
+                if saturated:
+                    self._slot_freed.wait(min(REMOTE_QUEUE_FALLBACK_POLL, renew_interval))
+                    continue
+
                 job = self.queue.claim(self.server_name)
                 if not job:
-                    time.sleep(1)
+                    watcher.wait(1 if waiting_on_locks else REMOTE_QUEUE_FALLBACK_POLL)
                     continue
-                try:
-                    self.handler.process_remote_job(job)
-                    self.queue.complete(job['id'])
-                except Exception as e:
-                    self.queue.fail(job['id'], str(e))
-                    self.handler.notify_remote_job_failure(job, str(e))
-                    self.health.fail('remote_worker', e)
-                    logger.error(f'远程命令处理失败: {e}')
-                    time.sleep(2)
+                with self._lock:
+                    self._deferred.append(job)
+                self._dispatch_deferred()
             except Exception as e:
                 self.health.fail('remote_worker', e)
                 logger.error(f'远程命令处理失败: {e}')
                 time.sleep(2)
 
+    def _report(self):
+        with self._lock:
+            details = {
+                'server': self.server_name,
+                'wakeup': self._wakeup_mode,
+                'capacity': self.concurrency,
+                'active': len(self._active),
+                'deferred': len(self._deferred),
+                'jobs': [
+                    f"{job.get('action')}:{','.join(sorted(self._job_containers(job))) or '-'}"
+                    for job in self._active.values()
+                ],
+            }
+        self.health.beat('remote_worker', details=details)
+
+    @staticmethod
+    def _job_containers(job: Dict) -> Set[str]:
+        payload = job.get('payload', {})
+        containers = set(payload.get('containers') or [])
+        if payload.get('container'):
+            containers.add(payload['container'])
+        return containers
+
+    @staticmethod
+    def _container_lock_held(container: str) -> bool:
+        lock_path = Path(str(container_lock_path(container)) + '.lock')
+        try:
+            return time.time() - lock_path.stat().st_mtime < REMOTE_JOB_PROCESSING_TIMEOUT
+        except OSError:
+            return False
+
+    def _dispatch_deferred(self):
+        with self._lock:
+            blocked: Set[str] = set()
+            remaining = []
+            for job in self._deferred:
+                containers = self._job_containers(job)
+                runnable = (
+                    len(self._active) < self.concurrency
+                    and not containers & (blocked | self._busy_containers)
+                    and not any(self._container_lock_held(container) for container in containers)
+                )
+                if not runnable:
+                    blocked |= containers
+                    remaining.append(job)
+                    continue
+                self._active[job['id']] = job
+                self._busy_containers |= containers
+                self._executor.submit(self._execute, job)
+            self._deferred = remaining
+
+    def _execute(self, job: Dict):
+        try:
+            self.handler.process_remote_job(job)
+            self.queue.complete(job['id'])
+        except Exception as e:
+            self.handler.notify_remote_job_failure(job, str(e))
+            self.queue.fail(job['id'], str(e))
+            self.health.fail('remote_worker', e)
+            logger.error(f'远程命令处理失败: {e}')
+        finally:
+            with self._lock:
+                self._active.pop(job['id'], None)
+                self._busy_containers -= self._job_containers(job)
+            self._dispatch_deferred()
+            self._slot_freed.set()
+
 class BotPoller(threading.Thread):
     def __init__(self, handler: CommandHandler, bot: TelegramBot,
                  coordinator: CommandCoordinator, health_reporter: HealthReporter):
@@ -2626,6 +6145,8 @@ class BotPoller(threading.Thread):
                 self.handler.handle_monitor(chat_id)
             elif text.startswith('/servers'):
                 self.handler.handle_servers(chat_id)
+            elif text.startswith('/top'):
+                self.handler.handle_top(chat_id)
             elif text.startswith('/help') or text.startswith('/start'):
                 self.handler.handle_help()
         except Exception as e:
@@ -2648,10 +6169,12 @@ class BotPoller(threading.Thread):
             logger.error(f"处理回调失败: {e}")
 
 class HeartbeatThread(threading.Thread):
-    def __init__(self, registry: ServerRegistry, health_reporter: HealthReporter):
+    def __init__(self, registry: ServerRegistry, health_reporter: HealthReporter,
+                 outbox: Optional[NotificationOutbox] = None):
         super().__init__(daemon=True)
         self.registry = registry
         self.health = health_reporter
+        self.outbox = outbox
 
     def run(self):
         logger.info("心跳线程已启动")
@@ -2661,6 +6184,8 @@ class HeartbeatThread(threading.Thread):
             try:
                 self.registry.heartbeat()
                 self.health.beat('heartbeat', details={'interval': self.registry.heartbeat_interval})
+                if self.outbox:
+                    self.health.beat('outbox', details=self.outbox.stats())
                 time.sleep(self.registry.heartbeat_interval)
             except Exception as e:
                 self.health.fail('heartbeat', e)
@@ -2677,6 +6202,9 @@ class WatchtowerMonitor:
         self.session_data = {}
         self.state_store = UpdateStateManager(UPDATE_STATE_FILE, bot.server_name)
         self._cycle_global_error_signatures: Set[str] = set()
+        self._cycle_digest: Optional[NotificationDigest] = None
+        self._deferred_updates: Dict[str, threading.Thread] = {}
+        self._deferred_lock = threading.Lock()
 
     def _publish_local_inventory(self):
         containers = sorted(self.docker.get_all_containers())
@@ -2698,9 +6226,39 @@ class WatchtowerMonitor:
     def _resolve_mode(self) -> str:
         return resolve_update_mode()
 
+    def _recover_interrupted_updates(self):
+        results = self.docker.recover_interrupted_updates()
+        if not results:
+            return
+
+        state_text = {
+            'healthy': '✅ 已完成更新',
+            'rolled_back': '↩️ 已回滚',
+            'failed': '❌ 恢复失败',
+        }
+        lines = []
+        for item in results:
+            lines.append(
+                f"📦 <code>{escape_html(item['container'])}</code> "
+                f"(中断于 <code>{escape_html(item.get('interrupted_state') or 'unknown')}</code>)\n"
+                f"  {state_text.get(item['state'], item['state'])}: {escape_html(item['message'])}"
+            )
+        details = "\n\n".join(lines)
+
+        message = f'''<b>[{escape_html(self.bot.server_name)}]</b> ♻️ <b>已恢复中断的更新</b>
+
+━━━━━━━━━━━━━━━━━━━━
+{details}
+
+⏰ <b>时间</b>
+  <code>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</code>
+━━━━━━━━━━━━━━━━━━━━'''
+        self.bot.notify(message, priority=TelegramBot.PRIORITY_CRITICAL)
+
     def start(self):
         mode = self._resolve_mode()
         logger.info(f'更新检测模式: {mode}')
+        self._recover_interrupted_updates()
         self._publish_local_inventory()
         self.health.beat('update_monitor', status='starting', details={'mode': mode})
 
@@ -2804,10 +6362,26 @@ class WatchtowerMonitor:
         )
         self.state_store.prune_containers(set(containers))
 
-        for container in containers:
-            if shutdown_flag.is_set():
-                break
-            self._check_container_update(container)
+        if NOTIFY_DIGEST:
+            self._cycle_digest = NotificationDigest(self.bot.server_name)
+        try:
+            for container in containers:
+                if shutdown_flag.is_set():
+                    break
+                self._check_container_update(container)
+        finally:
+            digest, self._cycle_digest = self._cycle_digest, None
+            if digest:
+                for text, priority, key in digest.close():
+                    self.bot.notify(text, priority=priority, key=key)
+
+    def _emit_notification(self, category: str, message: str, line: str, key: str):
+        priority = NotificationDigest.CATEGORIES[category][2]
+        digest = self._cycle_digest
+        immediate = NOTIFY_DIGEST_CRITICAL_IMMEDIATE and priority == TelegramBot.PRIORITY_CRITICAL
+        if digest and not immediate and digest.add(category, message, line, key):
+            return
+        self.bot.notify(message, priority=priority, key=key)
 
     def _format_remote_version(self, image: str, image_id: str) -> str:
         image_short = image_id.replace('sha256:', '')[:12] if image_id else 'unknown'
@@ -2834,7 +6408,9 @@ class WatchtowerMonitor:
 ━━━━━━━━━━━━━━━━━━━━
 
 💡 当前为仅通知模式，可通过 /update 手动更新'''
-        self.bot.send_message(message)
+        line = (f'📦 <code>{escape_html(container)}</code>\n'
+                f'  <code>{escape_html(current_version)}</code> ➜ <code>{escape_html(latest_version)}</code>')
+        self._emit_notification('update_available', message, line, f'update_available:{container}:{latest_version}')
 
     def _send_update_failure_notification(self, container: str, image: str,
                                           current_version: str, latest_version: str,
@@ -2858,7 +6434,9 @@ class WatchtowerMonitor:
 ⏰ <b>时间</b>
   <code>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</code>
 ━━━━━━━━━━━━━━━━━━━━'''
-        self.bot.send_message(message)
+        line = (f'📦 <code>{escape_html(container)}</code> ➜ <code>{escape_html(latest_version)}</code>\n'
+                f'  {escape_html(error_message[:300])}')
+        self._emit_notification('update_failure', message, line, f'update_failure:{container}:{latest_version}')
 
     def _send_check_error_notification(self, container: str, image: str, error_message: str):
         message = f'''<b>[{escape_html(self.bot.server_name)}]</b> ⚠️ <b>检查更新失败</b>
@@ -2876,9 +6454,46 @@ class WatchtowerMonitor:
 ⏰ <b>时间</b>
   <code>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</code>
 ━━━━━━━━━━━━━━━━━━━━'''
-        self.bot.send_message(message)
+        line = f'📦 <code>{escape_html(container)}</code>\n  {escape_html(error_message[:300])}'
+        self._emit_notification('check_error', message, line, f'check_error:{container}:{error_message[:200]}')
+
+    def _schedule_deferred_update(self, container: str, target: Dict[str, str]) -> bool:
+        with self._deferred_lock:
+            if container in self._deferred_updates:
+                return False
+            worker = threading.Thread(
+                target=self._run_deferred_update,
+                args=(container, target),
+                name=f'deferred-update-{container}',
+                daemon=True
+            )
+            self._deferred_updates[container] = worker
+
+        logger.info(f'容器 {container} 存在新版本，将在 {UPDATE_DEFER_WINDOW} 秒窗口内选择低负载时刻更新')
+        worker.start()
+        return True
+
+    def _run_deferred_update(self, container: str, target: Dict[str, str]):
+        try:
+            planner = QuietMomentPlanner(
+                UPDATE_DEFER_WINDOW,
+                UPDATE_DEFER_SAMPLE_INTERVAL,
+                UPDATE_DEFER_QUIET_CPU,
+                UPDATE_DEFER_QUIET_NET_KBPS
+            )
+            schedule = planner.wait(lambda: self.docker.sample_container_activity(container))
+            if schedule is None:
+                return
+            logger.info(f'容器 {container} 选定更新时机: {format_update_schedule(schedule)}')
+            self._check_container_update(container, schedule=schedule, target=target)
+        except Exception as e:
+            logger.exception(f'容器 {container} 延迟更新失败: {e}')
+        finally:
+            with self._deferred_lock:
+                self._deferred_updates.pop(container, None)
 
-    def _check_container_update(self, container: str):
+    def _check_container_update(self, container: str, schedule: Optional[Dict[str, Any]] = None,
+                                target: Optional[Dict[str, str]] = None):
         current_info = self.docker.get_container_info(container)
         if not current_info or not current_info.get('image') or not current_info.get('image_id'):
             logger.warning(f'跳过容器 {container}，无法获取当前镜像信息')
@@ -2899,7 +6514,11 @@ class WatchtowerMonitor:
             'last_checked_at': now
         })
 
-        pull_result = self.docker.pull_image(image)
+        if target and target.get('image') == image and self.docker._has_target_image(image, target.get('image_id')):
+            # 延迟更新沿用调度时已拉取的目标版本，不再重复拉取
+            pull_result = {'success': True, 'image_id': target['image_id']}
+        else:
+            pull_result = self.docker.pull_image(image)
         if not pull_result['success']:
             is_global_error = bool(pull_result.get('is_global_error'))
             error_key = pull_result.get('error_key') or ''
@@ -2955,10 +6574,17 @@ class WatchtowerMonitor:
             DockerManager.cleanup_image_if_unused(latest_image_id, keep_image_ids={current_image_id})
             return
 
+        if UPDATE_DEFER_WINDOW > 0 and schedule is None:
+            self._schedule_deferred_update(container, {'image': image, 'image_id': latest_image_id})
+            self.state_store.set_container_state(container, new_state)
+            return
+
         logger.info(f'检测到容器 {container} 存在新版本，开始自动更新')
         new_state['last_attempt_at'] = now
         new_state['last_attempt_target_image_id'] = latest_image_id
-        update_result = self.docker.update_container(container)
+        update_result = self.docker.update_container(container, target_image_id=latest_image_id)
+        if schedule:
+            update_result['schedule'] = schedule
 
         refreshed_info = self.docker.get_container_info(container)
         if refreshed_info:
@@ -2976,7 +6602,8 @@ class WatchtowerMonitor:
                     image.split(':')[0],
                     update_result.get('old_version') or current_version,
                     update_result.get('new_version') or latest_version,
-                    True
+                    True,
+                    update_result=update_result
                 )
             for key in [
                 'available_image_id',
@@ -3115,8 +6742,10 @@ class WatchtowerMonitor:
         return f'{tag} ({id_short})'
 
     def _send_update_notification(self, container: str, image: str,
-                                  old_ver: str, new_ver: str, running: bool):
+                                  old_ver: str, new_ver: str, running: bool,
+                                  update_result: Optional[Dict[str, Any]] = None):
         current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        timing_section = render_update_diagnostics(update_result)
         if running:
             message = f'''<b>[{escape_html(self.bot.server_name)}]</b> ✨ <b>容器更新成功</b>
 
@@ -3134,7 +6763,7 @@ class WatchtowerMonitor:
 
 ⏰ <b>更新时间</b>
   <code>{current_time}</code>
-━━━━━━━━━━━━━━━━━━━━
+{timing_section}━━━━━━━━━━━━━━━━━━━━
 
 ✅ 容器已成功启动并运行正常'''
         else:
@@ -3157,7 +6786,17 @@ class WatchtowerMonitor:
 
 ⚠️ 更新后无法启动
 💡 检查: <code>docker logs {escape_html(container)}</code>'''
-        self.bot.send_message(message)
+        if running:
+            line = (f'📦 <code>{escape_html(container)}</code>\n'
+                    f'  <code>{escape_html(old_ver)}</code> ➜ <code>{escape_html(new_ver)}</code>')
+        else:
+            line = f'📦 <code>{escape_html(container)}</code> ➜ <code>{escape_html(new_ver)}</code>\n  ⚠️ 更新后无法启动'
+        self._emit_notification(
+            'update_success' if running else 'update_failure',
+            message,
+            line,
+            f'update_result:{container}:{new_ver}:{running}'
+        )
 
     def _process_error(self, line: str):
         if any(keyword in line.lower() for keyword in ['skipping', 'already up to date', 'no new images', 'connection refused', 'timeout']):
@@ -3176,13 +6815,13 @@ class WatchtowerMonitor:
                     pass
         if container and container not in ['watchtower', 'watchtower-notifier'] and self.config.is_monitored(container):
             error_msg = line[:200]
-            self.bot.send_message(f'''<b>[{escape_html(self.bot.server_name)}]</b> ⚠️ <b>Watchtower 严重错误</b>
+            self.bot.notify(f'''<b>[{escape_html(self.bot.server_name)}]</b> ⚠️ <b>Watchtower 严重错误</b>
 
 ━━━━━━━━━━━━━━━━━━━━
 📦 <b>容器</b>: <code>{escape_html(container)}</code>
 🔴 <b>错误</b>: <code>{escape_html(error_msg)}</code>
 🕐 <b>时间</b>: <code>{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</code>
-━━━━━━━━━━━━━━━━━━━━''')
+━━━━━━━━━━━━━━━━━━━━''', priority=TelegramBot.PRIORITY_CRITICAL)
 
 
 def emit_rpc_payload(payload: Dict[str, Any]) -> int:
@@ -3190,12 +6829,64 @@ def emit_rpc_payload(payload: Dict[str, Any]) -> int:
     return 0 if payload.get('ok', False) else 1
 
 
-def run_rpc(argv: List[str]) -> int:
+def guard_rpc_emit(emit: Optional[Callable[[Dict[str, Any]], None]]) -> Callable[[Dict[str, Any]], None]:
+    def guarded(event: Dict[str, Any]):
+        if emit is None:
+            return
+        try:
+            emit(event)
+        except Exception as exc:
+            # 进度推送失败（如客户端断开）不能中断正在进行的 Docker 操作
+            logger.debug(f'推送 RPC 进度失败: {exc}')
+
+    return guarded
+
+
+def run_batch_action(action: str, containers: List[str], concurrency: int, docker: 'DockerManager',
+                     emit: Callable[[Dict[str, Any]], None]) -> Dict[str, Dict[str, Any]]:
+    import concurrent.futures
+
+    emit = guard_rpc_emit(emit)
+    results: Dict[str, Dict[str, Any]] = {}
+
+    def run_one(container: str) -> Dict[str, Any]:
+        emit({'event': 'start', 'container': container, 'timestamp': time.time()})
+        try:
+            if action == 'update':
+                result = docker.update_container(
+                    container,
+                    lambda message: emit({'event': 'progress', 'container': container, 'message': message})
+                )
+            else:
+                emit({'event': 'progress', 'container': container, 'message': '🔄 正在重启容器...'})
+                success = docker.restart_container(container)
+                result = {'success': success, 'message': '容器重启成功' if success else '容器重启失败'}
+        except Exception as exc:
+            result = {'success': False, 'message': str(exc)[:300]}
+        emit({'event': 'done', 'container': container, 'result': result, 'timestamp': time.time()})
+        return result
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(min(concurrency, len(containers)), 1)) as executor:
+        futures = {executor.submit(run_one, container): container for container in containers}
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] = future.result()
+    return {container: results[container] for container in containers}
+
+
+def build_rpc_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(prog='monitor.py rpc')
     subparsers = parser.add_subparsers(dest='rpc_command', required=True)
 
     subparsers.add_parser('ping')
-    subparsers.add_parser('inventory')
+    subparsers.add_parser('serve')
+
+    inventory_parser = subparsers.add_parser('inventory')
+    inventory_parser.add_argument('--since', default='')
+    inventory_parser.add_argument('--fields', default='')
+    inventory_parser.add_argument('--compress', action='store_true')
+
+    top_parser = subparsers.add_parser('top')
+    top_parser.add_argument('--limit', type=int, default=TOP_CONTAINER_LIMIT)
 
     update_parser = subparsers.add_parser('update')
     update_parser.add_argument('--container', required=True)
@@ -3203,45 +6894,75 @@ def run_rpc(argv: List[str]) -> int:
     restart_parser = subparsers.add_parser('restart')
     restart_parser.add_argument('--container', required=True)
 
+    for batch_command in ('update-batch', 'restart-batch'):
+        batch_parser = subparsers.add_parser(batch_command)
+        batch_parser.add_argument('--containers', required=True)
+        batch_parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY)
+
     monitor_add_parser = subparsers.add_parser('monitor-add')
     monitor_add_parser.add_argument('--container', required=True)
 
     monitor_remove_parser = subparsers.add_parser('monitor-remove')
     monitor_remove_parser.add_argument('--container', required=True)
+    return parser
 
-    args = parser.parse_args(argv)
-    server_name = SERVER_NAME or os.getenv('SERVER_NAME') or 'unknown'
-    docker = DockerManager()
-    config = ConfigManager(MONITOR_CONFIG, server_name)
 
+def execute_rpc(args: argparse.Namespace, docker: 'DockerManager', config: 'ConfigManager',
+                server_name: str, emit: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    emit = guard_rpc_emit(emit)
     try:
         if args.rpc_command == 'ping':
-            return emit_rpc_payload({
+            return {
                 'ok': True,
                 'server_name': server_name,
                 'version': VERSION,
                 'mode': resolve_update_mode(),
                 'timestamp': time.time(),
-            })
+            }
 
         if args.rpc_command == 'inventory':
-            payload = build_inventory_payload(server_name, docker, config)
+            fields = [field.strip() for field in args.fields.split(',') if field.strip()]
+            payload = project_inventory(build_inventory_payload(server_name, docker, config), fields)
             payload['version'] = VERSION
-            return emit_rpc_payload(payload)
+            revision, container_hashes = compute_inventory_revision(payload)
+            payload['revision'] = revision
+
+            revisions = InventoryRevisionStore(INVENTORY_REVISIONS_FILE)
+            previous_hashes = revisions.get(args.since) if args.since else None
+            revisions.record(revision, container_hashes)
+            if previous_hashes is not None:
+                payload = build_inventory_delta(payload, args.since, previous_hashes, container_hashes)
+            return compress_rpc_payload(payload) if args.compress else payload
+
+        if args.rpc_command == 'top':
+            return build_top_payload(server_name, docker, max(args.limit, 1))
 
         if args.rpc_command == 'update':
-            return emit_rpc_payload({
+            progress = lambda message: emit({'event': 'progress', 'container': args.container, 'message': message})
+            return {
                 'ok': True,
                 'action': 'update',
                 'server_name': server_name,
                 'container': args.container,
-                'result': docker.update_container(args.container),
+                'result': docker.update_container(args.container, progress),
                 'timestamp': time.time(),
-            })
+            }
+
+        if args.rpc_command in {'update-batch', 'restart-batch'}:
+            containers = [item.strip() for item in args.containers.split(',') if item.strip()]
+            action = args.rpc_command.split('-')[0]
+            results = run_batch_action(action, containers, max(args.concurrency, 1), docker, emit)
+            return {
+                'ok': True,
+                'action': args.rpc_command,
+                'server_name': server_name,
+                'results': results,
+                'timestamp': time.time(),
+            }
 
         if args.rpc_command == 'restart':
             success = docker.restart_container(args.container)
-            return emit_rpc_payload({
+            return {
                 'ok': True,
                 'action': 'restart',
                 'server_name': server_name,
@@ -3251,45 +6972,342 @@ def run_rpc(argv: List[str]) -> int:
                     'message': '容器重启成功' if success else '容器重启失败',
                 },
                 'timestamp': time.time(),
-            })
+            }
 
         if args.rpc_command == 'monitor-add':
             config.remove_excluded(args.container)
-            return emit_rpc_payload({
+            return {
                 'ok': True,
                 'action': 'monitor-add',
                 'server_name': server_name,
                 'container': args.container,
                 'excluded_containers': sorted(config.get_excluded_containers()),
                 'timestamp': time.time(),
-            })
+            }
 
         if args.rpc_command == 'monitor-remove':
             config.add_excluded(args.container)
-            return emit_rpc_payload({
+            return {
                 'ok': True,
                 'action': 'monitor-remove',
                 'server_name': server_name,
                 'container': args.container,
                 'excluded_containers': sorted(config.get_excluded_containers()),
                 'timestamp': time.time(),
-            })
+            }
     except Exception as exc:
-        return emit_rpc_payload({
+        return {
             'ok': False,
             'server_name': server_name,
             'error': str(exc)[:300],
             'timestamp': time.time(),
-        })
+        }
 
-    return emit_rpc_payload({
+    return {
         'ok': False,
         'server_name': server_name,
         'error': f'未知 RPC 命令: {args.rpc_command}',
         'timestamp': time.time(),
+    }
+
+
+def dispatch_rpc_request(parser: argparse.ArgumentParser, rpc_args: List[str], docker: 'DockerManager',
+                         config: 'ConfigManager', server_name: str,
+                         emit: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    try:
+        args = parser.parse_args(rpc_args)
+    except SystemExit:
+        return {'ok': False, 'server_name': server_name, 'error': f'无效的 RPC 参数: {rpc_args}'}
+    if args.rpc_command == 'serve':
+        return {'ok': False, 'server_name': server_name, 'error': '会话内不支持 serve'}
+    return execute_rpc(args, docker, config, server_name, emit)
+
+
+def build_agent_request_handler() -> type:
+    # http.server 只在启用 Agent 时才需要，避免拖慢 rpc 等短命令的启动
+    from http.server import BaseHTTPRequestHandler
+
+    class AgentRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        server_version = 'watchtower-monitor-agent'
+
+        def setup(self):
+            super().setup()
+            self.server.agent.connections += 1
+
+        def log_message(self, format, *args):
+            logger.debug(f'Agent {self.address_string()} {format % args}')
+
+        def _reply_json(self, status: int, payload: Dict[str, Any]):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _write_chunk(self, message: Dict[str, Any]):
+            data = (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+            self.wfile.write(f'{len(data):X}\r\n'.encode('ascii') + data + b'\r\n')
+            self.wfile.flush()
+
+        def do_POST(self):
+            agent = self.server.agent
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            if self.path != '/rpc':
+                self._reply_json(404, {'ok': False, 'error': f'未知路径: {self.path}'})
+                return
+            expected = f'Bearer {agent.token}'.encode('utf-8')
+            if not agent.token or not hmac.compare_digest(self.headers.get('Authorization', '').encode('utf-8'), expected):
+                self._reply_json(401, {'ok': False, 'error': '认证失败'})
+                return
+            try:
+                rpc_args = [str(item) for item in json.loads(body)['args']]
+            except Exception as exc:
+                self._reply_json(400, {'ok': False, 'error': f'无效的请求: {exc}'})
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            write_lock = threading.Lock()
+            disconnected = [False]
+
+            def emit(event: Dict[str, Any]):
+                with write_lock:
+                    if disconnected[0]:
+                        return
+                    try:
+                        self._write_chunk({'event': event})
+                    except OSError:
+                        # 客户端断开后继续执行操作，只是不再推送进度
+                        disconnected[0] = True
+
+            payload = dispatch_rpc_request(agent.parser, rpc_args, agent.docker, agent.config, agent.server_name, emit)
+            with write_lock:
+                if disconnected[0]:
+                    self.close_connection = True
+                    return
+                self._write_chunk({'payload': payload})
+                self.wfile.write(b'0\r\n\r\n')
+                self.wfile.flush()
+
+    return AgentRequestHandler
+
+
+class AgentServer:
+    def __init__(self, address: Tuple[str, int], token: str, docker: 'DockerManager',
+                 config: 'ConfigManager', server_name: str):
+        from http.server import ThreadingHTTPServer
+
+        self.token = token
+        self.docker = docker
+        self.config = config
+        self.server_name = server_name
+        self.parser = build_rpc_parser()
+        self.connections = 0
+        self.httpd = ThreadingHTTPServer(address, build_agent_request_handler())
+        self.httpd.daemon_threads = True
+        self.httpd.agent = self
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.httpd.server_address[:2]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='agent-server', daemon=True).start()
+        logger.info(f'Agent 服务已监听: {self.address[0]}:{self.address[1]}')
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def parse_listen_address(value: str, default_port: int) -> Tuple[str, int]:
+    host, separator, port = value.rpartition(':')
+    if not separator:
+        return ('0.0.0.0', int(value)) if value.isdigit() else (value, default_port)
+    return host.strip('[]') or '0.0.0.0', int(port or default_port)
+
+
+class ControlSocketHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        control = self.server.control
+        stdin = io.TextIOWrapper(self.rfile, encoding='utf-8')
+        stdout = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+        try:
+            serve_rpc_session(control.parser, control.docker, control.config, control.server_name, stdin, stdout)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug('控制 socket 客户端已断开')
+
+
+class ControlSocketServer:
+    def __init__(self, socket_path: Path, docker: 'DockerManager', config: 'ConfigManager', server_name: str):
+        self.socket_path = socket_path
+        self.docker = docker
+        self.config = config
+        self.server_name = server_name
+        self.parser = build_rpc_parser()
+        self.server: Optional[socketserver.ThreadingUnixStreamServer] = None
+
+    def start(self) -> bool:
+        if self.socket_path.exists():
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.settimeout(1)
+                probe.connect(str(self.socket_path))
+                logger.warning(f'控制 socket 已被其他进程占用: {self.socket_path}')
+                return False
+            except OSError:
+                self.socket_path.unlink(missing_ok=True)
+            finally:
+                probe.close()
+
+        self.server = socketserver.ThreadingUnixStreamServer(str(self.socket_path), ControlSocketHandler)
+        self.server.daemon_threads = True
+        self.server.control = self
+        os.chmod(self.socket_path, 0o600)
+        threading.Thread(target=self.server.serve_forever, name='control-socket', daemon=True).start()
+        logger.info(f'控制 socket 已监听: {self.socket_path}')
+        return True
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.socket_path.unlink(missing_ok=True)
+
+
+def forward_rpc_to_daemon(socket_path: Path, argv: List[str], rpc_command: str) -> Optional[int]:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(1)
+        sock.connect(str(socket_path))
+        sock.settimeout(None)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        reader = sock.makefile('r', encoding='utf-8')
+        writer = sock.makefile('w', encoding='utf-8')
+        if rpc_command == 'serve':
+            def pump():
+                try:
+                    for line in sys.stdin:
+                        writer.write(line)
+                        writer.flush()
+                    sock.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+
+            threading.Thread(target=pump, daemon=True).start()
+            for line in reader:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+            return 0
+
+        try:
+            writer.write(json.dumps({'id': 1, 'args': argv}, ensure_ascii=False) + '\n')
+            writer.flush()
+            sock.shutdown(socket.SHUT_WR)
+            for line in reader:
+                message = json.loads(line)
+                if 'event' in message:
+                    print(json.dumps(message['event'], ensure_ascii=False), flush=True)
+                elif 'payload' in message:
+                    return emit_rpc_payload(message['payload'])
+        except (OSError, json.JSONDecodeError) as exc:
+            logger.warning(f'守护进程连接中断: {exc}')
+
+    if rpc_command in RemoteServerController.IDEMPOTENT_RPC_COMMANDS:
+        return None
+    return emit_rpc_payload({
+        'ok': False,
+        'server_name': SERVER_NAME,
+        'error': '守护进程连接中断，操作结果未知，请确认后重试',
+        'timestamp': time.time(),
     })
 
+
+def serve_rpc_session(parser: argparse.ArgumentParser, docker: 'DockerManager', config: 'ConfigManager',
+                      server_name: str, stdin=None, stdout=None) -> int:
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    write_lock = threading.Lock()
+    workers: List[threading.Thread] = []
+    disconnected = [False]
+
+    def respond(request_id: Any, payload: Dict[str, Any], key: str = 'payload'):
+        with write_lock:
+            if disconnected[0]:
+                return
+            try:
+                stdout.write(json.dumps({'id': request_id, key: payload}, ensure_ascii=False) + '\n')
+                stdout.flush()
+            except (OSError, ValueError):
+                # 客户端断开后操作继续执行完成，只是不再推送进度和结果
+                disconnected[0] = True
+                logger.warning(f'RPC 会话客户端已断开，请求 {request_id} 将在后台继续执行')
+
+    def handle(request_id: Any, rpc_args: List[str]):
+        def emit(event: Dict[str, Any]):
+            respond(request_id, event, key='event')
+
+        respond(request_id, dispatch_rpc_request(parser, rpc_args, docker, config, server_name, emit))
+
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            request_id = request['id']
+            rpc_args = [str(item) for item in request['args']]
+        except Exception as exc:
+            respond(None, {'ok': False, 'server_name': server_name, 'error': f'无效的会话请求: {exc}'})
+            continue
+
+        worker = threading.Thread(target=handle, args=(request_id, rpc_args), daemon=True)
+        worker.start()
+        workers = [item for item in workers if item.is_alive()] + [worker]
+
+    for worker in workers:
+        worker.join()
+    return 0
+
+
+def run_rpc(argv: List[str]) -> int:
+    parser = build_rpc_parser()
+    args = parser.parse_args(argv)
+    if RPC_FORWARD:
+        forwarded = forward_rpc_to_daemon(RPC_CONTROL_SOCKET, argv, args.rpc_command)
+        if forwarded is not None:
+            return forwarded
+    ensure_data_dirs()
+    server_name = SERVER_NAME or os.getenv('SERVER_NAME') or 'unknown'
+    DockerManager.update_journal = UpdateJournal(UPDATE_JOURNAL_FILE)
+    DockerManager.step_timings = StepTimingStore(STEP_TIMINGS_FILE)
+    DockerManager.resource_sampler = CgroupResourceSampler(CGROUP_ROOT)
+    docker = DockerManager()
+    config = ConfigManager(MONITOR_CONFIG, server_name)
+
+    if args.rpc_command == 'serve':
+        return serve_rpc_session(parser, docker, config, server_name)
+
+    write_lock = threading.Lock()
+
+    def emit(event: Dict[str, Any]):
+        with write_lock:
+            print(json.dumps(event, ensure_ascii=False), flush=True)
+
+    return emit_rpc_payload(execute_rpc(args, docker, config, server_name, emit))
+
+
 def main():
+    configure_logging()
     if len(sys.argv) > 1 and sys.argv[1] == 'rpc':
         return run_rpc(sys.argv[2:])
 
@@ -3301,6 +7319,8 @@ def main():
         logger.error("错误: 必须设置 BOT_TOKEN 和 CHAT_ID 环境变量")
         sys.exit(1)
 
+    ensure_data_dirs()
+
     print('=' * 50)
     print(f"Docker 容器监控通知服务 v{VERSION}")
     print(f"服务器: {SERVER_NAME}")
@@ -3313,7 +7333,11 @@ def main():
     health = HealthReporter(HEALTH_FILE, SERVER_NAME)
     health.beat('main', status='starting')
 
-    bot = TelegramBot(os.getenv('BOT_TOKEN'), CHAT_ID, SERVER_NAME)
+    outbox = NotificationOutbox(NOTIFICATION_OUTBOX_FILE)
+    bot = TelegramBot(os.getenv('BOT_TOKEN'), CHAT_ID, SERVER_NAME, outbox=outbox)
+    DockerManager.update_journal = UpdateJournal(UPDATE_JOURNAL_FILE)
+    DockerManager.step_timings = StepTimingStore(STEP_TIMINGS_FILE)
+    DockerManager.resource_sampler = CgroupResourceSampler(CGROUP_ROOT)
     docker = DockerManager()
     config = ConfigManager(MONITOR_CONFIG, SERVER_NAME)
     registry = ServerRegistry(SERVER_REGISTRY, SERVER_NAME, PRIMARY_SERVER)
@@ -3328,7 +7352,26 @@ def main():
         logger.info("从服务器等待 0.5 秒...")
         time.sleep(0.5)
 
+    if RPC_FORWARD:
+        try:
+            ControlSocketServer(RPC_CONTROL_SOCKET, docker, config, SERVER_NAME).start()
+        except OSError as e:
+            logger.error(f'控制 socket 启动失败，rpc 调用将在独立进程中执行: {e}')
+
+    if AGENT_LISTEN:
+        if AGENT_TOKEN:
+            try:
+                AgentServer(parse_listen_address(AGENT_LISTEN, AGENT_PORT), AGENT_TOKEN, docker, config, SERVER_NAME).start()
+            except (OSError, ValueError) as e:
+                logger.error(f'Agent 服务启动失败: {e}')
+        else:
+            logger.error('已设置 AGENT_LISTEN 但未设置 AGENT_TOKEN，Agent 服务未启动')
+
     handler = CommandHandler(bot, docker, config, registry)
+    handler.remote_controller.start_connection_keeper()
+    handler.remote_controller.start_health_prober()
+    if PRIMARY_SERVER and ENABLE_BOT_POLLING:
+        handler.remote_controller.start_inventory_refreshers()
 
     if PRIMARY_SERVER and ENABLE_BOT_POLLING:
         bot_poller = BotPoller(handler, bot, coordinator, health)
@@ -3342,7 +7385,7 @@ def main():
     remote_worker = RemoteCommandWorker(handler, handler.command_queue, SERVER_NAME, health)
     remote_worker.start()
 
-    heartbeat = HeartbeatThread(registry, health)
+    heartbeat = HeartbeatThread(registry, health, outbox)
     heartbeat.start()
 
     all_containers = docker.get_all_containers()
@@ -3385,6 +7428,7 @@ def main():
 🤖 <b>机器人功能</b>
    /status - 查看服务器状态
    /servers - 查看所有服务器概览
+   /top - 查看容器资源占用排行
    /update - 更新容器镜像
    /restart - 重启容器
    /monitor - 监控管理
@@ -3402,7 +7446,7 @@ def main():
 
 ✅ 服务正常运行中"""
 
-        bot.send_message(startup_msg)
+        bot.send_message(startup_msg, priority=TelegramBot.PRIORITY_INFO)
     else:
         logger.info("从服务器已启动，等待主服务器协调")
 
@@ -3427,6 +7471,7 @@ def main():
         logger.exception(f"监控异常: {e}")
     finally:
         shutdown_flag.set()
+        bot.close()
         health.beat('main', status='stopped', details={'exit_code': exit_code})
         logger.info("服务已停止")
 
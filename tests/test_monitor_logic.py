@@ -1,8 +1,13 @@
+import concurrent.futures
 import importlib.util
 import io
 import json
 import os
+import socket
+import subprocess
+import sys
 import tempfile
+import threading
 import time
 import unittest
 import uuid
@@ -33,6 +38,7 @@ def load_monitor_module(env=None):
     with mock.patch("pathlib.Path.mkdir", autospec=True):
         with mock.patch.dict(os.environ, patched_env, clear=False):
             spec.loader.exec_module(module)
+    module.ensure_data_dirs = lambda: None
     return module
 
 
@@ -78,8 +84,7 @@ class MonitorLogicTests(unittest.TestCase):
     def test_remote_queue_reclaims_stale_processing_job_and_marks_failure(self):
         module = load_monitor_module()
         with tempfile.TemporaryDirectory() as tempdir:
-            queue_path = Path(tempdir) / "queue.json"
-            queue = module.RemoteCommandQueue(queue_path)
+            queue = module.RemoteCommandQueue(Path(tempdir) / "queue.json")
             job_id = queue.enqueue("srv-a", "confirm_update", {"container": "demo"})
 
             claimed = queue.claim("srv-a")
@@ -87,18 +92,21 @@ class MonitorLogicTests(unittest.TestCase):
             self.assertEqual(claimed["id"], job_id)
             self.assertIsNone(queue.claim("srv-a"))
 
-            data = json.loads(queue_path.read_text(encoding="utf-8"))
-            data["jobs"][0]["claimed_at"] = time.time() - (module.REMOTE_JOB_PROCESSING_TIMEOUT + 5)
-            queue_path.write_text(json.dumps(data), encoding="utf-8")
+            index_path = Path(tempdir) / "queue" / "srv-a" / "index.json"
+            index = json.loads(index_path.read_text(encoding="utf-8"))
+            index["processing"][job_id]["claimed_at"] = time.time() - (module.REMOTE_JOB_PROCESSING_TIMEOUT + 5)
+            index_path.write_text(json.dumps(index), encoding="utf-8")
 
             reclaimed = queue.claim("srv-a")
             self.assertIsNotNone(reclaimed)
             self.assertEqual(reclaimed["id"], job_id)
+            self.assertEqual(reclaimed["attempts"], 2)
 
             queue.fail(job_id, "boom")
-            failed_data = json.loads(queue_path.read_text(encoding="utf-8"))
-            self.assertEqual(failed_data["jobs"][0]["status"], "failed")
-            self.assertEqual(failed_data["jobs"][0]["error"], "boom")
+            archived = queue.archived("srv-a")
+            self.assertEqual(archived[-1]["status"], "failed")
+            self.assertEqual(archived[-1]["error"], "boom")
+            self.assertEqual(queue.count_pending("srv-a"), 0)
 
     def test_remote_queue_enqueue_returns_none_when_write_fails(self):
         module = load_monitor_module()
@@ -108,58 +116,75 @@ class MonitorLogicTests(unittest.TestCase):
                 self.assertIsNone(
                     queue.enqueue("srv-a", "confirm_update", {"container": "demo"})
                 )
+            self.assertEqual(list((Path(tempdir) / "queue" / "srv-a" / "jobs").iterdir()), [])
 
     def test_remote_queue_claim_does_not_rewrite_empty_queue(self):
         module = load_monitor_module()
         with tempfile.TemporaryDirectory() as tempdir:
-            queue_path = Path(tempdir) / "queue.json"
-            queue_path.write_text(json.dumps({"jobs": []}), encoding="utf-8")
-            queue = module.RemoteCommandQueue(queue_path)
+            queue = module.RemoteCommandQueue(Path(tempdir) / "queue.json")
+            job_id = queue.enqueue("srv-a", "confirm_update", {"container": "demo"})
+            queue.complete(queue.claim("srv-a")["id"])
+            index_path = Path(tempdir) / "queue" / "srv-a" / "index.json"
 
-            before = queue_path.stat().st_mtime_ns
+            before = index_path.stat().st_mtime_ns
             time.sleep(0.01)
             claimed = queue.claim("srv-a")
-            after = queue_path.stat().st_mtime_ns
+            after = index_path.stat().st_mtime_ns
 
             self.assertIsNone(claimed)
             self.assertEqual(before, after)
-            self.assertEqual(
-                json.loads(queue_path.read_text(encoding="utf-8")),
-                {"jobs": []},
-            )
+            self.assertEqual(queue.archived("srv-a")[-1]["id"], job_id)
 
     def test_remote_queue_claim_does_not_rewrite_when_target_server_has_no_job(self):
         module = load_monitor_module()
         with tempfile.TemporaryDirectory() as tempdir:
-            queue_path = Path(tempdir) / "queue.json"
-            queue_path.write_text(
-                json.dumps(
-                    {
-                        "jobs": [
-                            {
-                                "id": "job-1",
-                                "target_server": "srv-b",
-                                "action": "confirm_update",
-                                "payload": {"container": "demo"},
-                                "status": "pending",
-                                "created_at": time.time(),
-                            }
-                        ]
-                    }
-                ),
-                encoding="utf-8",
-            )
-            queue = module.RemoteCommandQueue(queue_path)
+            queue = module.RemoteCommandQueue(Path(tempdir) / "queue.json")
+            queue.enqueue("srv-b", "confirm_update", {"container": "demo"})
+            index_path = Path(tempdir) / "queue" / "srv-b" / "index.json"
 
-            before = queue_path.stat().st_mtime_ns
-            original = queue_path.read_text(encoding="utf-8")
-            time.sleep(0.01)
+            original = index_path.read_text(encoding="utf-8")
             claimed = queue.claim("srv-a")
-            after = queue_path.stat().st_mtime_ns
 
             self.assertIsNone(claimed)
-            self.assertEqual(before, after)
-            self.assertEqual(queue_path.read_text(encoding="utf-8"), original)
+            self.assertFalse((Path(tempdir) / "queue" / "srv-a").exists())
+            self.assertEqual(index_path.read_text(encoding="utf-8"), original)
+            self.assertEqual(queue.count_pending(), 1)
+
+    def test_remote_queue_orders_by_priority_expires_jobs_and_bounds_archive(self):
+        module = load_monitor_module()
+        with tempfile.TemporaryDirectory() as tempdir:
+            legacy_path = Path(tempdir) / "queue.json"
+            legacy_path.write_text(json.dumps({"jobs": [{
+                "id": "legacy-1", "target_server": "srv-a", "action": "confirm_restart",
+                "payload": {"container": "old"}, "status": "pending", "created_at": time.time() - 5,
+            }]}), encoding="utf-8")
+            queue = module.RemoteCommandQueue(legacy_path)
+            self.assertFalse(legacy_path.exists())
+
+            scheduled_id = queue.enqueue("srv-a", "confirm_update", {"container": "nightly", "source": "scheduled"})
+            bulk_id = queue.enqueue("srv-a", "batch_update", {"containers": ["a", "b"], "source": "interactive"})
+            expired_id = queue.enqueue("srv-a", "confirm_update", {"container": "gone"}, ttl=1)
+            manual_id = queue.enqueue("srv-a", "confirm_update", {"container": "demo", "message_id": "9"})
+            index_path = Path(tempdir) / "queue" / "srv-a" / "index.json"
+            index = json.loads(index_path.read_text(encoding="utf-8"))
+            for entry in index["pending"]:
+                if entry[2] == expired_id:
+                    entry[3] = time.time() - 1
+            index_path.write_text(json.dumps(index), encoding="utf-8")
+
+            order = []
+            with mock.patch.object(module, "REMOTE_JOB_ARCHIVE_SIZE", 2):
+                while True:
+                    job = queue.claim("srv-a")
+                    if not job:
+                        break
+                    order.append(job["id"])
+                    queue.complete(job["id"])
+
+            self.assertEqual(order, [bulk_id, manual_id, "legacy-1", scheduled_id])
+            archived = queue.archived("srv-a")
+            self.assertEqual([job["id"] for job in archived], [expired_id, scheduled_id])
+            self.assertEqual(list((Path(tempdir) / "queue" / "srv-a" / "jobs").iterdir()), [])
 
     def test_parse_remote_servers_config_preserves_ssh_and_queue_modes(self):
         remote_servers = json.dumps(
@@ -179,13 +204,13 @@ class MonitorLogicTests(unittest.TestCase):
         )
         module = load_monitor_module({"REMOTE_SERVERS_JSON": remote_servers})
 
-        self.assertEqual(module.REMOTE_SERVER_CONFIGS["srv-ssh"]["transport"], "ssh")
-        self.assertEqual(module.REMOTE_SERVER_CONFIGS["srv-ssh"]["host"], "100.64.0.10")
+        self.assertEqual(module.remote_server_configs()["srv-ssh"]["transport"], "ssh")
+        self.assertEqual(module.remote_server_configs()["srv-ssh"]["host"], "100.64.0.10")
         self.assertEqual(
-            module.REMOTE_SERVER_CONFIGS["srv-ssh"]["monitor_container"],
+            module.remote_server_configs()["srv-ssh"]["monitor_container"],
             "watchtower-notifier-154",
         )
-        self.assertEqual(module.REMOTE_SERVER_CONFIGS["srv-queue"]["transport"], "queue")
+        self.assertEqual(module.remote_server_configs()["srv-queue"]["transport"], "queue")
 
     def test_remote_server_controller_fetches_inventory_via_ssh(self):
         remote_servers = json.dumps(
@@ -226,6 +251,579 @@ class MonitorLogicTests(unittest.TestCase):
         self.assertEqual(inventory["transport"], "ssh")
         self.assertEqual(inventory["monitored_containers"], ["demo"])
 
+    def test_remote_rpc_reuses_ssh_control_master(self):
+        remote_servers = json.dumps([{"name": "srv-ssh", "transport": "ssh", "host": "100.64.0.10"}])
+        with tempfile.TemporaryDirectory() as tempdir:
+            module = load_monitor_module({
+                "REMOTE_SERVERS_JSON": remote_servers,
+                "SSH_CONTROL_DIR": tempdir,
+                "REMOTE_RPC_SESSIONS": "false",
+            })
+            registry = mock.Mock()
+            registry.get_active_servers.return_value = []
+            controller = module.RemoteServerController("local", mock.Mock(), mock.Mock(), registry)
+            control_path = controller._control_path("srv-ssh")
+            commands = []
+
+            def fake_run(command, **kwargs):
+                commands.append(command)
+                if "-N" in command:
+                    control_path.touch()
+                    return mock.Mock(returncode=0)
+                if "-O" in command:
+                    return mock.Mock(returncode=0, stdout="", stderr="")
+                return mock.Mock(returncode=0, stdout='{"ok": true, "server_name": "srv-ssh"}', stderr="")
+
+            with mock.patch.object(module.subprocess, "run", side_effect=fake_run):
+                first = controller._run_remote_rpc("srv-ssh", "ping", timeout=10)
+                second = controller._run_remote_rpc("srv-ssh", "ping", timeout=10)
+
+        self.assertFalse(first["connection"]["reused"])
+        self.assertTrue(second["connection"]["reused"])
+        self.assertIsNotNone(second["connection"]["setup_ms"])
+        self.assertEqual(sum(1 for command in commands if "-N" in command), 1)
+        rpc_commands = [command for command in commands if command[-1].endswith("rpc ping")]
+        self.assertEqual(len(rpc_commands), 2)
+        for command in rpc_commands:
+            self.assertIn(f"ControlPath={control_path}", command)
+            self.assertIn("ControlMaster=no", command)
+        self.assertTrue(controller.get_connection_stats("srv-ssh")["connected"])
+
+    def test_available_servers_pings_ssh_servers_concurrently_and_caches(self):
+        remote_servers = json.dumps([
+            {"name": "fast", "transport": "ssh", "host": "100.64.0.1"},
+            {"name": "slow", "transport": "ssh", "host": "100.64.0.2"},
+            {"name": "down", "transport": "ssh", "host": "100.64.0.3"},
+        ])
+        module = load_monitor_module({"REMOTE_SERVERS_JSON": remote_servers, "REMOTE_PING_TIMEOUT": "2"})
+        registry = mock.Mock()
+        registry.get_active_servers.return_value = []
+        controller = module.RemoteServerController("local", mock.Mock(), mock.Mock(), registry)
+        calls = []
+
+        def fake_rpc(server, *args, timeout=None):
+            calls.append((server, args, timeout))
+            time.sleep({"fast": 0.6, "slow": 1.0}.get(server, 0))
+            if server == "down":
+                raise RuntimeError("SSH 远程命令超时")
+            return {"ok": True, "server_name": server}
+
+        with mock.patch.object(controller, "_run_remote_rpc", side_effect=fake_rpc):
+            started_at = time.time()
+            servers = controller.get_available_servers()
+            elapsed = time.time() - started_at
+            cached_servers = controller.get_available_servers()
+
+        self.assertEqual(servers, ["local", "fast", "slow"])
+        self.assertEqual(cached_servers, servers)
+        self.assertLess(elapsed, 1.5)
+        self.assertEqual(len(calls), 3)
+        self.assertTrue(all(args == ("ping",) and timeout == 2 for _, args, timeout in calls))
+
+    def test_ssh_discovery_pings_every_stale_server_at_once_with_setup_budget(self):
+        remote_servers = json.dumps([
+            {"name": f"srv-{index}", "transport": "ssh", "host": f"100.64.1.{index}", "connect_timeout": 5}
+            for index in range(12)
+        ])
+        module = load_monitor_module({"REMOTE_SERVERS_JSON": remote_servers, "REMOTE_PING_TIMEOUT": "2"})
+        registry = mock.Mock()
+        registry.get_active_servers.return_value = []
+        controller = module.RemoteServerController("local", mock.Mock(), mock.Mock(), registry)
+
+        def fake_rpc(server, *args, timeout=None):
+            time.sleep(0.5)
+            return {"ok": True}
+
+        with mock.patch.object(controller, "_run_remote_rpc", side_effect=fake_rpc):
+            started_at = time.time()
+            reachability = controller._discover_ssh_servers([f"srv-{index}" for index in range(12)])
+            elapsed = time.time() - started_at
+
+        self.assertTrue(all(reachability.values()))
+        self.assertLess(elapsed, 0.9)
+        self.assertEqual(controller._ping_budget("srv-0"), 2 + 5 + 10 + 2)
+        controller._connection_stats["srv-0"] = {"connected": True}
+        controller._legacy_session_servers.add("srv-0")
+        self.assertEqual(controller._ping_budget("srv-0"), 2)
+
+    def test_inventory_delta_protocol_merges_changes_into_cached_copy(self):
+        remote_servers = json.dumps([{"name": "srv-ssh", "transport": "ssh", "host": "100.64.0.10"}])
+        with tempfile.TemporaryDirectory() as tempdir:
+            module = load_monitor_module({
+                "REMOTE_SERVERS_JSON": remote_servers,
+                "DATA_DIR": tempdir,
+                "REMOTE_INVENTORY_COMPRESS": "true",
+            })
+
+            def inventory(containers):
+                return {
+                    "ok": True, "server_name": "srv-ssh", "transport": "local", "mode": "independent",
+                    "collected_at": time.time(), "total_containers": len(containers),
+                    "monitored_containers": sorted(containers), "excluded_containers": [],
+                    "static_monitored_containers": [], "containers": containers,
+                }
+
+            snapshots = iter([
+                inventory({
+                    "app": {"image": "app:1", "running": True, "last_checked_at": 1.0},
+                    "db": {"image": "db:1", "running": True, "last_checked_at": 1.0},
+                }),
+                inventory({
+                    "app": {"image": "app:2", "running": True, "last_checked_at": 2.0},
+                    "cache": {"image": "redis:7", "running": True, "last_checked_at": 2.0},
+                }),
+            ])
+            parser = module.build_rpc_parser()
+            calls = []
+
+            def fake_rpc(server, *rpc_args, timeout=None):
+                calls.append(list(rpc_args))
+                return module.execute_rpc(parser.parse_args(list(rpc_args)), mock.Mock(), mock.Mock(), server)
+
+            registry = mock.Mock()
+            registry.get_active_servers.return_value = []
+            controller = module.RemoteServerController("local", mock.Mock(), mock.Mock(), registry)
+            with mock.patch.object(module, "build_inventory_payload", side_effect=lambda *args: next(snapshots)), \
+                 mock.patch.object(controller, "_run_remote_rpc", side_effect=fake_rpc), \
+                 mock.patch.object(module, "merge_inventory_delta", wraps=module.merge_inventory_delta) as merge_mock:
+                first = controller.get_inventory("srv-ssh", force_refresh=True)
+                second = controller.get_inventory("srv-ssh", force_refresh=True)
+
+        self.assertEqual(calls[0], ["inventory", "--compress"])
+        self.assertEqual(calls[1], ["inventory", "--since", first["revision"], "--compress"])
+        merge_mock.assert_called_once()
+        self.assertEqual(sorted(merge_mock.call_args[0][1]["containers"]), ["app", "cache"])
+        self.assertEqual(sorted(second["containers"]), ["app", "cache"])
+        self.assertEqual(second["containers"]["app"]["image"], "app:2")
+        self.assertNotIn("delta", second)
+        self.assertNotEqual(second["revision"], first["revision"])
+
+        delta = module.build_inventory_delta(
+            {"containers": {"app": {"image": "app:2"}}}, "rev", {"app": "x", "db": "y"}, {"app": "z"}
+        )
+        self.assertEqual(delta["removed_containers"], ["db"])
+
+    def test_unreachable_server_is_quarantined_with_backoff_and_recovers(self):
+        remote_servers = json.dumps([{"name": "srv-ssh", "transport": "ssh", "host": "100.64.0.10"}])
+        module = load_monitor_module({"REMOTE_SERVERS_JSON": remote_servers})
+        registry = mock.Mock()
+        registry.get_active_servers.return_value = []
+        controller = module.RemoteServerController("local", mock.Mock(), mock.Mock(), registry)
+        clock = [1000.0]
+        outcomes = [
+            module.RemoteUnreachableError("SSH 连接失败: timed out"),
+            module.RemoteUnreachableError("SSH 连接失败: timed out"),
+            module.RemoteUnreachableError("SSH 连接失败: timed out"),
+            {"ok": True},
+        ]
+
+        def invoke(*args):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            clock[0] += 0.05
+            return outcome
+
+        with mock.patch.object(module.time, "time", side_effect=lambda: clock[0]), \
+             mock.patch.object(controller, "_invoke_remote_rpc", side_effect=invoke) as invoke_mock:
+            for _ in range(2):
+                with self.assertRaises(module.RemoteUnreachableError):
+                    controller._run_remote_rpc("srv-ssh", "ping")
+            with self.assertRaisesRegex(module.RemoteUnreachableError, "起不可达"):
+                controller._run_remote_rpc("srv-ssh", "ping")
+            self.assertEqual(invoke_mock.call_count, 2)
+
+            clock[0] += 16
+            self.assertEqual(controller.health.due_for_probe(), ["srv-ssh"])
+            with self.assertRaises(module.RemoteUnreachableError):
+                controller._run_remote_rpc("srv-ssh", "ping")
+            clock[0] += 16
+            with self.assertRaisesRegex(module.RemoteUnreachableError, "起不可达"):
+                controller._run_remote_rpc("srv-ssh", "ping")
+
+            clock[0] += 15
+            controller._run_remote_rpc("srv-ssh", "ping")
+
+        health = controller.health.snapshot("srv-ssh")
+        self.assertFalse(health["quarantined"])
+        self.assertEqual(health["rtt_ms"], [50.0])
+        self.assertAlmostEqual(health["success_rate"], 0.25)
+
+    def test_remote_worker_wakes_on_enqueue_marker_without_polling(self):
+        module = load_monitor_module()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = module.RemoteCommandQueue(Path(tmpdir) / "command_queue.json")
+            marker = queue.wakeup_marker("srv-b")
+            watcher = module.FileChangeWatcher(marker.parent, {marker.name})
+            try:
+                self.assertTrue(watcher.available)
+                (marker.parent / "unrelated.json").write_text("{}")
+                self.assertFalse(watcher.wait(0.2))
+
+                threading.Timer(0.2, queue.enqueue, args=("srv-b", "confirm_restart", {})).start()
+                started_at = time.time()
+                self.assertTrue(watcher.wait(5))
+                self.assertLess(time.time() - started_at, 1)
+                self.assertEqual(queue.claim("srv-b")["action"], "confirm_restart")
+            finally:
+                watcher.close()
+
+            with mock.patch("ctypes.CDLL", side_effect=OSError("no inotify")):
+                fallback = module.FileChangeWatcher(Path(tmpdir), {"command_queue.json"})
+            self.assertFalse(fallback.available)
+            started_at = time.time()
+            self.assertFalse(fallback.wait(0.2))
+            self.assertGreaterEqual(time.time() - started_at, 0.19)
+
+    def test_remote_worker_runs_jobs_concurrently_but_serializes_per_container(self):
+        module = load_monitor_module()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = module.RemoteCommandQueue(Path(tmpdir) / "command_queue.json")
+            first = queue.enqueue("srv-a", "confirm_update", {"container": "x"})
+            second = queue.enqueue("srv-a", "confirm_restart", {"container": "x"})
+            other = queue.enqueue("srv-a", "confirm_restart", {"container": "y"})
+
+            events = []
+            done = threading.Event()
+
+            def process(job):
+                events.append(("start", job["id"], time.time()))
+                time.sleep(0.4 if job["id"] == first else 0.05)
+                events.append(("end", job["id"], time.time()))
+                if len(events) == 6:
+                    done.set()
+
+            handler = mock.Mock()
+            handler.process_remote_job.side_effect = process
+            health = mock.Mock()
+            worker = module.RemoteCommandWorker(handler, queue, "srv-a", health, concurrency=2)
+            with mock.patch.object(module, "LOCK_DIR", Path(tmpdir)):
+                worker.start()
+                self.assertTrue(done.wait(5))
+                deadline = time.time() + 5
+                while queue.count_pending("srv-a") and time.time() < deadline:
+                    time.sleep(0.05)
+                module.shutdown_flag.set()
+                worker.join(5)
+            self.assertEqual(queue.count_pending("srv-a"), 0)
+            self.assertEqual(len(queue.archived("srv-a")), 3)
+
+        times = {(kind, job_id): at for kind, job_id, at in events}
+        self.assertLess(times[("start", other)], times[("end", first)])
+        self.assertGreaterEqual(times[("start", second)], times[("end", first)])
+        occupancy = [call.kwargs["details"] for call in health.beat.call_args_list]
+        self.assertTrue(all(details["capacity"] == 2 for details in occupancy))
+
+    def test_duplicate_queued_jobs_coalesce_and_every_message_gets_result(self):
+        module = load_monitor_module()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = module.RemoteCommandQueue(Path(tmpdir) / "command_queue.json")
+
+            def submit(container, message_id):
+                return queue.enqueue("srv-a", "confirm_restart", {
+                    "server": "srv-a", "container": container, "chat_id": "1", "message_id": message_id,
+                })
+
+            job_id = submit("demo", "10")
+            self.assertEqual(submit("demo", "11"), job_id)
+            self.assertNotEqual(submit("other", "12"), job_id)
+            self.assertEqual(queue.count_pending("srv-a"), 2)
+
+            job = queue.claim("srv-a")
+            self.assertEqual(job["id"], job_id)
+            self.assertEqual(submit("demo", "13"), job_id)
+
+            bot = mock.Mock()
+            bot.server_name = "srv-a"
+            registry = mock.Mock()
+            registry.registry_file = Path("/tmp/server_registry.json")
+            docker = mock.Mock()
+            docker.restart_container.return_value = True
+            handler = module.CommandHandler(bot, docker, mock.Mock(), registry)
+            handler.command_queue = queue
+            handler.process_remote_job(job)
+            queue.complete(job_id)
+
+            final_edits = {call.args[1]: call.args[2] for call in bot.edit_message.call_args_list}
+            self.assertEqual(set(final_edits), {"10", "11", "13"})
+            self.assertEqual(len({text for text in final_edits.values()}), 1)
+            docker.restart_container.assert_called_once_with("demo")
+            self.assertNotEqual(submit("demo", "14"), job_id)
+
+    def test_late_subscriber_receives_final_text_and_batches_coalesce(self):
+        module = load_monitor_module()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = module.RemoteCommandQueue(Path(tmpdir) / "command_queue.json")
+
+            def submit(action, message_id, **fields):
+                return queue.enqueue("srv-a", action, {
+                    "server": "srv-a", "chat_id": "1", "message_id": message_id, "progress_channel": True, **fields,
+                })
+
+            job_id = submit("confirm_restart", "10", container="demo")
+            job = queue.claim("srv-a")
+            self.assertEqual(job["id"], job_id)
+            queue.publish_progress("srv-a", job_id, "✅ 重启成功", [("1", "10")])
+            self.assertEqual(submit("confirm_restart", "11", container="demo"), job_id)
+            queue.complete(job_id)
+
+            record = queue.read_progress("srv-a", job_id)
+            self.assertEqual(record["status"], "done")
+            self.assertEqual(record["targets"], [["1", "10"], ["1", "11"]])
+
+            bot = mock.Mock()
+            registry = mock.Mock()
+            registry.registry_file = Path("/tmp/server_registry.json")
+            handler = module.CommandHandler(bot, mock.Mock(), mock.Mock(), registry)
+            handler.command_queue = queue
+            handler._follow_job_progress("srv-a", job_id, "1", "10")
+            edited = {call.args[1]: call.args[2] for call in bot.edit_message.call_args_list}
+            self.assertEqual(edited, {"10": "✅ 重启成功", "11": "✅ 重启成功"})
+
+            batch_id = submit("batch_restart", "20", containers=["web", "db"])
+            self.assertEqual(submit("batch_restart", "21", containers=["db", "web"]), batch_id)
+            self.assertNotEqual(submit("batch_restart", "22", containers=["db"]), batch_id)
+
+    def test_queue_job_progress_is_relayed_by_primary_from_progress_record(self):
+        module = load_monitor_module()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = module.RemoteCommandQueue(Path(tmpdir) / "command_queue.json")
+            registry = mock.Mock()
+            registry.registry_file = Path("/tmp/server_registry.json")
+
+            def make_handler(name, docker=None):
+                bot = mock.Mock()
+                bot.server_name = name
+                handler = module.CommandHandler(bot, docker or mock.Mock(), mock.Mock(), registry)
+                handler.command_queue = queue
+                return handler
+
+            primary = make_handler("srv-main")
+            docker = mock.Mock()
+
+            def fake_update(container, progress_callback=None):
+                time.sleep(0.3)
+                return {"success": True, "old_version": "v1", "new_version": "v2", "message": "ok"}
+
+            docker.update_container.side_effect = fake_update
+            target = make_handler("srv-b", docker)
+
+            with mock.patch.object(module, "REMOTE_PROGRESS_EDIT_INTERVAL", 0.1):
+                primary._enqueue_remote_action("confirm_update", "srv-b", "demo", "1", "10")
+                job = queue.claim("srv-b")
+                target.process_remote_job(job)
+                queue.complete(job["id"])
+
+                deadline = time.time() + 5
+                while primary._progress_followers and time.time() < deadline:
+                    time.sleep(0.05)
+
+            target.bot.edit_message.assert_not_called()
+            texts = [call.args[2] for call in primary.bot.edit_message.call_args_list]
+            self.assertIn("已提交远程更新任务", texts[0])
+            self.assertTrue(any("准备更新" in text for text in texts))
+            self.assertIn("v2", texts[-1])
+            self.assertNotIn("准备更新", texts[-1])
+            self.assertFalse(queue.progress_file("srv-b", job["id"]).exists())
+
+    def test_remote_queue_renewed_claims_are_not_reclaimed(self):
+        module = load_monitor_module()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = module.RemoteCommandQueue(Path(tmpdir) / "command_queue.json")
+            job_id = queue.enqueue("srv-a", "confirm_update", {"container": "x"})
+            queue.claim("srv-a")
+            index_path = Path(tmpdir) / "command_queue" / "srv-a" / "index.json"
+            index = json.loads(index_path.read_text(encoding="utf-8"))
+            index["processing"][job_id]["claimed_at"] = time.time() - (module.REMOTE_JOB_PROCESSING_TIMEOUT + 5)
+            index_path.write_text(json.dumps(index), encoding="utf-8")
+
+            queue.renew("srv-a", [job_id])
+            self.assertIsNone(queue.claim("srv-a"))
+
+    def test_stale_claim_without_live_job_file_is_dropped_not_reclaimed(self):
+        module = load_monitor_module()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = module.RemoteCommandQueue(Path(tmpdir) / "command_queue.json")
+            index_path = Path(tmpdir) / "command_queue" / "srv-a" / "index.json"
+
+            def expire_claims():
+                index = json.loads(index_path.read_text(encoding="utf-8"))
+                for entry in index["processing"].values():
+                    entry["claimed_at"] = time.time() - (module.REMOTE_JOB_PROCESSING_TIMEOUT + 5)
+                index_path.write_text(json.dumps(index), encoding="utf-8")
+
+            lost_id = queue.enqueue("srv-a", "confirm_update", {"container": "lost"})
+            queue.claim("srv-a")
+            queue._job_file("srv-a", lost_id).unlink()
+
+            done_id = queue.enqueue("srv-a", "confirm_update", {"container": "done"})
+            queue.claim("srv-a")
+            original_update = module.safe_update_json
+
+            def lock_timeout_on_index(path, updater, default=None):
+                return None if path == index_path else original_update(path, updater, default=default)
+
+            with mock.patch.object(module, "safe_update_json", side_effect=lock_timeout_on_index):
+                queue.complete(done_id)
+            self.assertEqual(queue._peek(queue._job_file("srv-a", done_id))["status"], "done")
+
+            expire_claims()
+            self.assertIsNone(queue.claim("srv-a"))
+            index = json.loads(index_path.read_text(encoding="utf-8"))
+            self.assertEqual(index["processing"], {})
+            self.assertFalse(queue._job_file("srv-a", done_id).exists())
+
+    def test_unlimited_outbox_retries_do_not_block_bounded_replies_in_same_chat(self):
+        module = load_monitor_module()
+        delivered = []
+
+        def deliver(job):
+            text = job["payload"]["text"]
+            if text == "outbox":
+                return {"ok": False, "data": {}}
+            delivered.append(text)
+            return {"ok": True, "data": {}}
+
+        dispatcher = module.TelegramDispatcher(deliver)
+        try:
+            stuck = dispatcher.submit("sendMessage", {"text": "outbox"}, "1", 0, max_retries=None)
+            reply = dispatcher.submit("sendMessage", {"text": "reply"}, "1", 1)
+            self.assertTrue(reply.result(timeout=2)["ok"])
+            self.assertEqual(delivered, ["reply"])
+            self.assertFalse(stuck.done())
+        finally:
+            dispatcher.close(timeout=0.1)
+
+        bot = module.TelegramBot.__new__(module.TelegramBot)
+        bot._edits = {}
+        bot._edit_lock = threading.Lock()
+        bot.RESULT_TIMEOUT = 0.1
+        bot.chat_id = "1"
+        bot.dispatcher = mock.Mock()
+        bot.dispatcher.submit.return_value = concurrent.futures.Future()
+        self.assertFalse(bot.edit_message("1", "10", "done", final=True))
+        self.assertIsNone(bot.send_message_get_id("hello"))
+
+    def test_telegram_dispatcher_reschedules_rate_limited_chat_without_blocking_others(self):
+        module = load_monitor_module()
+        gate = threading.Event()
+        entered = threading.Event()
+        delivered = []
+
+        def deliver(job):
+            text = job["payload"]["text"]
+            if not delivered:
+                entered.set()
+                gate.wait(5)
+                delivered.append(text)
+                return {"ok": False, "data": {}, "retry_after": 1}
+            delivered.append(text)
+            return {"ok": True, "data": {"result": {"message_id": len(delivered)}}}
+
+        dispatcher = module.TelegramDispatcher(deliver)
+        try:
+            first = dispatcher.submit("sendMessage", {"text": "info-a"}, "1", module.TelegramBot.PRIORITY_INFO)
+            self.assertTrue(entered.wait(2))
+            started_at = time.time()
+            dispatcher.submit("sendMessage", {"text": "info-b"}, "1", module.TelegramBot.PRIORITY_INFO)
+            dispatcher.submit("sendMessage", {"text": "failure"}, "1", module.TelegramBot.PRIORITY_CRITICAL)
+            other = dispatcher.submit("sendMessage", {"text": "other-chat"}, "2", module.TelegramBot.PRIORITY_INFO)
+            self.assertLess(time.time() - started_at, 0.1)
+
+            gate.set()
+            other.result(timeout=0.5)
+            self.assertTrue(first.result(timeout=5)["ok"])
+            for _ in range(50):
+                if len(delivered) == 5:
+                    break
+                time.sleep(0.05)
+        finally:
+            dispatcher.close(timeout=5)
+
+        self.assertEqual(delivered, ["info-a", "other-chat", "failure", "info-a", "info-b"])
+
+        bot = module.TelegramBot("token", "1", "srv")
+        try:
+            response = mock.Mock(status_code=200)
+            response.json.return_value = {"ok": True, "result": {"message_id": 42}}
+            bot.session = mock.Mock()
+            bot.session.post.return_value = response
+            self.assertEqual(bot.send_message_async("hi").result(timeout=2), "42")
+        finally:
+            bot.close(timeout=2)
+
+    def test_edit_message_coalesces_to_latest_text_and_flushes_final_edit(self):
+        module = load_monitor_module()
+        posted = []
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"ok": True, "result": {}}
+        gate = threading.Event()
+
+        def post(url, json, timeout):
+            gate.wait(2)
+            posted.append(json["text"])
+            return response
+
+        session = mock.Mock()
+        session.post.side_effect = post
+        with mock.patch("requests.Session", return_value=session):
+            bot = module.TelegramBot("token", "1", "srv")
+        try:
+            self.assertTrue(bot.edit_message("1", "10", "a"))
+            self.assertTrue(bot.edit_message("1", "10", "b"))
+            self.assertTrue(bot.edit_message("1", "10", "c"))
+            self.assertEqual(posted, [])
+            gate.set()
+            time.sleep(0.1)
+            self.assertEqual(posted, ["a"])
+            time.sleep(bot.EDIT_INTERVAL + 0.3)
+            self.assertEqual(posted, ["a", "c"])
+
+            self.assertTrue(bot.edit_message("1", "10", "c"))
+            time.sleep(bot.EDIT_INTERVAL + 0.1)
+            self.assertTrue(bot.edit_message("1", "10", "d"))
+            bot.edit_message("1", "10", "stale")
+            self.assertTrue(bot.edit_message("1", "10", "e", final=True))
+            self.assertEqual(posted, ["a", "c", "d", "e"])
+            time.sleep(bot.EDIT_INTERVAL + 0.3)
+            self.assertEqual(posted, ["a", "c", "d", "e"])
+        finally:
+            bot.close(timeout=2)
+
+    def test_notification_outbox_replays_pending_after_restart_and_dedups(self):
+        module = load_monitor_module()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            outbox_file = Path(tmpdir) / "outbox.jsonl"
+            outbox = module.NotificationOutbox(outbox_file)
+            info = outbox.add("info", module.TelegramBot.PRIORITY_INFO, key="update_available:demo:v2")
+            self.assertIsNone(outbox.add("info again", module.TelegramBot.PRIORITY_INFO, key="update_available:demo:v2"))
+            failure = outbox.add("failure", module.TelegramBot.PRIORITY_CRITICAL)
+
+            restarted = module.NotificationOutbox(outbox_file)
+            self.assertEqual([entry["id"] for entry in restarted.pending()], [failure["id"], info["id"]])
+            self.assertEqual(restarted.stats()["pending"], 2)
+            self.assertGreaterEqual(restarted.stats()["oldest_age"], 0)
+
+            posted = []
+            response = mock.Mock(status_code=200)
+            response.json.return_value = {"ok": True, "result": {"message_id": 1}}
+            session = mock.Mock()
+            session.post.side_effect = lambda url, json, timeout: posted.append(json["text"]) or response
+            with mock.patch("requests.Session", return_value=session):
+                bot = module.TelegramBot("token", "1", "srv", outbox=restarted)
+            try:
+                for _ in range(50):
+                    if restarted.stats()["pending"] == 0:
+                        break
+                    time.sleep(0.05)
+            finally:
+                bot.close(timeout=2)
+
+            self.assertEqual(posted, ["failure", "info"])
+            reloaded = module.NotificationOutbox(outbox_file)
+            self.assertEqual(reloaded.pending(), [])
+            self.assertIsNone(reloaded.add("info", module.TelegramBot.PRIORITY_INFO, key="update_available:demo:v2"))
+
     def test_enqueue_remote_action_uses_ssh_when_configured(self):
         remote_servers = json.dumps(
             [
@@ -266,6 +864,77 @@ class MonitorLogicTests(unittest.TestCase):
             "demo",
         )
 
+    def test_stale_inventory_is_served_immediately_and_view_edited_after_refresh(self):
+        remote_servers = json.dumps([{"name": "srv-ssh", "transport": "ssh", "host": "100.64.0.10"}])
+        module = load_monitor_module({"REMOTE_SERVERS_JSON": remote_servers})
+        bot = mock.Mock()
+        bot.server_name = "local"
+        bot.send_message_get_id.return_value = "42"
+        registry = mock.Mock()
+        registry.get_active_servers.return_value = []
+        registry.registry_file = Path("/tmp/server_registry.json")
+        handler = module.CommandHandler(bot, mock.Mock(), mock.Mock(), registry)
+        controller = handler.remote_controller
+        controller._inventory_cache["srv-ssh"] = {
+            "cached_at": time.time() - 120,
+            "payload": {"transport": "ssh", "monitored_containers": ["old"], "containers": {}},
+        }
+        release = threading.Event()
+        refreshed = threading.Event()
+
+        def slow_fetch(server):
+            release.wait(5)
+            return {"transport": "ssh", "monitored_containers": ["new"], "containers": {}}
+
+        bot.edit_message.side_effect = lambda *args, **kwargs: refreshed.set() or True
+        with mock.patch.object(controller, "_fetch_inventory_via_ssh", side_effect=slow_fetch):
+            started_at = time.time()
+            handler._show_update_containers("1", "srv-ssh")
+            elapsed = time.time() - started_at
+            release.set()
+            self.assertTrue(refreshed.wait(5))
+
+        self.assertLess(elapsed, 1)
+        sent_text, sent_buttons = bot.send_message_get_id.call_args[0]
+        self.assertEqual(sent_buttons["inline_keyboard"][0][0]["text"], "⬜ old")
+        chat_id, message_id, _, buttons = bot.edit_message.call_args[0]
+        self.assertEqual((chat_id, message_id), ("1", "42"))
+        self.assertEqual(buttons["inline_keyboard"][0][0]["text"], "⬜ new")
+        self.assertEqual(controller._inventory_cache["srv-ssh"]["payload"]["monitored_containers"], ["new"])
+
+    def test_selection_and_server_views_do_not_block_on_stale_inventory(self):
+        remote_servers = json.dumps([{"name": "srv-ssh", "transport": "ssh", "host": "100.64.0.10"}])
+        module = load_monitor_module({"REMOTE_SERVERS_JSON": remote_servers})
+        self.assertLess(module.REMOTE_REFRESH_INTERVAL, module.REMOTE_CACHE_TTL)
+        bot = mock.Mock()
+        bot.server_name = "local"
+        registry = mock.Mock()
+        registry.registry_file = Path("/tmp/server_registry.json")
+        handler = module.CommandHandler(bot, mock.Mock(), mock.Mock(), registry)
+        controller = handler.remote_controller
+        controller._inventory_cache["srv-ssh"] = {
+            "cached_at": time.time() - 120,
+            "payload": {"transport": "ssh", "monitored_containers": ["old"], "containers": {"old": {}}},
+        }
+        release = threading.Event()
+
+        def slow_fetch(server):
+            release.wait(5)
+            return {"transport": "ssh", "monitored_containers": ["new"], "containers": {"new": {}}}
+
+        with mock.patch.object(controller, "_fetch_inventory_via_ssh", side_effect=slow_fetch), \
+             mock.patch.object(handler, "_get_available_servers", return_value=["srv-ssh"]), \
+             mock.patch.object(module, "safe_read_json", return_value={}):
+            started_at = time.time()
+            candidates = handler._selection_candidates("update", "srv-ssh")
+            handler._render_selection("restart", "srv-ssh", set())
+            handler.handle_servers("1")
+            elapsed = time.time() - started_at
+            release.set()
+
+        self.assertLess(elapsed, 1)
+        self.assertEqual(candidates, ["old"])
+
     def test_notify_only_mode_cleans_up_pulled_image(self):
         module = load_monitor_module()
 
@@ -298,6 +967,71 @@ class MonitorLogicTests(unittest.TestCase):
 
         cleanup_mock.assert_called_once_with("sha256:new", keep_image_ids={"sha256:old"})
 
+    def test_deferred_update_reuses_resolved_target_without_repulling(self):
+        module = load_monitor_module()
+        bot = mock.Mock()
+        bot.server_name = "srv-a"
+        docker = mock.Mock()
+        docker.get_container_info.return_value = {"image": "demo:latest", "image_id": "sha256:old", "running": True}
+        docker._format_version_info.return_value = "latest (old)"
+        docker.pull_image.return_value = {"success": True, "image_id": "sha256:new"}
+        docker._has_target_image.side_effect = lambda image, image_id: image_id == "sha256:new"
+        docker.update_container.return_value = {"success": True, "message": "更新成功"}
+        monitor = module.WatchtowerMonitor(bot, docker, mock.Mock(), mock.Mock())
+        monitor.state_store = mock.Mock()
+        monitor.state_store.get_container_state.return_value = {}
+
+        with mock.patch.object(module, "AUTO_UPDATE", True), \
+             mock.patch.object(module, "UPDATE_DEFER_WINDOW", 60), \
+             mock.patch.object(monitor, "_schedule_deferred_update") as schedule_mock, \
+             mock.patch.object(monitor, "_send_update_notification"):
+            monitor._check_container_update("demo")
+            schedule_mock.assert_called_once_with("demo", {"image": "demo:latest", "image_id": "sha256:new"})
+            docker.update_container.assert_not_called()
+
+            docker.pull_image.reset_mock()
+            monitor._check_container_update("demo", schedule={"reason": "quiet"}, target=schedule_mock.call_args[0][1])
+
+        docker.pull_image.assert_not_called()
+        docker.update_container.assert_called_once_with("demo", target_image_id="sha256:new")
+
+    def test_independent_cycle_aggregates_notifications_into_split_digests(self):
+        module = load_monitor_module()
+        bot = mock.Mock()
+        bot.server_name = "srv-a"
+        docker = mock.Mock()
+        containers = [f"service-{index:02d}-{'x' * 40}" for index in range(60)]
+        docker.get_all_containers.return_value = containers
+        config = mock.Mock()
+        config.is_monitored.return_value = True
+        monitor = module.WatchtowerMonitor(bot, docker, config, mock.Mock())
+        monitor.state_store = mock.Mock()
+
+        def check(container):
+            if container == containers[0]:
+                monitor._send_update_failure_notification(container, "demo:latest", "v1", "v2", "pull denied")
+                self.assertEqual(bot.notify.call_count, 1 if module.NOTIFY_DIGEST_CRITICAL_IMMEDIATE else 0)
+            else:
+                monitor._send_update_available_notification(container, "demo:latest", "v1 (aaaa)", "v2 (bbbb)")
+
+        with mock.patch.object(monitor, "_check_container_update", side_effect=check):
+            monitor._run_independent_check_cycle()
+            sent = [(call.args[0], call.kwargs["priority"]) for call in bot.notify.call_args_list]
+
+            self.assertIn("自动更新失败", sent[0][0])
+            self.assertIn("pull denied", sent[0][0])
+            self.assertEqual(sent[0][1], module.TelegramBot.PRIORITY_CRITICAL)
+            digests = [text for text, _ in sent[1:]]
+            self.assertGreater(len(digests), 1)
+            self.assertTrue(all(len(text) <= module.TELEGRAM_MESSAGE_LIMIT for text in digests))
+            self.assertIn(f"发现可用更新 (59)</b> (1/{len(digests)})", digests[0])
+            self.assertEqual(sum(text.count("📦") for text in digests), 59)
+
+            bot.notify.reset_mock()
+            with mock.patch.object(module, "NOTIFY_DIGEST_CRITICAL_IMMEDIATE", True):
+                monitor._run_independent_check_cycle()
+            self.assertIn("自动更新失败", bot.notify.call_args_list[0].args[0])
+
     def test_compose_update_path_uses_docker_compose(self):
         module = load_monitor_module()
         compose_metadata = {
@@ -412,6 +1146,818 @@ class MonitorLogicTests(unittest.TestCase):
         self.assertTrue(any(command[:2] == ["docker", "run"] for command in calls))
         self.assertFalse(any(command[:2] == ["docker", "compose"] for command in calls))
 
+    def test_update_journal_records_recreate_steps(self):
+        module = load_monitor_module()
+        container_config = {
+            "Config": {"Image": "demo:latest", "Labels": {}},
+            "HostConfig": {"NetworkMode": "bridge"},
+            "Mounts": [],
+        }
+
+        def fake_run(command, timeout=30):
+            return mock.Mock(returncode=0, stdout="", stderr="")
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            journal = module.UpdateJournal(Path(tempdir) / "journal.json")
+            module.DockerManager.update_journal = journal
+            with mock.patch.object(module.DockerManager, "get_container_info", side_effect=[
+                {"image": "demo:latest", "image_id": "sha256:old", "running": True, "health": None},
+                {"image": "demo:latest", "image_id": "sha256:new", "running": True, "health": None},
+            ]):
+                with mock.patch.object(module.DockerManager, "get_container_inspect", return_value=container_config):
+                    with mock.patch.object(module.DockerManager, "_run", side_effect=fake_run):
+                        with mock.patch.object(module.DockerManager, "pull_image", return_value={
+                            "success": True,
+                            "image_id": "sha256:new",
+                        }):
+                            with mock.patch.object(module.DockerManager, "wait_container_ready", return_value=True):
+                                with mock.patch.object(module.DockerManager, "_format_version_info", return_value="latest"):
+                                    result = module.DockerManager._update_container_internal("web", None)
+
+            data = json.loads((Path(tempdir) / "journal.json").read_text(encoding="utf-8"))
+
+        self.assertTrue(result["success"])
+        record = next(iter(data["operations"].values()))
+        self.assertEqual(record["state"], "healthy")
+        self.assertEqual(
+            [step["state"] for step in record["history"]],
+            ["planned", "backup_tagged", "pulled", "stopped", "removed", "started", "healthy"],
+        )
+        self.assertEqual(record["new_image_id"], "sha256:new")
+
+    def test_update_journal_keeps_env_out_of_journal_and_clears_config_when_finished(self):
+        module = load_monitor_module()
+        snapshot = module.DockerManager.run_config_snapshot({
+            "Config": {"Image": "demo:latest", "Env": ["API_TOKEN=secret"], "Labels": {}},
+            "HostConfig": {"NetworkMode": "bridge", "Binds": ["/etc:/host"]},
+            "Mounts": [{"Source": "/data", "Destination": "/data", "RW": True, "Propagation": "rprivate"}],
+            "NetworkSettings": {"Networks": {}},
+        })
+        self.assertNotIn("NetworkSettings", snapshot)
+        self.assertNotIn("Binds", snapshot["HostConfig"])
+        self.assertEqual(snapshot["Mounts"], [{"Source": "/data", "Destination": "/data", "RW": True}])
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            journal_file = Path(tempdir) / "journal.json"
+            journal = module.UpdateJournal(journal_file)
+            op_id = journal.begin("web", "recreate", {"image": "demo:latest", "container_config": snapshot})
+
+            self.assertNotIn("secret", journal_file.read_text(encoding="utf-8"))
+            env_file = journal._env_file(op_id)
+            self.assertEqual(env_file.stat().st_mode & 0o777, 0o600)
+            restored = journal.get_incomplete()[0]["container_config"]
+            self.assertEqual(restored["Config"]["Env"], ["API_TOKEN=secret"])
+            self.assertEqual(
+                module.DockerManager.build_run_command("web", restored, "demo:latest").count("API_TOKEN=secret"), 1
+            )
+
+            journal.advance(op_id, "healthy")
+            self.assertNotIn("container_config", journal.get_operation(op_id))
+            self.assertFalse(env_file.exists())
+
+    def test_recover_interrupted_update_recreates_removed_container(self):
+        module = load_monitor_module()
+        container_config = {
+            "Config": {"Image": "demo:latest", "Labels": {}},
+            "HostConfig": {"NetworkMode": "bridge"},
+            "Mounts": [],
+        }
+        calls = []
+
+        def fake_run(command, timeout=30):
+            calls.append(command)
+            return mock.Mock(returncode=0, stdout="", stderr="")
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            journal = module.UpdateJournal(Path(tempdir) / "journal.json")
+            op_id = journal.begin("web", "recreate", {
+                "image": "demo:latest",
+                "old_image_id": "sha256:old",
+                "container_config": container_config,
+            })
+            journal.advance(op_id, "backup_tagged", backup_tag="watchtower-rollback/web:1")
+            journal.advance(op_id, "pulled", new_image_id="sha256:new")
+            journal.advance(op_id, "stopped")
+            journal.advance(op_id, "removed")
+            module.DockerManager.update_journal = journal
+
+            with mock.patch.object(module, "container_lock_path", return_value=Path(tempdir) / "web.lock"):
+                with mock.patch.object(module.DockerManager, "get_container_info", return_value={}):
+                    with mock.patch.object(module.DockerManager, "_run", side_effect=fake_run):
+                        with mock.patch.object(module.DockerManager, "wait_container_ready", return_value=True):
+                            with mock.patch.object(module.DockerManager, "cleanup_image_if_unused"):
+                                results = module.DockerManager.recover_interrupted_updates()
+
+            self.assertEqual(journal.get_incomplete(), [])
+            self.assertEqual(journal.get_operation(op_id)["state"], "healthy")
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["interrupted_state"], "removed")
+        self.assertEqual(results[0]["state"], "healthy")
+        run_commands = [command for command in calls if command[:2] == ["docker", "run"]]
+        self.assertEqual(len(run_commands), 1)
+        self.assertEqual(run_commands[0][-1], "demo:latest")
+
+    def test_failed_recovery_keeps_backup_tag_for_manual_rollback(self):
+        module = load_monitor_module()
+        calls = []
+
+        def fake_run(command, timeout=30):
+            calls.append(command)
+            return mock.Mock(returncode=0, stdout="", stderr="")
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            journal = module.UpdateJournal(Path(tempdir) / "journal.json")
+            op_id = journal.begin("web", "recreate", {
+                "image": "demo:latest",
+                "old_image_id": "sha256:old",
+                "container_config": {"Config": {"Image": "demo:latest"}, "HostConfig": {}, "Mounts": []},
+            })
+            journal.advance(op_id, "backup_tagged", backup_tag="watchtower-rollback/web:1")
+            journal.advance(op_id, "removed", new_image_id="sha256:new")
+            module.DockerManager.update_journal = journal
+
+            with mock.patch.object(module, "container_lock_path", return_value=Path(tempdir) / "web.lock"), \
+                 mock.patch.object(module.DockerManager, "get_container_info", return_value={}), \
+                 mock.patch.object(module.DockerManager, "_run", side_effect=fake_run), \
+                 mock.patch.object(module.DockerManager, "wait_container_ready", return_value=False), \
+                 mock.patch.object(module.DockerManager, "cleanup_image_if_unused"):
+                results = module.DockerManager.recover_interrupted_updates()
+
+        self.assertEqual(results[0]["state"], "failed")
+        self.assertIn("watchtower-rollback/web:1", results[0]["message"])
+        self.assertNotIn(["docker", "image", "rm", "watchtower-rollback/web:1"], calls)
+
+    def test_step_timing_store_derives_bounded_timeouts_and_flags_regression(self):
+        module = load_monitor_module()
+        with tempfile.TemporaryDirectory() as tempdir:
+            store = module.StepTimingStore(Path(tempdir) / "timings.json")
+            self.assertEqual(store.timeout_for("web", "ready", 90), 90)
+
+            for duration in [4.0, 5.0, 6.0]:
+                store.record("web", "ready", duration)
+            self.assertEqual(store.timeout_for("web", "ready", 90), module.ADAPTIVE_TIMEOUT_MIN)
+
+            for duration in [100.0, 110.0, 120.0]:
+                store.record("jvm", "ready", duration)
+            self.assertEqual(
+                store.timeout_for("jvm", "ready", 90),
+                int(module.percentile([100.0, 110.0, 120.0], module.ADAPTIVE_TIMEOUT_PERCENTILE)
+                    * module.ADAPTIVE_TIMEOUT_MARGIN),
+            )
+
+            self.assertIsNone(store.check_regression("web", "ready", 6.5))
+            self.assertIn("5.0s", store.check_regression("web", "ready", 30.0))
+
+            module.DockerManager.step_timings = store
+            result = {}
+            clock = [1000.0]
+
+            def fake_wait(container, timeout=90):
+                clock[0] += 30.0
+                return True
+
+            with mock.patch.object(module.DockerManager, "wait_container_ready", side_effect=fake_wait):
+                with mock.patch.object(module.time, "time", side_effect=lambda: clock[0]):
+                    self.assertTrue(module.DockerManager._wait_ready_timed("web", result))
+
+        self.assertEqual(result["timings"], {"ready": 30.0})
+        self.assertIn("timing_alert", result)
+
+    def test_pull_timing_excludes_retry_sleeps_and_records_timeouts_as_censored(self):
+        module = load_monitor_module()
+        clock = [1000.0]
+        outcomes = iter([(20.0, 1, "Get https://registry-1.docker.io/v2/: i/o timeout"), (30.0, 0, "")])
+
+        def fake_run(command, timeout=30):
+            if command[:2] == ["docker", "pull"]:
+                elapsed, returncode, stderr = next(outcomes)
+                clock[0] += elapsed
+                if returncode is None:
+                    raise subprocess.TimeoutExpired(command, timeout)
+                return mock.Mock(returncode=returncode, stdout="", stderr=stderr)
+            return mock.Mock(returncode=0, stdout="sha256:new\n", stderr="")
+
+        with mock.patch.object(module.DockerManager, "_run", side_effect=fake_run), \
+             mock.patch.object(module.time, "time", side_effect=lambda: clock[0]), \
+             mock.patch.object(module.time, "sleep", side_effect=lambda seconds: clock.__setitem__(0, clock[0] + seconds)):
+            pulled = module.DockerManager.pull_image("demo:latest", timeout=60)
+            self.assertTrue(pulled["success"])
+            self.assertEqual(pulled["attempt_seconds"], 30.0)
+
+            outcomes = iter([(60.0, None, "")])
+            timed_out = module.DockerManager.pull_image("demo:latest", timeout=60)
+        self.assertTrue(timed_out["timed_out"])
+        self.assertEqual(timed_out["attempt_seconds"], 60.0)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            store = module.StepTimingStore(Path(tempdir) / "timings.json")
+            for duration in [10.0, 12.0]:
+                store.record("web", "pull", duration)
+            store.record("web", "pull", 600.0, censored=True)
+            self.assertEqual(store.get_samples("web", "pull"), [10.0, 12.0])
+            self.assertGreaterEqual(store.timeout_for("web", "pull", 300), 600)
+
+    def test_post_update_observation_is_opt_in(self):
+        module = load_monitor_module()
+        self.assertEqual(module.POST_UPDATE_OBSERVE_SECONDS, 0)
+        with mock.patch.object(module.DockerManager, "collect_resource_profile") as collect:
+            self.assertEqual(module.DockerManager._collect_update_baseline("web"), {})
+            self.assertIsNone(module.DockerManager._observe_post_update("web", {"samples": 2}, {}))
+        collect.assert_not_called()
+
+    def test_compose_update_rolls_back_on_post_update_memory_regression(self):
+        module = load_monitor_module({"POST_UPDATE_OBSERVE_SECONDS": "60"})
+        compose_metadata = {
+            "project": "demo",
+            "service": "web",
+            "working_dir": "/srv/demo",
+            "config_files": [],
+            "oneoff": False,
+        }
+        old_info = {"image": "demo:latest", "image_id": "sha256:old"}
+        baseline = {
+            "samples": 2,
+            "cpu_percent": 2.0,
+            "memory_bytes": 100 * 1024 * 1024,
+            "restart_count_start": 0,
+            "restart_count": 0,
+            "running": True,
+        }
+        observed = dict(baseline, memory_bytes=400 * 1024 * 1024)
+        calls = []
+
+        def fake_run(command, timeout=30):
+            calls.append(command)
+            return mock.Mock(returncode=0, stdout="", stderr="")
+
+        with mock.patch.object(module.DockerManager, "validate_compose_metadata", return_value=None):
+            with mock.patch.object(module.DockerManager, "_run", side_effect=fake_run):
+                with mock.patch.object(module.DockerManager, "get_image_id", return_value="sha256:new"):
+                    with mock.patch.object(module.DockerManager, "wait_container_ready", return_value=True):
+                        with mock.patch.object(module.DockerManager, "collect_resource_profile", side_effect=[baseline, observed]):
+                            with mock.patch.object(module.DockerManager, "_format_version_info", return_value="latest (old)"):
+                                result = module.DockerManager._update_compose_container(
+                                    "web-1",
+                                    {},
+                                    old_info,
+                                    compose_metadata,
+                                )
+
+        self.assertFalse(result["success"])
+        self.assertIn("性能回退", result["message"])
+        self.assertIn("已自动回滚", result["message"])
+        self.assertIn(["docker", "image", "tag", "sha256:old", "demo:latest"], calls)
+        up_calls = [command for command in calls if command[:2] == ["docker", "compose"] and "up" in command]
+        self.assertEqual(len(up_calls), 2)
+
+    def test_resource_profile_skips_failed_samples_and_warmup_cpu(self):
+        module = load_monitor_module()
+        clock = [1000.0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        def sample(cpu):
+            return {"cpu_percent": cpu, "memory_bytes": 100, "restart_count": 0, "running": True}
+
+        samples = iter([sample(90.0), {}, sample(4.0), {}, sample(6.0)])
+        with mock.patch.object(module.DockerManager, "sample_container_resources", side_effect=lambda _: next(samples)), \
+             mock.patch.object(module.DockerManager, "get_container_inspect", return_value={"State": {"Running": True}}), \
+             mock.patch.object(module.time, "time", side_effect=lambda: clock[0]), \
+             mock.patch.object(module.time, "sleep", side_effect=sleep), \
+             mock.patch.object(module, "PERF_SAMPLE_INTERVAL", 5):
+            profile = module.DockerManager.collect_resource_profile("web", 21, warmup=10)
+
+        self.assertEqual(profile["samples"], 3)
+        self.assertEqual(profile["failed_samples"], 2)
+        self.assertEqual(profile["cpu_percent"], 5.0)
+
+        with mock.patch.object(module.DockerManager, "sample_container_resources", return_value={}), \
+             mock.patch.object(module.DockerManager, "get_container_inspect", return_value={"State": {"Running": True}}), \
+             mock.patch.object(module.time, "sleep"):
+            profile = module.DockerManager.collect_resource_profile("web", 0)
+        self.assertEqual(profile, {"samples": 0, "failed_samples": 1, "running": True})
+
+        with mock.patch.object(module.DockerManager, "sample_container_resources", return_value={}), \
+             mock.patch.object(module.DockerManager, "get_container_inspect", return_value={}), \
+             mock.patch.object(module.time, "sleep") as sleep_mock:
+            profile = module.DockerManager.collect_resource_profile("web", 60)
+        sleep_mock.assert_not_called()
+        self.assertFalse(profile["running"])
+
+    def test_detect_performance_regression_thresholds(self):
+        module = load_monitor_module()
+        baseline = {"cpu_percent": 5.0, "memory_bytes": 200 * 1024 * 1024}
+        steady = {
+            "cpu_percent": 6.0,
+            "memory_bytes": 210 * 1024 * 1024,
+            "restart_count_start": 0,
+            "restart_count": 0,
+            "running": True,
+        }
+        self.assertIsNone(module.DockerManager.detect_performance_regression(baseline, steady))
+        self.assertIn("CPU", module.DockerManager.detect_performance_regression(
+            baseline, dict(steady, cpu_percent=40.0)
+        ))
+        self.assertIn("重启", module.DockerManager.detect_performance_regression(
+            baseline, dict(steady, restart_count=2)
+        ))
+        self.assertIsNone(module.DockerManager.detect_performance_regression(baseline, {}))
+        self.assertIsNone(module.DockerManager.detect_performance_regression(
+            baseline, {"samples": 0, "running": True}
+        ))
+        self.assertIn("已停止", module.DockerManager.detect_performance_regression(
+            baseline, {"samples": 0, "running": False}
+        ))
+        self.assertEqual(module.parse_byte_size("1.5GiB"), int(1.5 * 1024 ** 3))
+
+    def test_cgroup_sampler_computes_deltas_from_cgroup_files(self):
+        module = load_monitor_module()
+        with tempfile.TemporaryDirectory() as tempdir:
+            root = Path(tempdir)
+            (root / "cgroup.controllers").write_text("cpu memory io", encoding="utf-8")
+            scope = root / "system.slice" / "docker-abc123.scope"
+            scope.mkdir(parents=True)
+
+            def write_counters(cpu_usec, memory, rbytes, wbytes):
+                (scope / "cpu.stat").write_text(f"usage_usec {cpu_usec}\nuser_usec 0\n", encoding="utf-8")
+                (scope / "memory.current").write_text(f"{memory}\n", encoding="utf-8")
+                (scope / "memory.stat").write_text("anon 1\ninactive_file 1000\n", encoding="utf-8")
+                (scope / "io.stat").write_text(f"8:0 rbytes={rbytes} wbytes={wbytes} rios=1 wios=1\n", encoding="utf-8")
+
+            write_counters(1_000_000, 11_000, 0, 0)
+            sampler = module.CgroupResourceSampler(root)
+            self.assertTrue(sampler.available())
+            self.assertEqual(sampler.resolve_path("abc123"), scope)
+
+            clock = [100.0]
+            with mock.patch.object(module.time, "monotonic", side_effect=lambda: clock[0]):
+                def settle(_seconds):
+                    clock[0] += 2.0
+                    write_counters(2_000_000, 21_000, 4096, 8192)
+
+                with mock.patch.object(module.time, "sleep", side_effect=settle):
+                    samples = sampler.sample({"abc123": "web"})
+
+        self.assertEqual(len(samples), 1)
+        self.assertEqual(samples[0]["name"], "web")
+        self.assertAlmostEqual(samples[0]["cpu_percent"], 50.0)
+        self.assertEqual(samples[0]["memory_bytes"], 20_000)
+        self.assertAlmostEqual(samples[0]["io_read_bps"], 2048.0)
+        self.assertAlmostEqual(samples[0]["io_write_bps"], 4096.0)
+
+    def test_cgroup_sampler_keeps_baselines_across_partial_calls_and_prunes_by_age(self):
+        module = load_monitor_module()
+        with tempfile.TemporaryDirectory() as tempdir:
+            root = Path(tempdir)
+            (root / "cgroup.controllers").write_text("cpu memory io", encoding="utf-8")
+            for container_id in ("aaa", "bbb"):
+                scope = root / "system.slice" / f"docker-{container_id}.scope"
+                scope.mkdir(parents=True)
+                (scope / "cpu.stat").write_text("usage_usec 0\n", encoding="utf-8")
+                (scope / "memory.current").write_text("0\n", encoding="utf-8")
+
+            sampler = module.CgroupResourceSampler(root, max_sample_age=30)
+            clock = [100.0]
+            with mock.patch.object(module.time, "monotonic", side_effect=lambda: clock[0]), \
+                 mock.patch.object(module.time, "sleep", side_effect=lambda seconds: clock.__setitem__(0, clock[0] + seconds)):
+                sampler.sample({"aaa": "web", "bbb": "db"})
+                clock[0] += 5
+                sampler.sample({"aaa": "web"})
+                self.assertEqual(set(sampler._previous), {"aaa", "bbb"})
+
+                clock[0] += 40
+                sampler.sample({"aaa": "web"})
+
+        self.assertEqual(set(sampler._previous), {"aaa"})
+        self.assertEqual(set(sampler._paths), {"aaa"})
+
+    def test_run_rpc_top_sorts_heaviest_containers_first(self):
+        module = load_monitor_module()
+        usage = {
+            "source": "cgroup",
+            "containers": [
+                {"name": "idle", "cpu_percent": 0.1, "memory_bytes": 10},
+                {"name": "busy", "cpu_percent": 80.0, "memory_bytes": 20},
+                {"name": "mid", "cpu_percent": 5.0, "memory_bytes": 30},
+            ],
+        }
+        with mock.patch.object(module.DockerManager, "get_resource_usage", return_value=usage):
+            stdout = io.StringIO()
+            with mock.patch("sys.stdout", stdout):
+                exit_code = module.run_rpc(["top", "--limit", "2"])
+
+        self.assertEqual(exit_code, 0)
+        payload = json.loads(stdout.getvalue().strip())
+        self.assertEqual(payload["source"], "cgroup")
+        self.assertEqual([item["name"] for item in payload["containers"]], ["busy", "mid"])
+        self.assertEqual(payload["total_containers"], 3)
+
+    def test_readiness_probe_resolves_label_and_measures_tcp_latency(self):
+        module = load_monitor_module(
+            {"READINESS_PROBES_JSON": json.dumps({"worker": "log:ready", "broken": "ftp://x"})}
+        )
+        self.assertEqual(module.readiness_probes(), {"worker": {"type": "log", "pattern": "ready"}})
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        port = listener.getsockname()[1]
+        container_config = {
+            "Config": {"Labels": {"watchtower-monitor.readiness": f"tcp://{{ip}}:{port}"}},
+            "NetworkSettings": {"Networks": {"bridge": {"IPAddress": "127.0.0.1"}}},
+        }
+        try:
+            probe = module.DockerManager.get_readiness_probe("web", container_config)
+            self.assertEqual(probe, {"type": "tcp", "host": "127.0.0.1", "port": port})
+            outcome = module.DockerManager.run_readiness_probe("web", probe, 5, container_config)
+        finally:
+            listener.close()
+
+        self.assertTrue(outcome["success"])
+        self.assertEqual(outcome["attempts"], 1)
+        self.assertIsNotNone(outcome["latency_ms"])
+
+    def test_failed_readiness_probe_rolls_back_update(self):
+        module = load_monitor_module()
+        container_config = {
+            "Config": {
+                "Image": "demo:latest",
+                "Labels": {"watchtower-monitor.readiness": "http://127.0.0.1:9/ready"},
+            },
+            "HostConfig": {"NetworkMode": "bridge"},
+            "Mounts": [],
+        }
+        probe_outcome = {
+            "type": "http", "target": "http://127.0.0.1:9/ready", "success": False,
+            "attempts": 3, "latency_ms": None, "detail": "HTTP 503", "elapsed": 3.0,
+        }
+        run_result = mock.Mock(returncode=0, stdout="", stderr="")
+        with mock.patch.object(module.DockerManager, "get_container_info", return_value={
+            "image": "demo:latest", "image_id": "sha256:old", "running": True, "health": None,
+        }), \
+             mock.patch.object(module.DockerManager, "get_container_inspect", return_value=container_config), \
+             mock.patch.object(module.DockerManager, "_run", return_value=run_result), \
+             mock.patch.object(module.DockerManager, "pull_image", return_value={"success": True, "image_id": "sha256:new"}), \
+             mock.patch.object(module.DockerManager, "wait_container_ready", return_value=True), \
+             mock.patch.object(module.DockerManager, "run_readiness_probe", return_value=probe_outcome), \
+             mock.patch.object(module.DockerManager, "_format_version_info", return_value="latest"):
+            result = module.DockerManager._update_container_internal("web", None)
+
+        self.assertFalse(result["success"])
+        self.assertEqual(result["readiness_error"], "就绪探测未通过 (http): HTTP 503")
+        self.assertIn("已自动回滚到旧镜像", result["message"])
+        self.assertFalse(result["probe"]["success"])
+
+    def test_quiet_moment_planner_waits_for_lowest_observed_load(self):
+        module = load_monitor_module()
+        planner = module.QuietMomentPlanner(100, 10, quiet_cpu=1.0, quiet_net_kbps=4.0)
+        clock = [1000.0]
+        readings = iter([
+            {"cpu_percent": 40.0, "net_bytes": 0},
+            {"cpu_percent": 30.0, "net_bytes": 1024 * 500},
+            {"cpu_percent": 20.0, "net_bytes": 1024 * 600},
+            {"cpu_percent": 25.0, "net_bytes": 1024 * 900},
+            {"cpu_percent": 35.0, "net_bytes": 1024 * 1500},
+            {"cpu_percent": 15.0, "net_bytes": 1024 * 1550},
+        ])
+
+        def advance(seconds):
+            clock[0] += seconds
+
+        with mock.patch.object(module.time, "time", side_effect=lambda: clock[0]), \
+             mock.patch.object(module.time, "sleep", side_effect=advance):
+            schedule = planner.wait(lambda: next(readings))
+
+        self.assertEqual(schedule["reason"], "quietest")
+        self.assertEqual(schedule["waited"], 50.0)
+        self.assertEqual(schedule["cpu_percent"], 15.0)
+        self.assertAlmostEqual(schedule["net_kbps"], 5.0)
+        self.assertEqual(schedule["peak_cpu"], 35.0)
+        self.assertAlmostEqual(schedule["peak_net_kbps"], 60.0)
+        self.assertIn("窗口内最安静时刻", module.render_update_diagnostics({"schedule": schedule}))
+
+        deadline_planner = module.QuietMomentPlanner(30, 10, quiet_cpu=1.0, quiet_net_kbps=4.0)
+        with mock.patch.object(module.time, "time", side_effect=lambda: clock[0]), \
+             mock.patch.object(module.time, "sleep", side_effect=advance):
+            schedule = deadline_planner.wait(lambda: {})
+        self.assertEqual(schedule["reason"], "deadline")
+        self.assertEqual(schedule["samples"], 0)
+
+    def test_rpc_update_completes_when_client_disconnects_mid_update(self):
+        module = load_monitor_module()
+        completed = []
+
+        def update_container(container, progress_callback=None):
+            for message in ("📥 正在拉取镜像...", "🚀 正在启动新容器...", "🩺 正在检查就绪状态..."):
+                progress_callback(message)
+            completed.append(container)
+            return {"success": True, "message": "更新成功"}
+
+        docker = mock.Mock()
+        docker.update_container.side_effect = update_container
+
+        class DisconnectingStream(io.StringIO):
+            def write(self, text):
+                if self.getvalue():
+                    raise BrokenPipeError("client went away")
+                return super().write(text)
+
+        stdout = DisconnectingStream()
+        stdin = io.StringIO(json.dumps({"id": 1, "args": ["update", "--container", "demo"]}) + "\n")
+        parser = module.build_rpc_parser()
+        self.assertEqual(module.serve_rpc_session(parser, docker, mock.Mock(), "srv", stdin, stdout), 0)
+        self.assertEqual(completed, ["demo"])
+        self.assertEqual(len(stdout.getvalue().splitlines()), 1)
+
+        def broken_emit(event):
+            raise BrokenPipeError("ssh channel closed")
+
+        args = parser.parse_args(["update-batch", "--containers", "a,b"])
+        payload = module.execute_rpc(args, docker, mock.Mock(), "srv", broken_emit)
+        self.assertTrue(payload["ok"])
+        self.assertTrue(all(result["success"] for result in payload["results"].values()))
+        self.assertEqual(sorted(completed), ["a", "b", "demo"])
+
+    def test_rpc_serve_answers_json_lines_requests_with_ids(self):
+        module = load_monitor_module()
+        stdin = io.StringIO(
+            json.dumps({"id": "a", "args": ["ping"]}) + "\n"
+            + "not json\n"
+            + json.dumps({"id": "b", "args": ["restart"]}) + "\n"
+        )
+        stdout = io.StringIO()
+        with mock.patch.object(module, "resolve_update_mode", return_value="independent"), \
+             mock.patch("sys.stderr", io.StringIO()):
+            exit_code = module.serve_rpc_session(
+                module.build_rpc_parser(), mock.Mock(), mock.Mock(), "test-server", stdin, stdout
+            )
+
+        self.assertEqual(exit_code, 0)
+        responses = {item["id"]: item["payload"] for item in map(json.loads, stdout.getvalue().splitlines())}
+        self.assertTrue(responses["a"]["ok"])
+        self.assertEqual(responses["a"]["mode"], "independent")
+        self.assertFalse(responses[None]["ok"])
+        self.assertIn("无效的 RPC 参数", responses["b"]["error"])
+
+    def test_remote_rpc_session_multiplexes_and_reconnects(self):
+        module = load_monitor_module()
+        server_script = (
+            "import json, sys, threading, time\n"
+            "def handle(request):\n"
+            "    time.sleep(0.3 if request['args'][0] == 'slow' else 0)\n"
+            "    sys.stdout.write(json.dumps({'id': request['id'], 'payload': {'ok': True, 'args': request['args']}}) + '\\n')\n"
+            "    sys.stdout.flush()\n"
+            "for line in sys.stdin:\n"
+            "    threading.Thread(target=handle, args=(json.loads(line),)).start()\n"
+        )
+        session = module.RemoteRPCSession("srv", [sys.executable, "-c", server_script])
+        results = {}
+
+        def call(name):
+            results[name] = session.request([name], timeout=5)
+
+        try:
+            slow = threading.Thread(target=call, args=("slow",))
+            slow.start()
+            time.sleep(0.05)
+            call("fast")
+            self.assertNotIn("slow", results)
+            slow.join()
+            self.assertEqual(results["slow"]["args"], ["slow"])
+
+            first_process = session._process
+            session.close()
+            self.assertEqual(session.request(["again"], timeout=5)["args"], ["again"])
+            self.assertIsNot(session._process, first_process)
+        finally:
+            session.close()
+
+    def test_session_rpc_keeps_session_on_timeout_and_marks_legacy_servers(self):
+        module = load_monitor_module()
+        registry = mock.Mock()
+        registry.get_active_servers.return_value = []
+        controller = module.RemoteServerController("local", mock.Mock(), mock.Mock(), registry)
+        config = {"command_timeout": 5}
+        server_script = (
+            "import json, sys, threading, time\n"
+            "def handle(request):\n"
+            "    time.sleep(1 if request['args'][0] == 'top' else 0)\n"
+            "    sys.stdout.write(json.dumps({'id': request['id'], 'payload': {'ok': True}}) + '\\n')\n"
+            "    sys.stdout.flush()\n"
+            "for line in sys.stdin:\n"
+            "    threading.Thread(target=handle, args=(json.loads(line),)).start()\n"
+        )
+        modern = module.RemoteRPCSession("srv-new", [sys.executable, "-c", server_script])
+        legacy = module.RemoteRPCSession("srv-old", [sys.executable, "-c", "import sys; sys.exit(2)"])
+        sessions = {"srv-new": modern, "srv-old": legacy}
+
+        try:
+            with mock.patch.object(controller, "_get_rpc_session", side_effect=lambda server, _: sessions[server]):
+                self.assertIsNone(controller._run_session_rpc("srv-new", config, ("top",), 0.2))
+                process = modern._process
+                self.assertTrue(modern.is_alive())
+                self.assertTrue(controller._run_session_rpc("srv-new", config, ("ping",), 5)["ok"])
+                self.assertIs(modern._process, process)
+
+                self.assertIsNone(controller._run_session_rpc("srv-old", config, ("ping",), 5))
+                self.assertIn("srv-old", controller._legacy_session_servers)
+                legacy.command = [sys.executable, "-c", "raise SystemExit('should not start')"]
+                self.assertIsNone(controller._run_session_rpc("srv-old", config, ("ping",), 5))
+                self.assertIsNone(legacy._process)
+        finally:
+            modern.close()
+            legacy.close()
+
+    def test_run_rpc_update_batch_streams_progress_events_then_summary(self):
+        module = load_monitor_module()
+
+        def fake_update(container, progress_callback=None):
+            progress_callback(f"pulling {container}")
+            return {"success": container != "b", "message": "boom" if container == "b" else "ok"}
+
+        stdout = io.StringIO()
+        with mock.patch.object(module.DockerManager, "update_container", side_effect=fake_update), \
+             mock.patch("sys.stdout", stdout):
+            exit_code = module.run_rpc(["update-batch", "--containers", "a,b", "--concurrency", "2"])
+
+        self.assertEqual(exit_code, 0)
+        lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        events = [line for line in lines[:-1] if "event" in line]
+        self.assertEqual(len(events), 6)
+        self.assertIn({"event": "progress", "container": "a", "message": "pulling a"}, events)
+        summary = lines[-1]
+        self.assertTrue(summary["ok"])
+        self.assertEqual(list(summary["results"]), ["a", "b"])
+        self.assertFalse(summary["results"]["b"]["success"])
+
+    def test_multi_select_keyboard_runs_batch_with_live_progress(self):
+        module = load_monitor_module()
+        bot = mock.Mock()
+        bot.server_name = "local"
+        registry = mock.Mock()
+        registry.get_active_servers.return_value = []
+        registry.registry_file = Path("/tmp/server_registry.json")
+        docker = mock.Mock()
+        docker.list_containers.return_value = ["web", "db"]
+        docker.restart_container.side_effect = lambda name: name == "web"
+        handler = module.CommandHandler(bot, docker, mock.Mock(), registry)
+
+        with mock.patch.object(handler, "_get_server_containers", return_value=["db", "web"]), \
+             mock.patch.object(handler, "_run_async", side_effect=lambda target, *args: target(*args)), \
+             mock.patch.object(module.time, "sleep"):
+            handler.handle_callback("sel:restart:local:web", "q1", "1", "9")
+            text, buttons = bot.edit_message.call_args[0][2:4]
+            self.assertEqual(buttons["inline_keyboard"][1][0]["text"], "☑️ web")
+            self.assertEqual(buttons["inline_keyboard"][2][1]["text"], "✅ 重启所选 (1)")
+            handler.handle_callback("selall:restart:local", "q2", "1", "9")
+            handler.handle_callback("batch:restart:local", "q3", "1", "9")
+            self.assertIn("确认批量重启", bot.edit_message.call_args[0][2])
+            handler.handle_callback("batch_ok:restart:local", "q4", "1", "9")
+
+        final_text = bot.edit_message.call_args[0][2]
+        self.assertIn("批量重启完成（部分失败）", final_text)
+        self.assertIn("成功 1 · 失败 1", final_text)
+        self.assertEqual(handler._batch_selections, {})
+
+    def test_selections_are_per_message_and_single_pick_uses_single_flow(self):
+        module = load_monitor_module()
+        bot = mock.Mock()
+        bot.server_name = "local"
+        registry = mock.Mock()
+        registry.get_active_servers.return_value = []
+        registry.registry_file = Path("/tmp/server_registry.json")
+        handler = module.CommandHandler(bot, mock.Mock(), mock.Mock(), registry)
+
+        with mock.patch.object(handler, "_get_server_containers", return_value=["db", "web"]):
+            handler.handle_callback("sel:restart:local:web", "q1", "1", "9")
+            handler.handle_callback("sel:restart:local:db", "q2", "2", "7")
+            self.assertEqual(handler._batch_selections["1:9:restart:local"], {"web"})
+            self.assertEqual(handler._batch_selections["2:7:restart:local"], {"db"})
+
+            handler.handle_callback("batch:restart:local", "q3", "1", "9")
+            text, buttons = bot.edit_message.call_args[0][2:4]
+            self.assertIn("确认重启", text)
+            self.assertEqual(buttons["inline_keyboard"][0][0]["callback_data"], "confirm_restart:local:web")
+
+            handler.handle_callback("cancel", "q4", "2", "7")
+        self.assertEqual(handler._batch_selections, {})
+
+    def test_agent_transport_serves_rpc_between_two_local_instances(self):
+        agent_module = load_monitor_module({"SERVER_NAME": "srv-agent"})
+        docker = mock.Mock()
+
+        def fake_update(container, progress_callback=None):
+            progress_callback("拉取镜像")
+            return {"success": True, "old_version": "v1", "new_version": "v2", "message": "ok"}
+
+        docker.update_container.side_effect = fake_update
+        agent = agent_module.AgentServer(("127.0.0.1", 0), "secret", docker, mock.Mock(), "srv-agent")
+        agent.start()
+        try:
+            host, port = agent.address
+            remote_servers = json.dumps([
+                {"name": "srv-agent", "transport": "agent", "url": f"http://{host}:{port}", "token": "secret"},
+                {"name": "srv-bad", "transport": "agent", "url": f"http://{host}:{port}", "token": "wrong"},
+            ])
+            module = load_monitor_module({"REMOTE_SERVERS_JSON": remote_servers})
+            registry = mock.Mock()
+            registry.get_active_servers.return_value = []
+            controller = module.RemoteServerController("local", mock.Mock(), mock.Mock(), registry)
+
+            self.assertTrue(controller.uses_rpc("srv-agent"))
+            self.assertFalse(controller.uses_queue("srv-agent"))
+            self.assertEqual(controller.get_available_servers(), ["local", "srv-agent"])
+
+            events = []
+            payload = controller.execute_action("confirm_update", "srv-agent", "demo", events.append)
+            self.assertTrue(payload["result"]["success"])
+            self.assertEqual(events, [{"event": "progress", "container": "demo", "message": "拉取镜像"}])
+            self.assertEqual(payload["connection"]["transport"], "agent")
+
+            for _ in range(3):
+                self.assertEqual(controller._run_remote_rpc("srv-agent", "ping")["server_name"], "srv-agent")
+            self.assertEqual(agent.connections, 2)
+
+            with self.assertRaisesRegex(RuntimeError, "认证失败"):
+                controller._run_remote_rpc("srv-bad", "ping")
+        finally:
+            agent.stop()
+
+    def test_run_rpc_forwards_to_daemon_control_socket_and_falls_back(self):
+        module = load_monitor_module()
+        docker = mock.Mock()
+
+        def fake_update(container, progress_callback=None):
+            progress_callback("拉取镜像")
+            return {"success": True, "message": "ok"}
+
+        docker.update_container.side_effect = fake_update
+        with tempfile.TemporaryDirectory() as tmpdir:
+            socket_path = Path(tmpdir) / "control.sock"
+            control = module.ControlSocketServer(socket_path, docker, mock.Mock(), "daemon")
+            self.assertTrue(control.start())
+            try:
+                stdout = io.StringIO()
+                with mock.patch.object(module, "RPC_CONTROL_SOCKET", socket_path), \
+                     mock.patch.object(module, "DockerManager", side_effect=AssertionError("cold start")), \
+                     mock.patch("sys.stdout", stdout):
+                    exit_code = module.run_rpc(["update", "--container", "demo"])
+            finally:
+                control.stop()
+
+            self.assertEqual(exit_code, 0)
+            lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+            self.assertEqual(lines[0], {"event": "progress", "container": "demo", "message": "拉取镜像"})
+            self.assertEqual(lines[-1]["server_name"], "daemon")
+            self.assertTrue(lines[-1]["result"]["success"])
+            self.assertFalse(socket_path.exists())
+
+            stdout = io.StringIO()
+            with mock.patch.object(module, "RPC_CONTROL_SOCKET", socket_path), \
+                 mock.patch.object(module, "resolve_update_mode", return_value="independent"), \
+                 mock.patch("sys.stdout", stdout):
+                self.assertEqual(module.run_rpc(["ping"]), 0)
+            self.assertEqual(json.loads(stdout.getvalue())["server_name"], "test-server")
+
+    def test_rpc_ping_startup_stays_within_budget(self):
+        # 只用于发现明显退化的宽松上限（秒），导入清单才是主要约束
+        startup_budget = 3.0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            env = dict(
+                os.environ,
+                DATA_DIR=tmpdir,
+                SERVER_NAME="bench",
+                UPDATE_SOURCE="independent",
+                RPC_CONTROL_SOCKET=str(Path(tmpdir) / "missing.sock"),
+            )
+
+            def run(*args):
+                started_at = time.perf_counter()
+                result = subprocess.run([sys.executable, *args], env=env, capture_output=True, text=True, timeout=30)
+                return result, time.perf_counter() - started_at
+
+            baseline = min(run("-c", "pass")[1] for _ in range(3))
+            elapsed = min(run(str(MODULE_PATH), "rpc", "ping")[1] for _ in range(3))
+            result, _ = run("-X", "importtime", str(MODULE_PATH), "rpc", "ping")
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertTrue(json.loads(result.stdout.strip().splitlines()[-1])["ok"])
+
+        imports = {}
+        for line in result.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                _, cumulative, name = line.split("|")
+                if cumulative.strip().isdigit():
+                    imports[name.strip()] = int(cumulative)
+        report = "\n".join(
+            f"{us / 1000:8.1f} ms  {name}" for name, us in sorted(imports.items(), key=lambda item: -item[1])[:10]
+        )
+        for heavy in ("requests", "http.server", "concurrent.futures", "ctypes"):
+            self.assertNotIn(heavy, imports, report)
+        self.assertLess(elapsed - baseline, startup_budget, f"rpc ping 启动 {elapsed:.3f}s\n{report}")
+
     def test_run_rpc_inventory_emits_json_payload(self):
         module = load_monitor_module()
         inventory_payload = {